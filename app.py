@@ -1,9 +1,13 @@
 import streamlit as st
 import os
+import uuid
 from dotenv import load_dotenv
-from graph import build_recipe_agent_graph
-from state import RecipeAgentState
-import time
+from resources import (get_embeddings, get_job_queue, get_job_store, get_llm_scheduler, get_prewarmer,
+                       get_recipe_cache, resource_stats)
+from cache import get_search_cache
+from coalesce import coalescing_stats
+from jobs import FAILED, FINISHED, JOB_POLL_INTERVAL_S, SUBMITTED
+from prewarm import SUGGESTIONS_BY_LANG
 from langdetect import detect
 import langdetect.lang_detect_exception
 
@@ -62,14 +66,6 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Initialize session state
-if 'messages' not in st.session_state:
-    st.session_state.messages = []
-if 'app' not in st.session_state:
-    st.session_state.app = build_recipe_agent_graph()
-if 'user_language' not in st.session_state:
-    st.session_state.user_language = 'en'
-
 def detect_language(text):
     """Detect the language of the input text"""
     try:
@@ -104,123 +100,143 @@ def display_message(message, is_user=True):
         with st.chat_message("assistant"):
             st.write(message)
 
-def process_recipe_request(user_desire, dietary_preferences):
-    """Process the recipe request using the LangGraph agent"""
-    
-    # Detect user language
-    detected_lang = detect_language(user_desire)
-    st.session_state.user_language = detected_lang
-    language_name = get_language_name(detected_lang)
+# Status shown while each node is running, keyed by node name and language
+NODE_STATUS_MESSAGES = {
+    'queued': {
+        'it': "⏳ In attesa di uno chef libero...",
+        'en': "⏳ Waiting for a free chef...",
+        'fr': "⏳ En attente d'un chef disponible...",
+        'es': "⏳ Esperando a un chef libre...",
+        'de': "⏳ Warten auf einen freien Koch..."
+    },
+    'search_base_recipe': {
+        'it': "🔍 Ricerca ricetta base...",
+        'en': "🔍 Searching for base recipe...",
+        'fr': "🔍 Recherche de la recette de base...",
+        'es': "🔍 Buscando receta base...",
+        'de': "🔍 Suche nach Grundrezept..."
+    },
+    'extract_ingredients': {
+        'it': "📝 Estrazione ingredienti...",
+        'en': "📝 Extracting ingredients...",
+        'fr': "📝 Extraction des ingrédients...",
+        'es': "📝 Extrayendo ingredientes...",
+        'de': "📝 Zutaten extrahieren..."
+    },
+    'search_pairings': {
+        'it': "🍯 Ricerca abbinamenti sapori...",
+        'en': "🍯 Finding flavor pairings...",
+        'fr': "🍯 Recherche d'associations de saveurs...",
+        'es': "🍯 Buscando maridajes de sabores...",
+        'de': "🍯 Geschmackskombinationen finden..."
+    },
+    'generate_recipe': {
+        'it': "👨‍🍳 Generazione ricetta innovativa...",
+        'en': "👨‍🍳 Generating innovative recipe...",
+        'fr': "👨‍🍳 Génération de recette innovante...",
+        'es': "👨‍🍳 Generando receta innovadora...",
+        'de': "👨‍🍳 Innovative Rezept generieren..."
+    },
+    'done': {
+        'it': "✅ Ricetta pronta!",
+        'en': "✅ Recipe ready!",
+        'fr': "✅ Recette prête!",
+        'es': "✅ ¡Receta lista!",
+        'de': "✅ Rezept fertig!"
+    }
+}
+
+# Progress reached when a node completes, and the step that is expected to run next
+NODE_PROGRESS = {
+    'start': (10, 'search_base_recipe'),
+    'search_base_recipe': (35, 'extract_ingredients'),
+    'extract_ingredients': (55, 'search_pairings'),
+    'search_pairings': (75, 'generate_recipe'),
+    'merge_pairings': (75, 'generate_recipe'),
+    'generate_recipe': (100, 'done'),
+    'clarify_input': (100, 'done')
+}
+
+def get_status_message(step, lang_code):
+    """Get the status message of a step in the user's language"""
+    messages = NODE_STATUS_MESSAGES[step]
+    return messages.get(lang_code, messages['it'])
+
+def job_messages(job):
+    """Chat messages of a job: the request, then its outcome once the job has finished"""
+    messages = [{'content': job['request']['text'], 'is_user': True}]
+    result = job['result'] or {}
+    if job['status'] == FAILED:
+        messages.append({'content': f"❌ Errore: Error processing request: {job['error']}", 'is_user': False})
+    elif result.get('final_recipe'):
+        messages.append({
+            'content': result['final_recipe'],
+            'is_user': False,
+            'recipe': True,
+            'request': job['request']['text'],
+            'cached_desire': result.get('cached_desire')
+        })
+    elif result.get('error_message'):
+        messages.append({'content': f"❌ Errore: {result['error_message']}", 'is_user': False})
+    elif job['status'] in FINISHED:
+        messages.append({'content': "I cannot create the recipe you asked. Try to be more specific.", 'is_user': False})
+    return messages
+
+# Initialize session state
+if 'session_id' not in st.session_state:
+    # The session id is kept in the URL, so a page reload finds the session's jobs again
+    st.session_state.session_id = st.query_params.get('session') or uuid.uuid4().hex
+    st.query_params['session'] = st.session_state.session_id
+if 'messages' not in st.session_state:
+    st.session_state.messages = []
+    st.session_state.pending_job = None
+    get_job_queue()  # starts the workers, which pick up jobs cut off by a restart
+    get_prewarmer()  # starts generating the suggestion recipes in the background
+    for job in get_job_store().session_jobs(st.session_state.session_id):
+        st.session_state.messages += job_messages(job)
+        if job['status'] not in FINISHED:
+            st.session_state.pending_job = job['id']
+if 'user_language' not in st.session_state:
+    st.session_state.user_language = 'en'
+
+def submit_recipe_request(user_desire, dietary_preferences, fresh=False, language=None):
+    """
+    Queue the request for the job workers, which run the session's graph (or
+    serve the recipe cache) outside of this script thread. Returns the job id.
+    """
+    return get_job_queue().submit(st.session_state.session_id, {
+        'text': user_desire,
+        'dietary_preferences': dietary_preferences,
+        'language': language or detect_language(user_desire),
+        'fresh': fresh
+    })
+
+@st.fragment(run_every=JOB_POLL_INTERVAL_S)
+def show_job_progress(job_id):
+    """Poll the job of the session, showing its progress and the recipe streamed so far"""
+    job = get_job_store().get(job_id)
+    lang = st.session_state.user_language
     
-    # Initialize state
-    initial_state = RecipeAgentState(
-        messages=[],
-        user_desire=user_desire,
-        dietary_preferences=dietary_preferences,
-        base_recipe_query=None,
-        base_recipe_search_results=None,
-        extracted_ingredients_from_base_recipe=[],
-        pairing_query=None,
-        pairing_results=None,
-        final_recipe=None,
-        error_message=None,
-        retry_count=0,
-        tool_calls=[],
-        tool_results=[],
-        awaiting_user_input=False,
-        user_language=detected_lang  # Add language to state
-    )
+    if job is None or job['status'] in FINISHED:
+        st.session_state.pending_job = None
+        if job is not None:
+            result = job['result'] or {}
+            st.session_state.messages += job_messages(job)[1:]
+            st.session_state.last_request_metrics = result.get('metrics')
+            st.session_state.user_language = result.get('language') or lang
+        # Rerun the whole page to render the outcome in the chat
+        st.rerun()
     
-    # Create progress indicators
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+    if job['status'] == SUBMITTED:
+        st.progress(0)
+        st.text(get_status_message('queued', lang))
+        return
     
-    try:
-        # Update progress with language-specific messages
-        if detected_lang == 'en':
-            status_text.text("🔍 Searching for base recipe...")
-        elif detected_lang == 'fr':
-            status_text.text("🔍 Recherche de la recette de base...")
-        elif detected_lang == 'es':
-            status_text.text("🔍 Buscando receta base...")
-        elif detected_lang == 'de':
-            status_text.text("🔍 Suche nach Grundrezept...")
-        else:
-            status_text.text("🔍 Ricerca ricetta base...")
-        
-        progress_bar.progress(20)
-        
-        # Execute the graph
-        final_state = st.session_state.app.invoke(initial_state)
-        
-        # Update progress
-        if detected_lang == 'en':
-            status_text.text("📝 Extracting ingredients...")
-        elif detected_lang == 'fr':
-            status_text.text("📝 Extraction des ingrédients...")
-        elif detected_lang == 'es':
-            status_text.text("📝 Extrayendo ingredientes...")
-        elif detected_lang == 'de':
-            status_text.text("📝 Zutaten extrahieren...")
-        else:
-            status_text.text("📝 Estrazione ingredienti...")
-        
-        progress_bar.progress(40)
-        time.sleep(0.5)
-        
-        if detected_lang == 'en':
-            status_text.text("🍯 Finding flavor pairings...")
-        elif detected_lang == 'fr':
-            status_text.text("🍯 Recherche d'associations de saveurs...")
-        elif detected_lang == 'es':
-            status_text.text("🍯 Buscando maridajes de sabores...")
-        elif detected_lang == 'de':
-            status_text.text("🍯 Geschmackskombinationen finden...")
-        else:
-            status_text.text("🍯 Ricerca abbinamenti sapori...")
-        
-        progress_bar.progress(60)
-        time.sleep(0.5)
-        
-        if detected_lang == 'en':
-            status_text.text("👨‍🍳 Generating innovative recipe...")
-        elif detected_lang == 'fr':
-            status_text.text("👨‍🍳 Génération de recette innovante...")
-        elif detected_lang == 'es':
-            status_text.text("👨‍🍳 Generando receta innovadora...")
-        elif detected_lang == 'de':
-            status_text.text("👨‍🍳 Innovative Rezept generieren...")
-        else:
-            status_text.text("👨‍🍳 Generazione ricetta innovativa...")
-        
-        progress_bar.progress(80)
-        time.sleep(0.5)
-        
-        progress_bar.progress(100)
-        
-        if detected_lang == 'en':
-            status_text.text("✅ Recipe ready!")
-        elif detected_lang == 'fr':
-            status_text.text("✅ Recette prête!")
-        elif detected_lang == 'es':
-            status_text.text("✅ ¡Receta lista!")
-        elif detected_lang == 'de':
-            status_text.text("✅ Rezept fertig!")
-        else:
-            status_text.text("✅ Ricetta pronta!")
-        
-        # Clear progress indicators
-        time.sleep(1)
-        progress_bar.empty()
-        status_text.empty()
-        
-        return final_state
-        
-    except Exception as e:
-        progress_bar.empty()
-        status_text.empty()
-        st.error(f"Error processing request: {str(e)}")
-        return None
+    progress, next_step = NODE_PROGRESS.get(job['node'], (0, 'search_base_recipe'))
+    st.progress(progress)
+    st.text(get_status_message(next_step, lang))
+    if job['partial']:
+        st.markdown(job['partial'] + "▌")
 
 def main():
     # Header
@@ -276,20 +292,47 @@ def main():
             value=4
         )
         
+        # Recipe cache
+        fresh_recipe = st.checkbox(
+            "Always generate a new recipe",
+            value=False,
+            help="Skip the cache of recipes already generated for similar requests"
+        )
+        
         st.markdown('</div>', unsafe_allow_html=True)
         
         # Clear chat button
         if st.button("🗑️ Clean chat", type="secondary"):
             st.session_state.messages = []
+            st.session_state.pending_job = None
+            st.session_state.session_id = uuid.uuid4().hex
+            st.query_params['session'] = st.session_state.session_id
             st.rerun()
     
     # Main chat interface
     col1, col2 = st.columns([3, 1])
     
     with col1:
-        # Display chat messages
-        for message in st.session_state.messages:
-            display_message(message['content'], message['is_user'])
+        # Display chat messages, the latest recipe in full with its download button
+        for i, message in enumerate(st.session_state.messages):
+            if message.get('recipe') and i == len(st.session_state.messages) - 1:
+                # Display recipe in a nice container
+                st.markdown('<div class="recipe-container">', unsafe_allow_html=True)
+                st.markdown("## 🎉 Your innovative recipe")
+                st.markdown(message['content'])
+                st.markdown('</div>', unsafe_allow_html=True)
+                if message.get('cached_desire'):
+                    st.caption(f"⚡ From the recipe cache, first generated for \"{message['cached_desire']}\"")
+                
+                # Add download button
+                st.download_button(
+                    label="📥 Download recipe",
+                    data=message['content'],
+                    file_name=f"ricetta_{message['request'].replace(' ', '_')}.txt",
+                    mime="text/plain"
+                )
+            else:
+                display_message(message['content'], message['is_user'])
         
         # Chat input with multilingual placeholder
         placeholders = {
@@ -307,7 +350,8 @@ def main():
         }
         
         placeholder = placeholders.get(st.session_state.user_language, placeholders['it'])
-        user_input = st.chat_input(placeholder)
+        # One request at a time per session, the next one may refine its recipe
+        user_input = st.chat_input(placeholder, disabled=st.session_state.pending_job is not None)
         
         if user_input:
             # Add user message to chat
@@ -319,111 +363,28 @@ def main():
             # Display user message
             display_message(user_input, is_user=True)
             
-            # Process the request
-            with st.spinner("Creating your innovative recipe..."):
-                final_state = process_recipe_request(user_input, selected_prefs)
-            
-            if final_state:
-                if final_state.get("final_recipe"):
-                    # Display the recipe
-                    recipe_content = final_state["final_recipe"]
-                    
-                    # Add recipe to chat
-                    st.session_state.messages.append({
-                        'content': recipe_content,
-                        'is_user': False
-                    })
-                    
-                    # Display recipe in a nice container
-                    st.markdown('<div class="recipe-container">', unsafe_allow_html=True)
-                    st.markdown("## 🎉 Your innovative recipe")
-                    st.markdown(recipe_content)
-                    st.markdown('</div>', unsafe_allow_html=True)
-                    
-                    # Add download button
-                    st.download_button(
-                        label="📥 Download recipe",
-                        data=recipe_content,
-                        file_name=f"ricetta_{user_input.replace(' ', '_')}.txt",
-                        mime="text/plain"
-                    )
-                    
-                elif final_state.get("error_message"):
-                    error_msg = final_state["error_message"]
-                    st.session_state.messages.append({
-                        'content': f"❌ Errore: {error_msg}",
-                        'is_user': False
-                    })
-                    
-                    st.markdown('<div class="error-container">', unsafe_allow_html=True)
-                    st.error(f"Errore: {error_msg}")
-                    st.markdown('</div>', unsafe_allow_html=True)
-                    
-                else:
-                    error_msg = "I cannot create the recipe you asked. Try to be more specific."
-                    st.session_state.messages.append({
-                        'content': error_msg,
-                        'is_user': False
-                    })
-                    st.warning(error_msg)
+            # Queue the request, its progress is polled without blocking the page
+            st.session_state.pending_job = submit_recipe_request(user_input, selected_prefs, fresh_recipe)
+        
+        if st.session_state.pending_job is not None:
+            show_job_progress(st.session_state.pending_job)
     
     with col2:
         # Recipe suggestions with multilingual support
         st.markdown("### 💡 Suggestions")
         
-        # Language-specific suggestions
-        suggestions_by_lang = {
-            'it': [
-                "Pasta alla carbonara fusion",
-                "Risotto innovativo", 
-                "Pollo con spezie esotiche",
-                "Dessert al cioccolato creativo",
-                "Insalata gourmet",
-                "Pizza con ingredienti inusuali"
-            ],
-            'en': [
-                "Fusion carbonara pasta",
-                "Innovative risotto",
-                "Chicken with exotic spices", 
-                "Creative chocolate dessert",
-                "Gourmet salad",
-                "Pizza with unusual ingredients"
-            ],
-            'fr': [
-                "Pâtes carbonara fusion",
-                "Risotto innovant",
-                "Poulet aux épices exotiques",
-                "Dessert au chocolat créatif", 
-                "Salade gourmet",
-                "Pizza aux ingrédients inhabituels"
-            ],
-            'es': [
-                "Pasta carbonara fusión",
-                "Risotto innovador",
-                "Pollo con especias exóticas",
-                "Postre de chocolate creativo",
-                "Ensalada gourmet", 
-                "Pizza con ingredientes inusuales"
-            ],
-            'de': [
-                "Fusion Carbonara Pasta",
-                "Innovatives Risotto",
-                "Hähnchen mit exotischen Gewürzen",
-                "Kreatives Schokoladendessert",
-                "Gourmet Salat",
-                "Pizza mit ungewöhnlichen Zutaten"
-            ]
-        }
-        
-        current_suggestions = suggestions_by_lang.get(st.session_state.user_language, suggestions_by_lang['it'])
+        # Language-specific suggestions, their recipes are prewarmed in the recipe cache
+        suggestion_lang = st.session_state.user_language if st.session_state.user_language in SUGGESTIONS_BY_LANG else 'it'
+        current_suggestions = SUGGESTIONS_BY_LANG[suggestion_lang]
         
         for suggestion in current_suggestions:
-            if st.button(suggestion, key=f"suggestion_{suggestion}"):
-                # Simulate clicking the suggestion
+            if st.button(suggestion, key=f"suggestion_{suggestion}", disabled=st.session_state.pending_job is not None):
                 st.session_state.messages.append({
                     'content': suggestion,
                     'is_user': True
                 })
+                # The language is known, detecting it on a few words could miss the prewarmed recipe
+                st.session_state.pending_job = submit_recipe_request(suggestion, selected_prefs, fresh_recipe, suggestion_lang)
                 st.rerun()
         
         # Statistics
@@ -431,6 +392,63 @@ def main():
         st.metric("Recipe created", len([m for m in st.session_state.messages if not m['is_user']]))
         st.metric("Total messages", len(st.session_state.messages))
         
+        last_metrics = st.session_state.get("last_request_metrics")
+        if last_metrics:
+            with st.expander("⏱️ Last request"):
+                st.caption(f"**Total**: {last_metrics['wall_ms'] / 1000:.1f}s")
+                for node, wall_ms in last_metrics['nodes_ms'].items():
+                    st.caption(f"{node}: {wall_ms / 1000:.2f}s")
+                st.caption(f"**LLM tokens**: {last_metrics['prompt_tokens']} prompt, {last_metrics['completion_tokens']} completion")
+                if last_metrics['retrieval_hits']:
+                    hits = ", ".join(f"{source} {count}" for source, count in last_metrics['retrieval_hits'].items())
+                    st.caption(f"**Retrieved passages**: {hits}")
+                for cache, counters in last_metrics['cache'].items():
+                    st.caption(f"**{cache} cache**: {counters['hits']} hits, {counters['misses']} misses")
+        
+        with st.expander("🧠 Shared resources"):
+            stats = resource_stats()
+            st.caption(f"Process memory: {stats['process_rss_mb']} MB")
+            for name, resource in stats['resources'].items():
+                st.caption(f"**{name}**: loaded in {resource['load_time_s']}s, +{resource['rss_delta_mb']} MB")
+            if "llm_scheduler" in stats['resources']:
+                queue = get_llm_scheduler().stats()
+                st.caption(
+                    f"**LLM queue**: {queue['queue_depth']} waiting (max {queue['max_queue_depth']}), "
+                    f"mean wait {queue['mean_wait_ms']} ms, {queue['rate_limited']} rate limited"
+                )
+            if "job_queue" in stats['resources']:
+                jobs = get_job_queue().stats()
+                st.caption(
+                    f"**Recipe jobs**: {jobs['jobs']['running']} running, {jobs['jobs']['submitted']} queued "
+                    f"on {jobs['workers']} {jobs['mode']} workers, {jobs['failed']} failed"
+                )
+        
+        with st.expander("⚡ Caches"):
+            search_stats = get_search_cache().stats()
+            st.caption(f"**Web search**: {search_stats['hit_rate']:.0%} hit rate, {search_stats['entries']} entries")
+            coalescing = coalescing_stats()
+            shared = ", ".join(f"{name} {stats['coalesced']}" for name, stats in coalescing.items())
+            st.caption(f"**Coalesced duplicate calls**: {shared}")
+            # The embedding model is only loaded by the first search, not by the sidebar
+            loaded = resource_stats()['resources']
+            if "recipe_cache" in loaded:
+                recipe_stats = get_recipe_cache().stats()
+                st.caption(f"**Recipes**: {recipe_stats['hit_rate']:.0%} hit rate, {recipe_stats['entries']} entries")
+            prewarmer = get_prewarmer()
+            if prewarmer is not None and "recipe_cache" in loaded:
+                prewarm_stats = prewarmer.stats()
+                stale = sum(language['stale'] for language in prewarm_stats['languages'].values())
+                st.caption(
+                    f"**Prewarmed suggestions**: {prewarm_stats['coverage']:.0%} ready, {stale} stale"
+                    + (", refreshing now" if prewarm_stats['running'] else "")
+                )
+            if "embeddings" in loaded:
+                embedding_stats = get_embeddings().stats()
+                st.caption(
+                    f"**Query embeddings**: {embedding_stats['hit_rate']:.0%} hit rate "
+                    f"({embedding_stats['memory_hits']} memory, {embedding_stats['disk_hits']} disk, {embedding_stats['misses']} misses)"
+                )
+        
         # Tips
         st.markdown("### 💭 Tips")
         st.info("""
@@ -0,0 +1,107 @@
+import json
+import time
+import argparse
+from typing import Any, Dict, List
+import numpy as np
+import faiss
+from pdf_processor import INDEX_TYPES, create_faiss_index, embed_queries, faiss_index_description
+from resources import get_embeddings, get_vector_store, get_pairing_index
+
+RECALL_K = 5
+
+def benchmark_queries() -> List[str]:
+    """Realistic pairing queries: every ingredient of the book, alone and with a partner"""
+    pairing_index = get_pairing_index()
+    if pairing_index is None:
+        return ["chicken", "lemon", "chocolate and orange", "lamb with rosemary", "tomato basil"]
+
+    queries = []
+    for ingredient, partners in pairing_index.pairs.items():
+        queries.append(pairing_index.names.get(ingredient, ingredient))
+        for partner in list(partners)[:2]:
+            queries.append(f"{ingredient} and {partner}")
+    return queries
+
+def exact_vectors(db) -> np.ndarray:
+    """
+    Vectors of the stored chunks, in index order. Only a flat index gives them
+    back exactly: PQ/SQ reconstructions are the quantized vectors, which would
+    make the quantized index types their own ground truth, so the chunks are
+    embedded again.
+    """
+    if isinstance(faiss.downcast_index(db.index), faiss.IndexFlat):
+        return db.index.reconstruct_n(0, db.index.ntotal)
+
+    texts = [db.docstore.search(db.index_to_docstore_id[row]).page_content for row in range(db.index.ntotal)]
+    vectors = np.asarray(get_embeddings().embed_documents(texts), dtype=np.float32)
+    if db._normalize_L2:
+        faiss.normalize_L2(vectors)
+    return vectors
+
+def benchmark_index_type(index_type: str, vectors: np.ndarray, queries: np.ndarray, ground_truth: np.ndarray) -> Dict[str, Any]:
+    """Build one index type and measure its recall@k against the flat index, latency and size"""
+    start = time.perf_counter()
+    index = create_faiss_index(index_type, vectors)
+    build_time = time.perf_counter() - start
+
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), RECALL_K)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids[0])
+
+    start = time.perf_counter()
+    index.search(queries, RECALL_K)
+    batch_time = (time.perf_counter() - start) * 1000
+
+    recall = np.mean([
+        len(set(found) & set(expected)) / RECALL_K
+        for found, expected in zip(results, ground_truth)
+    ])
+
+    return {
+        "index_type": index_type,
+        "description": faiss_index_description(index_type, *vectors.shape),
+        f"recall@{RECALL_K}": round(float(recall), 4),
+        "latency_ms_mean": round(float(np.mean(latencies)), 4),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 4),
+        "batch_latency_ms": round(batch_time, 3),
+        "size_bytes": int(faiss.serialize_index(index).size),
+        "build_s": round(build_time, 3),
+    }
+
+def run_index_benchmark(index_types: List[str] = INDEX_TYPES) -> Dict[str, Any]:
+    """Compare the index types on the vectors of the current pairings store"""
+    db = get_vector_store()
+    vectors = exact_vectors(db)
+    query_texts = benchmark_queries()
+    queries = embed_queries(query_texts)
+
+    # Exact neighbours are the reference for recall
+    _, ground_truth = create_faiss_index("flat", vectors).search(queries, RECALL_K)
+
+    results = []
+    for index_type in index_types:
+        result = benchmark_index_type(index_type, vectors, queries, ground_truth)
+        results.append(result)
+        print(
+            f"{index_type:>9}  recall@{RECALL_K}={result[f'recall@{RECALL_K}']:.3f}  "
+            f"mean={result['latency_ms_mean']:.3f}ms  p95={result['latency_ms_p95']:.3f}ms  "
+            f"size={result['size_bytes'] / 2**20:.2f}MB  build={result['build_s']:.2f}s"
+        )
+
+    return {"vectors": int(vectors.shape[0]), "dim": int(vectors.shape[1]), "queries": len(query_texts), "results": results}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall vs latency vs size of the FAISS index types on the pairings store")
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES), help="index types to compare")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    report = run_index_benchmark(args.types)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved in : {args.output}")
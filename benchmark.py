@@ -0,0 +1,339 @@
+import os
+import sys
+import json
+import time
+import logging
+import asyncio
+import argparse
+import platform
+import subprocess
+import tempfile
+import zlib
+from contextlib import redirect_stdout
+from typing import Any, Dict, List, Optional
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from resources import get_embeddings, resource_stats, set_resource
+from state import RecipeAgentState
+
+BENCHMARK_OUTPUT = "benchmark_results.json"
+
+# Canned web results: the stub search tool answers every query with one of them
+STUB_RECIPES = [
+    {
+        "title": "Spaghetti alla carbonara",
+        "content": "Spaghetti, guanciale, eggs, pecorino and black pepper. Fry the guanciale, toss the pasta with the eggs and cheese off the heat.",
+        "ingredients": ["guanciale", "egg", "pecorino", "black pepper"],
+    },
+    {
+        "title": "Roast chicken with lemon and thyme",
+        "content": "A whole chicken roasted with lemon, garlic and thyme, basted with butter until golden.",
+        "ingredients": ["chicken", "lemon", "garlic", "thyme"],
+    },
+    {
+        "title": "Chocolate and orange mousse",
+        "content": "Dark chocolate melted with cream, orange zest and a pinch of cardamom, folded into whipped egg whites.",
+        "ingredients": ["chocolate", "orange", "cardamom", "cream"],
+    },
+    {
+        "title": "Lamb tagine",
+        "content": "Lamb shoulder slowly cooked with apricot, cumin, cinnamon and almond.",
+        "ingredients": ["lamb", "apricot", "cumin", "almond"],
+    },
+]
+
+BENCHMARK_REQUESTS = [
+    ("carbonara", "it"),
+    ("a light chicken dinner", "en"),
+    ("un dessert au chocolat", "fr"),
+    ("algo con cordero", "es"),
+    ("pasta veloce per due", "it"),
+    ("something with lemon", "en"),
+]
+
+def _stub_recipe(query: str) -> Dict[str, Any]:
+    return STUB_RECIPES[zlib.crc32(query.encode("utf-8")) % len(STUB_RECIPES)]
+
+class StubChatModel(BaseChatModel):
+    """
+    Deterministic local stand-in for the Groq client: answers the ingredient
+    extraction prompt from the canned recipe it contains and any other prompt
+    with a fixed recipe, after `latency_s` plus `token_latency_s` per word.
+    """
+
+    latency_s: float = 0.5
+    token_latency_s: float = 0.0
+    recipe_words: int = 300
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat-model"
+
+    def _answer(self, messages: List[BaseMessage]) -> str:
+        prompt = str(messages[-1].content)
+        if "main ingredients" in prompt:
+            for recipe in STUB_RECIPES:
+                if recipe["content"] in prompt:
+                    return ", ".join(recipe["ingredients"])
+            return "tomato, basil, garlic"
+        body = " ".join(f"step{i}" for i in range(self.recipe_words))
+        return f"# Stub recipe\n\n## Ingredients\n- 200 g pasta\n\n## Instructions\n{body}"
+
+    def _delay(self, answer: str) -> float:
+        return self.latency_s + self.token_latency_s * len(answer.split())
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        answer = self._answer(messages)
+        time.sleep(self._delay(answer))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        answer = self._answer(messages)
+        await asyncio.sleep(self._delay(answer))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+class StubSearchTool:
+    """Deterministic local stand-in for the Tavily search tool with a fixed latency"""
+
+    name = "tavily_search"
+
+    def __init__(self, latency_s: float = 0.8):
+        self.latency_s = latency_s
+
+    def _results(self, query: Any) -> Dict[str, Any]:
+        recipe = _stub_recipe(str(query))
+        return {"query": str(query), "results": [{"title": recipe["title"], "url": "https://example.com/recipe", "content": recipe["content"]}]}
+
+    def invoke(self, query: Any, *args, **kwargs) -> Dict[str, Any]:
+        time.sleep(self.latency_s)
+        return self._results(query)
+
+    async def ainvoke(self, query: Any, *args, **kwargs) -> Dict[str, Any]:
+        await asyncio.sleep(self.latency_s)
+        return self._results(query)
+
+def install_stubs(llm_latency: float, llm_token_latency: float, search_latency: float) -> None:
+    """
+    Replace the shared LLM and search clients, no API key is needed afterwards.
+    The recipe cache is swapped for an in-memory one, so stub recipes never
+    reach the persistent cache served to users.
+    """
+    from cache import RecipeCache
+
+    set_resource("llm", StubChatModel(latency_s=llm_latency, token_latency_s=llm_token_latency))
+    set_resource("search_tool", StubSearchTool(latency_s=search_latency))
+    set_resource("recipe_cache", RecipeCache(get_embeddings(), path=None))
+
+def summarize(samples_ms: List[float]) -> Dict[str, Any]:
+    """Count, mean and p50/p95/p99/max of latency samples in ms"""
+    if not samples_ms:
+        return {"count": 0}
+    values = np.asarray(samples_ms)
+    return {
+        "count": len(samples_ms),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+def benchmark_state(desire: str, lang: str) -> RecipeAgentState:
+    return RecipeAgentState(
+        messages=[],
+        user_desire=desire,
+        dietary_preferences=[],
+        base_recipe_query=None,
+        base_recipe_search_results=None,
+        extracted_ingredients_from_base_recipe=[],
+        pairing_query=None,
+        pairing_results=None,
+        final_recipe=None,
+        error_message=None,
+        retry_count=0,
+        tool_calls=[],
+        tool_results=[],
+        awaiting_user_input=False,
+        user_language=lang,
+        bypass_cache=True,  # measure the (stubbed) search, not the search cache
+    )
+
+def benchmark_graph(runs: int, verbose: bool = False) -> Dict[str, Any]:
+    """
+    Run the graph `runs` times over the benchmark requests. In "updates" mode a
+    node's update is emitted as soon as it finishes, so the time between two
+    updates is the time spent in that node.
+    """
+    from graph import build_recipe_agent_graph
+
+    app = build_recipe_agent_graph()
+    node_samples: Dict[str, List[float]] = {}
+    total_samples = []
+    failures = 0
+
+    for i in range(runs):
+        desire, lang = BENCHMARK_REQUESTS[i % len(BENCHMARK_REQUESTS)]
+        final_state = {}
+        with open(os.devnull, "w") as devnull, redirect_stdout(sys.stdout if verbose else devnull):
+            start = previous = time.perf_counter()
+            for update in app.stream(benchmark_state(desire, lang), stream_mode="updates"):
+                now = time.perf_counter()
+                for node, values in update.items():
+                    node_samples.setdefault(node, []).append((now - previous) * 1000)
+                    final_state.update(values or {})
+                previous = now
+            total_samples.append((time.perf_counter() - start) * 1000)
+        if not final_state.get("final_recipe"):
+            failures += 1
+
+    return {
+        "runs": runs,
+        "failures": failures,
+        "end_to_end": summarize(total_samples),
+        "nodes": {node: summarize(samples) for node, samples in node_samples.items()},
+    }
+
+def benchmark_async_graph(runs: int, concurrency: int) -> Dict[str, Any]:
+    """Throughput of the async graph with `concurrency` requests in flight"""
+    from graph import arun_recipe_agent, build_recipe_agent_graph
+
+    app = build_recipe_agent_graph()
+
+    async def run_all() -> List[float]:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(i: int) -> float:
+            desire, lang = BENCHMARK_REQUESTS[i % len(BENCHMARK_REQUESTS)]
+            async with semaphore:
+                start = time.perf_counter()
+                await arun_recipe_agent(benchmark_state(desire, lang), app, fresh=True, store=False)
+                return (time.perf_counter() - start) * 1000
+
+        return await asyncio.gather(*(run_one(i) for i in range(runs)))
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        samples = asyncio.run(run_all())
+        elapsed = time.perf_counter() - start
+
+    return {
+        "runs": runs,
+        "concurrency": concurrency,
+        "requests_per_s": round(runs / elapsed, 3),
+        "end_to_end": summarize(samples),
+    }
+
+def benchmark_retrieval(repeats: int) -> Dict[str, Any]:
+    """Latency of the pairing search paths on the real vector store, query embeddings included"""
+    from pdf_processor import multi_query_similarity_search
+    from tools import search_food_pairings_for_ingredients
+
+    ingredient_sets = [recipe["ingredients"] for recipe in STUB_RECIPES]
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        # Loads the embedding model, the index and the BM25 index outside the measurements
+        search_food_pairings_for_ingredients(ingredient_sets[0])
+
+        pairing_samples = []
+        dense_samples = []
+        for _ in range(repeats):
+            for ingredients in ingredient_sets:
+                start = time.perf_counter()
+                search_food_pairings_for_ingredients(ingredients)
+                pairing_samples.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                multi_query_similarity_search(ingredients)
+                dense_samples.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "search_food_pairings_for_ingredients": summarize(pairing_samples),
+        "multi_query_similarity_search": summarize(dense_samples),
+    }
+
+def benchmark_ingestion(pdf_path: str) -> Dict[str, Any]:
+    """Throughput and peak memory of a full parallel index build into a temporary directory"""
+    from pdf_processor import build_vector_db_parallel
+
+    with tempfile.TemporaryDirectory() as db_path:
+        return build_vector_db_parallel(pdf_path, db_path=db_path)
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(runs: int = 20, concurrency: int = 4, retrieval_repeats: int = 5, llm_latency: float = 0.5,
+                  llm_token_latency: float = 0.0, search_latency: float = 0.8, ingest_pdf: Optional[str] = None,
+                  verbose: bool = False) -> Dict[str, Any]:
+    """Full offline benchmark: stubbed graph runs (sync and async), retrieval, optional ingestion and memory"""
+    from pdf_processor import _peak_rss_mb
+    from graph import GRAPH_TOPOLOGY
+
+    install_stubs(llm_latency, llm_token_latency, search_latency)
+    if not verbose:
+        # Keeps the per-node log lines out of the measurements
+        logging.getLogger("chef").setLevel(logging.WARNING)
+
+    report: Dict[str, Any] = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "runs": runs, "concurrency": concurrency, "retrieval_repeats": retrieval_repeats,
+            "llm_latency_s": llm_latency, "llm_token_latency_s": llm_token_latency, "search_latency_s": search_latency,
+            "graph_topology": GRAPH_TOPOLOGY,
+        },
+    }
+
+    print("Benchmarking retrieval...")
+    report["retrieval"] = benchmark_retrieval(retrieval_repeats)
+    print("Benchmarking the graph...")
+    report["graph"] = benchmark_graph(runs, verbose)
+    print("Benchmarking the async graph...")
+    report["async_graph"] = benchmark_async_graph(runs, concurrency)
+    if ingest_pdf:
+        print("Benchmarking ingestion...")
+        report["ingestion"] = benchmark_ingestion(ingest_pdf)
+
+    report["memory"] = {"peak_rss_mb": _peak_rss_mb(), **resource_stats()}
+    return report
+
+def print_report(report: Dict[str, Any]) -> None:
+    def line(name: str, stats: Dict[str, Any]) -> None:
+        if stats.get("count"):
+            print(f"{name:>40}  p50={stats['p50_ms']:.1f}ms  p95={stats['p95_ms']:.1f}ms  p99={stats['p99_ms']:.1f}ms")
+
+    line("end to end", report["graph"]["end_to_end"])
+    for node, stats in report["graph"]["nodes"].items():
+        line(node, stats)
+    line(f"async end to end (x{report['async_graph']['concurrency']})", report["async_graph"]["end_to_end"])
+    print(f"{'async throughput':>40}  {report['async_graph']['requests_per_s']} requests/s")
+    for name, stats in report["retrieval"].items():
+        line(name, stats)
+    print(f"{'peak RSS':>40}  {report['memory']['peak_rss_mb']} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the recipe graph with local stand-ins for the LLM and web search")
+    parser.add_argument("--runs", type=int, default=20, help="graph runs (sync and async)")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight for the async runs")
+    parser.add_argument("--retrieval-repeats", type=int, default=5, help="repetitions of the retrieval queries")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per stubbed LLM call")
+    parser.add_argument("--llm-token-latency", type=float, default=0.0, help="extra seconds per generated word")
+    parser.add_argument("--search-latency", type=float, default=0.8, help="seconds per stubbed web search")
+    parser.add_argument("--ingest", metavar="PDF", help="also measure a full parallel index build of this PDF")
+    parser.add_argument("--output", default=BENCHMARK_OUTPUT, help="JSON file for the results")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the nodes")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.runs, args.concurrency, args.retrieval_repeats, args.llm_latency,
+                           args.llm_token_latency, args.search_latency, args.ingest, args.verbose)
+    print_report(report)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved in : {args.output}")
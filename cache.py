@@ -0,0 +1,537 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from instrumentation import record_cache
+
+load_dotenv()
+
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", "search_cache.sqlite3")
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 7 * 24 * 3600))          # seconds
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 5000))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+SEARCH_CACHE_BYPASS = os.getenv("SEARCH_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 4096))              # vectors kept in memory
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")  # empty: no disk tier
+EMBEDDING_CACHE_MAX_DISK_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_DISK_ENTRIES", 100000))
+
+RECIPE_CACHE_PATH = os.getenv("RECIPE_CACHE_PATH", "recipe_cache.sqlite3")  # empty: kept in memory only
+RECIPE_CACHE_THRESHOLD = float(os.getenv("RECIPE_CACHE_THRESHOLD", 0.88))  # cosine similarity of the requests
+RECIPE_CACHE_MAX_ENTRIES = int(os.getenv("RECIPE_CACHE_MAX_ENTRIES", 2000))
+RECIPE_CACHE_MAX_AGE_S = int(os.getenv("RECIPE_CACHE_MAX_AGE_S", 24 * 3600))  # older recipes are not served, 0: no limit
+RECIPE_CACHE_BYPASS = os.getenv("RECIPE_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+
+# Graph outputs stored with a recipe: enough to serve it and to refine it later
+# without repeating the web search, the extraction and the pairing lookup
+RECIPE_CACHE_FIELDS = (
+    "final_recipe", "base_recipe_query", "base_recipe_search_results",
+    "extracted_ingredients_from_base_recipe", "pairing_query", "pairing_results",
+)
+
+def normalize_query(text: str) -> str:
+    """Normalize a query so that trivially different spellings share a cache key"""
+    return re.sub(r"\s+", " ", text or "").strip().lower()
+
+class SearchCache:
+    """
+    Persistent cache for the formatted web search results, stored in SQLite.
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted when the cache grows over `max_entries` or `max_bytes`.
+    """
+
+    def __init__(self, path: str = SEARCH_CACHE_PATH, ttl: int = SEARCH_CACHE_TTL,
+                 max_entries: int = SEARCH_CACHE_MAX_ENTRIES, max_bytes: int = SEARCH_CACHE_MAX_BYTES,
+                 bypass: bool = SEARCH_CACHE_BYPASS):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _db(self) -> sqlite3.Connection:
+        """SQLite connection, opened on first use in each process (see CachedEmbeddings._db)"""
+        if self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS search_cache (
+                       key TEXT PRIMARY KEY,
+                       value TEXT NOT NULL,
+                       size INTEGER NOT NULL,
+                       created_at REAL NOT NULL,
+                       accessed_at REAL NOT NULL
+                   )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_accessed ON search_cache (accessed_at)")
+            self._conn.commit()
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def get(self, query: str, bypass: bool = False) -> Optional[str]:
+        """Return the cached value for the query, or None on a miss"""
+        if bypass or self.bypass:
+            return None
+
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            row = conn.execute(
+                "SELECT value, created_at FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    conn.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+                    conn.commit()
+                self.misses += 1
+                return None
+
+            conn.execute("UPDATE search_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, query: str, value: str, bypass: bool = False) -> None:
+        """Store a value for the query and evict old entries if needed"""
+        if bypass or self.bypass:
+            return
+
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now)
+            )
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Drop expired entries, then least recently used ones until within bounds"""
+        cursor = conn.execute("DELETE FROM search_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        self.evictions += cursor.rowcount
+
+        count, total_size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM search_cache"
+        ).fetchone()
+
+        while count > self.max_entries or total_size > self.max_bytes:
+            row = conn.execute(
+                "SELECT key, size FROM search_cache ORDER BY accessed_at ASC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            conn.execute("DELETE FROM search_cache WHERE key = ?", (row[0],))
+            self.evictions += 1
+            count -= 1
+            total_size -= row[1]
+
+    def clear(self) -> None:
+        """Remove every entry from the cache"""
+        with self._lock:
+            conn = self._db()
+            conn.execute("DELETE FROM search_cache")
+            conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the current size of the cache"""
+        with self._lock:
+            count, total_size = self._db().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM search_cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": total_size,
+        }
+
+_search_cache: Optional[SearchCache] = None
+_search_cache_lock = threading.Lock()
+
+def get_search_cache() -> SearchCache:
+    """Return the process-wide search cache, opening it on first use"""
+    global _search_cache
+    if _search_cache is None:
+        with _search_cache_lock:
+            if _search_cache is None:
+                _search_cache = SearchCache()
+    return _search_cache
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Query embedding cache in front of the encoder, keyed on the normalized text.
+    A bounded in-memory LRU is backed by an optional SQLite tier that stores the
+    vectors as float32, so repeated queries skip the forward pass across restarts.
+    embed_documents (chunk ingestion) is passed through uncached.
+    """
+
+    def __init__(self, model: Embeddings, model_name: str = "", max_entries: int = EMBEDDING_CACHE_SIZE,
+                 path: Optional[str] = EMBEDDING_CACHE_PATH, max_disk_entries: int = EMBEDDING_CACHE_MAX_DISK_ENTRIES):
+        self.model = model
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.path = path
+        self._conn = None
+        self._conn_pid = None
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """
+        SQLite connection of the disk tier, opened on first use in each process:
+        the cache can be created before the server forks its workers, and a
+        connection must not be used across a fork.
+        """
+        if self.path and self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS embedding_cache (
+                       model TEXT NOT NULL,
+                       key TEXT NOT NULL,
+                       vector BLOB NOT NULL,
+                       created_at REAL NOT NULL,
+                       PRIMARY KEY (model, key)
+                   )"""
+            )
+            self._conn.commit()
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key: str) -> Optional[np.ndarray]:
+        """Cached vector from memory, then disk (promoted to memory), or None"""
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            record_cache("embedding", True)
+            return vector
+
+        conn = self._db()
+        if conn is not None:
+            row = conn.execute(
+                "SELECT vector FROM embedding_cache WHERE model = ? AND key = ?", (self.model_name, key)
+            ).fetchone()
+            if row is not None:
+                vector = np.frombuffer(row[0], dtype=np.float32)
+                self._remember(key, vector)
+                self.disk_hits += 1
+                record_cache("embedding", True)
+                return vector
+
+        self.misses += 1
+        record_cache("embedding", False)
+        return None
+
+    def _store(self, vectors: Dict[str, np.ndarray]) -> None:
+        for key, vector in vectors.items():
+            self._remember(key, vector)
+        conn = self._db()
+        if conn is None:
+            return
+
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embedding_cache (model, key, vector, created_at) VALUES (?, ?, ?, ?)",
+            [(self.model_name, key, vector.tobytes(), now) for key, vector in vectors.items()]
+        )
+        count = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        if count > self.max_disk_entries:
+            # Oldest vectors go first, the memory tier keeps the hot ones anyway
+            conn.execute(
+                "DELETE FROM embedding_cache WHERE rowid IN (SELECT rowid FROM embedding_cache ORDER BY created_at ASC LIMIT ?)",
+                (count - self.max_disk_entries,)
+            )
+        conn.commit()
+
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        """Embed several queries as a float32 matrix, encoding only the cache misses in one batch"""
+        keys = [normalize_query(text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                if key not in found:
+                    vector = self._lookup(key)
+                    if vector is not None:
+                        found[key] = vector
+
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        if missing:
+            # The normalized text is encoded so every spelling of a query gets the same vector
+            encoded = np.asarray(self.model.embed_documents(missing), dtype=np.float32)
+            new_vectors = dict(zip(missing, encoded))
+            with self._lock:
+                self._store(new_vectors)
+            found.update(new_vectors)
+
+        return np.stack([found[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0].tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.embed_documents(texts)
+
+    def clear(self) -> None:
+        """Remove every cached vector, in memory and on disk"""
+        with self._lock:
+            self._memory.clear()
+            conn = self._db()
+            if conn is not None:
+                conn.execute("DELETE FROM embedding_cache")
+                conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters per tier and the current size of the cache"""
+        with self._lock:
+            disk_entries = None
+            conn = self._db()
+            if conn is not None:
+                disk_entries = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            memory_entries = len(self._memory)
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": memory_entries,
+            "disk_entries": disk_entries,
+        }
+
+
+class RecipeCache:
+    """
+    Semantic cache of the final recipes. Requests are partitioned by their
+    sorted dietary preferences and language; within a partition the nearest
+    cached request (cosine similarity of the user_desire embeddings) is served
+    when it is above `threshold`, so rewordings like "fusion carbonara" and
+    "carbonara fusion pasta" share a recipe. Stored in SQLite, recipes older
+    than `max_age` seconds are no longer served and the least recently served
+    entries are evicted over `max_entries`.
+    """
+
+    def __init__(self, embeddings: Embeddings, path: Optional[str] = RECIPE_CACHE_PATH,
+                 threshold: float = RECIPE_CACHE_THRESHOLD, max_entries: int = RECIPE_CACHE_MAX_ENTRIES,
+                 max_age: int = RECIPE_CACHE_MAX_AGE_S, bypass: bool = RECIPE_CACHE_BYPASS):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.path = path
+        self._conn = None
+        self._conn_pid = None
+        # partition -> (version, desires, unit vectors as a matrix), loaded on first lookup
+        self._matrices: Dict[str, Tuple[Tuple, List[str], np.ndarray]] = {}
+
+    def _db(self) -> sqlite3.Connection:
+        """
+        SQLite connection, opened on first use in each process (see
+        CachedEmbeddings._db). Without a path the cache lives in the memory
+        of the process that opened it.
+        """
+        if self._conn is None or (self.path and self._conn_pid != os.getpid()):
+            self._conn = sqlite3.connect(self.path or ":memory:", check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS recipe_cache (
+                       partition TEXT NOT NULL,
+                       desire TEXT NOT NULL,
+                       vector BLOB NOT NULL,
+                       value TEXT NOT NULL,
+                       created_at REAL NOT NULL,
+                       accessed_at REAL NOT NULL,
+                       PRIMARY KEY (partition, desire)
+                   )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_recipe_cache_accessed ON recipe_cache (accessed_at)")
+            self._conn.commit()
+            self._conn_pid = os.getpid()
+            self._matrices.clear()
+        return self._conn
+
+    @staticmethod
+    def partition(dietary_preferences: Optional[List[str]], language: Optional[str]) -> str:
+        """Requests are only compared with requests of the same diet and language"""
+        preferences = sorted({normalize_query(preference) for preference in dietary_preferences or []})
+        return json.dumps([preferences, language or ""])
+
+    def _embed(self, desire: str) -> np.ndarray:
+        if hasattr(self.embeddings, "embed_queries"):
+            vector = self.embeddings.embed_queries([desire])[0]
+        else:
+            vector = np.asarray(self.embeddings.embed_query(desire), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).astype(np.float32)
+
+    def _matrix(self, partition: str) -> Tuple[List[str], np.ndarray]:
+        """
+        Desires and vectors of a partition. The loaded matrix is reused while the
+        partition's row count and latest write are unchanged, so recipes stored
+        by other processes (prewarmer, job and server workers) are picked up.
+        """
+        conn = self._db()
+        version = conn.execute(
+            "SELECT COUNT(*), MAX(created_at) FROM recipe_cache WHERE partition = ?", (partition,)
+        ).fetchone()
+        loaded = self._matrices.get(partition)
+        if loaded is None or loaded[0] != version:
+            rows = conn.execute(
+                "SELECT desire, vector FROM recipe_cache WHERE partition = ?", (partition,)
+            ).fetchall()
+            desires = [row[0] for row in rows]
+            matrix = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) if rows else np.zeros((0, 0), dtype=np.float32)
+            loaded = self._matrices[partition] = (version, desires, matrix)
+        return loaded[1], loaded[2]
+
+    def get(self, user_desire: str, dietary_preferences: Optional[List[str]], language: Optional[str],
+            fresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        The cached graph outputs of the nearest request, with its "cached_desire"
+        and "cache_similarity", or None on a miss. `fresh` always misses, and so
+        does a nearest recipe older than `max_age`.
+        """
+        if fresh or self.bypass:
+            return None
+
+        desire = normalize_query(user_desire)
+        partition = self.partition(dietary_preferences, language)
+        with self._lock:
+            desires, matrix = self._matrix(partition)
+        if not desires:
+            self.misses += 1
+            record_cache("recipe", False)
+            return None
+
+        if desire in desires:
+            best, similarity = desire, 1.0
+        else:
+            scores = matrix @ self._embed(desire)
+            index = int(np.argmax(scores))
+            best, similarity = desires[index], float(scores[index])
+
+        if similarity < self.threshold:
+            self.misses += 1
+            record_cache("recipe", False)
+            return None
+
+        with self._lock:
+            conn = self._db()
+            row = conn.execute(
+                "SELECT value, created_at FROM recipe_cache WHERE partition = ? AND desire = ?", (partition, best)
+            ).fetchone()
+            expired = row is not None and bool(self.max_age) and time.time() - row[1] > self.max_age
+            if row is None or expired:  # evicted meanwhile, or too old: generated again and replaced by set
+                self.expired += expired
+                self.misses += 1
+                record_cache("recipe", False)
+                return None
+            conn.execute(
+                "UPDATE recipe_cache SET accessed_at = ? WHERE partition = ? AND desire = ?", (time.time(), partition, best)
+            )
+            conn.commit()
+        self.hits += 1
+        record_cache("recipe", True)
+        return {**json.loads(row[0]), "cached_desire": best, "cache_similarity": round(similarity, 4)}
+
+    def set(self, user_desire: str, dietary_preferences: Optional[List[str]], language: Optional[str],
+            state: Dict[str, Any]) -> None:
+        """Store the graph outputs of a request that produced a recipe"""
+        if self.bypass or not state.get("final_recipe"):
+            return
+
+        desire = normalize_query(user_desire)
+        partition = self.partition(dietary_preferences, language)
+        vector = self._embed(desire)
+        value = json.dumps({field: state.get(field) for field in RECIPE_CACHE_FIELDS})
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO recipe_cache (partition, desire, vector, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (partition, desire, vector.tobytes(), value, now, now)
+            )
+            self._matrices.pop(partition, None)
+            self._evict(conn)
+            conn.commit()
+
+    def age(self, user_desire: str, dietary_preferences: Optional[List[str]], language: Optional[str]) -> Optional[float]:
+        """Seconds since the recipe of this exact request was generated, None if it is not cached"""
+        with self._lock:
+            row = self._db().execute(
+                "SELECT created_at FROM recipe_cache WHERE partition = ? AND desire = ?",
+                (self.partition(dietary_preferences, language), normalize_query(user_desire))
+            ).fetchone()
+        return time.time() - row[0] if row else None
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        count = conn.execute("SELECT COUNT(*) FROM recipe_cache").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        rows = conn.execute(
+            "SELECT partition, desire FROM recipe_cache ORDER BY accessed_at ASC LIMIT ?", (count - self.max_entries,)
+        ).fetchall()
+        conn.executemany("DELETE FROM recipe_cache WHERE partition = ? AND desire = ?", rows)
+        for partition, _ in rows:
+            self._matrices.pop(partition, None)
+        self.evictions += len(rows)
+
+    def clear(self) -> None:
+        """Remove every cached recipe"""
+        with self._lock:
+            conn = self._db()
+            conn.execute("DELETE FROM recipe_cache")
+            conn.commit()
+            self._matrices.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the number of cached recipes"""
+        with self._lock:
+            count = self._db().execute("SELECT COUNT(*) FROM recipe_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "entries": count,
+        }
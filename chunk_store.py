@@ -0,0 +1,154 @@
+import os
+import json
+import mmap
+import struct
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Union
+import numpy as np
+import faiss
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+CHUNK_STORE_FILE = "chunks.bin"
+INDEX_FILE = "index.faiss"
+
+# File layout: magic, number of rows, then one (offset, length) pair per field
+# of each row (id, text, metadata) and finally the UTF-8 encoded fields.
+MAGIC = b"CHUNKS01"
+HEADER = struct.Struct("<8sQ")
+FIELDS_PER_ROW = 3
+
+def write_chunk_store(path: str, ids: List[str], docs: List[Document]) -> None:
+    """Write the chunks, in index order, to an offset-addressed binary file"""
+    encoded = [
+        (doc_id.encode("utf-8"), doc.page_content.encode("utf-8"), json.dumps(doc.metadata).encode("utf-8"))
+        for doc_id, doc in zip(ids, docs)
+    ]
+    table = np.zeros((len(encoded), FIELDS_PER_ROW, 2), dtype=np.uint64)
+    offset = HEADER.size + table.nbytes
+    for row, fields in enumerate(encoded):
+        for field, data in enumerate(fields):
+            table[row, field] = (offset, len(data))
+            offset += len(data)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(encoded)))
+        f.write(table.tobytes())
+        for fields in encoded:
+            for data in fields:
+                f.write(data)
+    os.replace(tmp_path, path)
+
+class ChunkStore:
+    """Read-only view of a chunk file: rows are decoded on access from the mmap'd file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"'{path}' is not a chunk store file")
+        # Zero-copy view over the offset table
+        self._table = np.frombuffer(self._mmap, dtype=np.uint64, count=self.count * FIELDS_PER_ROW * 2,
+                                    offset=HEADER.size).reshape(self.count, FIELDS_PER_ROW, 2)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _field(self, row: int, field: int) -> str:
+        offset, length = self._table[row, field]
+        return self._mmap[int(offset):int(offset + length)].decode("utf-8")
+
+    def id(self, row: int) -> str:
+        return self._field(row, 0)
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self._field(row, 1), metadata=json.loads(self._field(row, 2)))
+
+class RowIds(Mapping):
+    """index_to_docstore_id of a memory-mapped store: FAISS row i has docstore id "i" """
+
+    def __init__(self, count: int):
+        self.count = count
+
+    def __getitem__(self, row: int) -> str:
+        if not 0 <= row < self.count:
+            raise KeyError(row)
+        return str(row)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.count))
+
+    def __len__(self) -> int:
+        return self.count
+
+class MmapDocstore(Docstore):
+    """Docstore backed by a ChunkStore, documents are only decoded for returned hits"""
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+
+    def search(self, search: str) -> Union[str, Document]:
+        try:
+            row = int(search)
+        except ValueError:
+            return f"ID {search} not found."
+        if not 0 <= row < len(self.store):
+            return f"ID {search} not found."
+        return self.store.document(row)
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        raise TypeError("MmapDocstore is read-only; load a writable copy for ingestion (load_writable_vector_store)")
+
+    def delete(self, ids: List) -> None:
+        raise TypeError("MmapDocstore is read-only; load a writable copy for ingestion (load_writable_vector_store)")
+
+def chunk_store_exists(db_path: str) -> bool:
+    return os.path.exists(os.path.join(db_path, CHUNK_STORE_FILE))
+
+def read_index_mmap(path: str) -> faiss.Index:
+    """Memory-map the FAISS index file so worker processes share it through the page cache"""
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    try:
+        return faiss.read_index(path, flag)
+    except RuntimeError:
+        # Not every index type can be mapped, those are read into memory
+        return faiss.read_index(path)
+
+def load_mmap_vector_store(db_path: str, embeddings: Any):
+    """FAISS store over the memory-mapped index and chunk file, without unpickling anything"""
+    index = read_index_mmap(os.path.join(db_path, INDEX_FILE))
+    store = ChunkStore(os.path.join(db_path, CHUNK_STORE_FILE))
+    if index.ntotal != len(store):
+        raise ValueError(f"'{db_path}' is inconsistent: {index.ntotal} vectors but {len(store)} chunks")
+    return FAISS(embeddings, index, MmapDocstore(store), RowIds(len(store)))
+
+def load_writable_vector_store(db_path: str, embeddings: Any):
+    """Fully loaded, writable FAISS store (for ingestion) read from the chunk file"""
+    index = faiss.read_index(os.path.join(db_path, INDEX_FILE))
+    store = ChunkStore(os.path.join(db_path, CHUNK_STORE_FILE))
+    ids = [store.id(row) for row in range(len(store))]
+    docstore = InMemoryDocstore({doc_id: store.document(row) for row, doc_id in enumerate(ids)})
+    return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
+
+def save_vector_store(db: FAISS, db_path: str) -> None:
+    """Save a FAISS store as index.faiss + chunks.bin (no pickle)"""
+    os.makedirs(db_path, exist_ok=True)
+    ids = [db.index_to_docstore_id[row] for row in range(db.index.ntotal)]
+    docs = [db.docstore.search(doc_id) for doc_id in ids]
+    write_chunk_store(os.path.join(db_path, CHUNK_STORE_FILE), ids, docs)
+    faiss.write_index(db.index, os.path.join(db_path, INDEX_FILE))
+
+if __name__ == "__main__":
+    # Convert a store saved by FAISS.save_local (index.pkl) to the chunk file format
+    from pdf_processor import VECTOR_DB_PATH
+
+    # The embedding model is not needed to copy the stored vectors and chunks
+    db = FAISS.load_local(VECTOR_DB_PATH, None, allow_dangerous_deserialization=True)
+    save_vector_store(db, VECTOR_DB_PATH)
+    print(f"Chunk store with {db.index.ntotal} chunks saved in : {os.path.join(VECTOR_DB_PATH, CHUNK_STORE_FILE)}")
+    print("index.pkl is no longer needed and can be deleted.")
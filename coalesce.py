@@ -0,0 +1,137 @@
+import copy
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from cache import normalize_query
+from instrumentation import record_cache
+
+class _Call:
+    """One in-flight execution and the callers waiting for its outcome"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[Exception] = None
+        self.abandoned = False  # the leader was cancelled, the waiters run the call again
+        self.waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def outcome(self) -> Any:
+        if self.error is not None:
+            raise self.error
+        # Callers get their own deep copy, so one caller cannot mutate the lists of another's state
+        return copy.deepcopy(self.result)
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls: the first caller of a key runs it, the
+    callers arriving while it is in flight wait and share its result (or error).
+    If the leader is cancelled, one of the waiters runs the call again instead.
+    Nothing is kept once the call completes, this is not a cache.
+    Works across threads and event loops, sync and async callers can share a call.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.executions = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: Hashable) -> Tuple[_Call, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+        record_cache(f"{self.name}_coalescing", not leader)
+        return call, leader
+
+    def _complete(self, key: Hashable, call: _Call, result: Any = None, error: Optional[Exception] = None,
+                  abandoned: bool = False) -> None:
+        with self._lock:
+            del self._calls[key]
+            call.result = copy.deepcopy(result)
+            call.error = error
+            call.abandoned = abandoned
+            call.event.set()
+            waiters = list(call.waiters)
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(lambda future=future: future.done() or future.set_result(None))
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Run `func` unless an identical call is in flight, in which case wait for its result"""
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            call.event.wait()
+            if not call.abandoned:
+                return call.outcome()
+
+        try:
+            result = func()
+        except Exception as e:
+            self._complete(key, call, error=e)
+            raise
+        except BaseException:
+            # Cancellation belongs to the leader's caller, a waiter takes over the call
+            self._complete(key, call, abandoned=True)
+            raise
+        self._complete(key, call, result=result)
+        return result
+
+    async def ado(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Async version of do, waiting does not block the event loop"""
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            with self._lock:
+                if not call.event.is_set():
+                    future = asyncio.get_running_loop().create_future()
+                    call.waiters.append((asyncio.get_running_loop(), future))
+                else:
+                    future = None
+            if future is not None:
+                await future
+            if not call.abandoned:
+                return call.outcome()
+
+        try:
+            result = await func()
+        except Exception as e:
+            self._complete(key, call, error=e)
+            raise
+        except BaseException:
+            # e.g. the leader's client disconnected: a waiter takes over the call
+            self._complete(key, call, abandoned=True)
+            raise
+        self._complete(key, call, result=result)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.executions + self.coalesced
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / calls if calls else 0.0,
+            "in_flight": len(self._calls),
+        }
+
+def request_key(user_desire: str, dietary_preferences: Optional[List[str]], language: Optional[str]) -> Tuple[str, Tuple[str, ...], str]:
+    """Identity of a recipe request: normalized desire, sorted preferences and language"""
+    preferences = tuple(sorted({normalize_query(preference) for preference in dietary_preferences or []}))
+    return normalize_query(user_desire), preferences, language or ""
+
+# Whole graph runs (stateless callers, checkpointed session turns), and the external calls made by the nodes
+graph_flights = SingleFlight("graph")
+session_flights = SingleFlight("session")
+search_flights = SingleFlight("search")
+llm_flights = SingleFlight("llm")
+pairing_flights = SingleFlight("pairing")
+
+def coalescing_stats() -> Dict[str, Dict[str, Any]]:
+    return {flights.name: flights.stats() for flights in (graph_flights, session_flights, search_flights, llm_flights, pairing_flights)}
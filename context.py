@@ -0,0 +1,152 @@
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+from hybrid_retriever import tokenize
+from instrumentation import get_logger
+from tools import PAIRING_RESULTS_HEADER
+
+load_dotenv()
+
+# Tokens of retrieved context in the recipe prompt: the model has an 8192-token
+# window shared by the instructions, the context and the generated recipe
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+BASE_RECIPE_SHARE = float(os.getenv("BASE_RECIPE_SHARE", 0.4))  # rest of the budget goes to the pairings
+NEAR_DUPLICATE_THRESHOLD = 0.8    # shingle Jaccard similarity above which a passage is dropped
+MIN_SENTENCE_CHARS = 20           # shorter sentences are never treated as repeated text
+MIN_TRUNCATED_TOKENS = 40         # a passage is cut to fit the budget only if this much of it survives
+
+logger = get_logger("context")
+
+_encoding = None
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when its encoding is available, else about 4 characters per token"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # not installed, or the encoding cannot be downloaded
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def _sentences(text: str) -> List[str]:
+    return [sentence for sentence in re.split(r"(?<=[.!?])\s+|\n+", text) if sentence.strip()]
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = _normalize(text).split()
+    return {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def split_base_recipe(base_recipe: Optional[str]) -> List[str]:
+    """The web results formatted by the search node, one passage per result"""
+    return [passage.strip() for passage in re.split(r"\n\s*\n(?=\*\*)", base_recipe or "") if passage.strip()]
+
+def split_pairing_results(pairing_results: Optional[str]) -> List[str]:
+    """The book passages of the pairing search, one per retrieved chunk or entry"""
+    text = pairing_results or ""
+    if text.startswith(PAIRING_RESULTS_HEADER):
+        text = text[len(PAIRING_RESULTS_HEADER):]
+    return [passage.strip() for passage in text.split("\n---\n") if passage.strip()]
+
+def remove_repeated_text(passages: Sequence[str]) -> List[str]:
+    """
+    Drop the sentences (and sentence fragments, e.g. the 200 characters two
+    neighbouring chunks share) already present in an earlier passage, then the
+    passages that are near-duplicates of an earlier one.
+    """
+    seen_text = ""
+    kept: List[Tuple[str, set]] = []
+    for passage in passages:
+        sentences = []
+        for sentence in _sentences(passage):
+            normalized = _normalize(sentence)
+            if len(normalized) >= MIN_SENTENCE_CHARS and normalized in seen_text:
+                continue
+            # The PDF text is full of tab runs, which cost tokens and carry nothing
+            sentences.append(re.sub(r"\s+", " ", sentence).strip())
+        if not sentences:
+            continue
+
+        text = " ".join(sentences)
+        shingles = _shingles(text)
+        if any(len(shingles & other) / len(shingles | other) >= NEAR_DUPLICATE_THRESHOLD for _, other in kept):
+            continue
+        kept.append((text, shingles))
+        seen_text += " " + _normalize(passage)
+    return [text for text, _ in kept]
+
+def rank_passages(passages: Sequence[str], ingredients: Sequence[str], desire: str = "") -> List[int]:
+    """
+    Indexes of the passages, most relevant first: distinct ingredients mentioned,
+    then desire terms, ties kept in retrieval order.
+    """
+    ingredient_terms = [set(tokenize(ingredient)) for ingredient in ingredients]
+    desire_terms = set(tokenize(desire))
+
+    def score(index: int) -> Tuple[int, int, int]:
+        terms = set(tokenize(passages[index]))
+        ingredient_hits = sum(1 for ingredient in ingredient_terms if ingredient and ingredient <= terms)
+        return (-ingredient_hits, -len(desire_terms & terms), index)
+
+    return sorted(range(len(passages)), key=score)
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Cut a passage to about `max_tokens` on a sentence boundary when possible"""
+    result = ""
+    for sentence in _sentences(text):
+        candidate = f"{result} {sentence}".strip()
+        if count_tokens(candidate) > max_tokens:
+            break
+        result = candidate
+    if not result:
+        words = text.split()
+        result = " ".join(words[:max(1, max_tokens * 3 // 4)])
+    return result + " …"
+
+def fit_budget(passages: Sequence[str], order: Sequence[int], budget: int) -> List[str]:
+    """Take the passages in rank order while they fit, returned in their original order"""
+    selected: Dict[int, str] = {}
+    remaining = budget
+    for index in order:
+        tokens = count_tokens(passages[index])
+        if tokens <= remaining:
+            selected[index] = passages[index]
+            remaining -= tokens
+        elif remaining >= MIN_TRUNCATED_TOKENS:
+            selected[index] = _truncate(passages[index], remaining)
+            remaining -= count_tokens(selected[index])
+    return [selected[index] for index in sorted(selected)]
+
+def compress_context(base_recipe: Optional[str], pairing_results: Optional[str], ingredients: Sequence[str],
+                     desire: str = "", budget: int = CONTEXT_TOKEN_BUDGET) -> Dict[str, Any]:
+    """
+    Build the context of the recipe prompt: deduplicate the web results and the
+    book passages, rank them by relevance to the ingredients and keep what fits
+    in `budget` tokens. Budget left unused by the base recipe goes to the pairings.
+    """
+    base_passages = remove_repeated_text(split_base_recipe(base_recipe))
+    pairing_passages = remove_repeated_text(split_pairing_results(pairing_results))
+
+    base_selected = fit_budget(base_passages, rank_passages(base_passages, ingredients, desire), int(budget * BASE_RECIPE_SHARE))
+    base_text = "\n\n".join(base_selected)
+    pairing_budget = budget - count_tokens(base_text) if base_text else budget
+    pairing_selected = fit_budget(pairing_passages, rank_passages(pairing_passages, ingredients, desire), pairing_budget)
+
+    pairing_text = "\n---\n".join(pairing_selected)
+    if pairing_text and (pairing_results or "").startswith(PAIRING_RESULTS_HEADER):
+        pairing_text = PAIRING_RESULTS_HEADER + pairing_text
+    stats = {
+        "tokens_before": count_tokens(base_recipe or "") + count_tokens(pairing_results or ""),
+        "tokens_after": count_tokens(base_text) + count_tokens(pairing_text),
+        "passages_before": len(split_base_recipe(base_recipe)) + len(split_pairing_results(pairing_results)),
+        "passages_after": len(base_selected) + len(pairing_selected),
+    }
+    logger.debug(f"Context compressed from {stats['tokens_before']} to {stats['tokens_after']} tokens",
+                 extra={"data": {"event": "context", **stats}})
+    return {"base_recipe": base_text, "pairing_results": pairing_text, "stats": stats}
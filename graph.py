@@ -1,25 +1,72 @@
+import os
+import asyncio
+from typing import Any, Callable, Dict, List, Optional
+from dotenv import load_dotenv
 from langgraph.graph import StateGraph, END
+from langchain_core.runnables import RunnableLambda
 from state import RecipeAgentState
 from nodes import *
+from instrumentation import get_logger, instrument_node
+from cache import RECIPE_CACHE_FIELDS
+from coalesce import graph_flights, request_key, session_flights
+from ingredient_extractor import MIN_INGREDIENTS
+from refinement import FULL_RUN, GENERATE, PAIRINGS, build_turn_input, completed_request_update, session_config
 
-def build_recipe_agent_graph():
+load_dotenv()
+
+logger = get_logger("graph")
+
+# "linear" runs the nodes one after the other, "fanout" looks up the pairings of
+# the ingredients named in the request in parallel with the base recipe search
+GRAPH_TOPOLOGY = os.getenv("GRAPH_TOPOLOGY", "linear")
+
+# Node whose LLM output is streamed token by token to the user
+STREAMED_NODE = "generate_recipe"
+
+# Outcome of a session turn shared with the other sessions waiting for the same request
+SHARED_SESSION_FIELDS = RECIPE_CACHE_FIELDS + ("error_message",)
+
+# Where the fan-out graph starts for each resume point of the refinement router
+FANOUT_RESUME_NODES = {
+    FULL_RUN: ["search_base_recipe", "speculative_pairings"],
+    PAIRINGS: "merge_pairings",
+    GENERATE: "generate_recipe",
+}
+
+def _node(func, afunc) -> RunnableLambda:
+    """
+    Wrap a node so the graph uses `func` with invoke/stream and `afunc` with
+    ainvoke/astream, both instrumented under the node name (e.g. "search_pairings").
+    """
+    name = func.__name__.removesuffix("_node")
+    return RunnableLambda(instrument_node(name, func), afunc=instrument_node(name, afunc), name=func.__name__)
+
+def build_recipe_agent_graph(topology: Optional[str] = None, checkpointer: Any = None):
+    """
+    Compiled recipe graph. With a checkpointer, runs of the same thread_id
+    continue the state of the previous one (see refinement.py).
+    """
+    if (topology or GRAPH_TOPOLOGY) == "fanout":
+        return build_fanout_recipe_agent_graph(checkpointer)
+    
     workflow = StateGraph(RecipeAgentState)
     
     # Add nodes
-    workflow.add_node("start", start_node)
-    workflow.add_node("search_base_recipe", search_base_recipe_node)
-    workflow.add_node("extract_ingredients", extract_ingredients_node)
-    workflow.add_node("search_pairings", search_pairings_node)
-    workflow.add_node("generate_recipe", generate_recipe_node)
-    workflow.add_node("clarify_input", clarify_input_node)
+    workflow.add_node("start", _node(start_node, astart_node))
+    workflow.add_node("search_base_recipe", _node(search_base_recipe_node, asearch_base_recipe_node))
+    workflow.add_node("extract_ingredients", _node(extract_ingredients_node, aextract_ingredients_node))
+    workflow.add_node("search_pairings", _node(search_pairings_node, asearch_pairings_node))
+    workflow.add_node("generate_recipe", _node(generate_recipe_node, agenerate_recipe_node))
+    workflow.add_node("clarify_input", _node(clarify_input_node, aclarify_input_node))
     
     # Set entry point
     workflow.set_entry_point("start")
     
     # Linear flow with clear progression
+    # In a checkpointed session the refinement router may skip the nodes whose inputs did not change
     workflow.add_conditional_edges(
         "start",
-        lambda state: "search_base_recipe" if state["user_desire"] else "clarify_input"
+        lambda state: (state.get("resume_from") or FULL_RUN) if state["user_desire"] else "clarify_input"
     )
     
     workflow.add_conditional_edges(
@@ -44,4 +91,214 @@ def build_recipe_agent_graph():
     
     workflow.add_edge("clarify_input", END)
     
-    return workflow.compile()
\ No newline at end of file
+    return workflow.compile(checkpointer=checkpointer)
+
+def build_fanout_recipe_agent_graph(checkpointer: Any = None):
+    """
+    start ─┬─ search_base_recipe ── extract_ingredients ─┬─ merge_pairings ── generate_recipe
+           └─ speculative_pairings ──────────────────────┘
+    The speculative lookup runs on the ingredients named in the request, off the
+    critical path. When the request names enough of them, the extraction is
+    skipped too; merge_pairings only searches the ingredients it does not cover.
+    """
+    workflow = StateGraph(RecipeAgentState)
+    
+    workflow.add_node("start", _node(start_node, astart_node))
+    workflow.add_node("search_base_recipe", _node(search_base_recipe_node, asearch_base_recipe_node))
+    workflow.add_node("speculative_pairings", _node(speculative_pairings_node, aspeculative_pairings_node))
+    workflow.add_node("extract_ingredients", _node(extract_ingredients_node, aextract_ingredients_node))
+    workflow.add_node("merge_pairings", _node(merge_pairings_node, amerge_pairings_node))
+    workflow.add_node("generate_recipe", _node(generate_recipe_node, agenerate_recipe_node))
+    workflow.add_node("clarify_input", _node(clarify_input_node, aclarify_input_node))
+    
+    workflow.set_entry_point("start")
+    
+    workflow.add_conditional_edges(
+        "start",
+        lambda state: FANOUT_RESUME_NODES[state.get("resume_from") or FULL_RUN] if state["user_desire"] else "clarify_input",
+        ["search_base_recipe", "speculative_pairings", "merge_pairings", "generate_recipe", "clarify_input"]
+    )
+    
+    # The speculative branch finishes in the same step as this node, so its
+    # output is not visible here yet: the request is inspected directly
+    workflow.add_conditional_edges(
+        "search_base_recipe",
+        lambda state: (
+            "clarify_input" if not state["base_recipe_search_results"]
+            else "merge_pairings" if len(desire_ingredients(state["user_desire"])) >= MIN_INGREDIENTS
+            else "extract_ingredients"
+        ),
+        ["clarify_input", "merge_pairings", "extract_ingredients"]
+    )
+    
+    # Waits for both branches
+    workflow.add_edge(["extract_ingredients", "speculative_pairings"], "merge_pairings")
+    workflow.add_edge("merge_pairings", "generate_recipe")
+    
+    workflow.add_conditional_edges(
+        "generate_recipe",
+        lambda state: END if state["final_recipe"] else "clarify_input"
+    )
+    
+    workflow.add_edge("clarify_input", END)
+    
+    return workflow.compile(checkpointer=checkpointer)
+
+def _state_key(state: RecipeAgentState):
+    return request_key(state["user_desire"], state.get("dietary_preferences"), state.get("user_language"))
+
+def cached_recipe_state(initial_state: RecipeAgentState, fresh: bool = False) -> Optional[Dict[str, Any]]:
+    """Final state served from the recipe cache for a similar earlier request, None on a miss"""
+    from resources import get_recipe_cache
+    
+    cached = get_recipe_cache().get(initial_state["user_desire"], initial_state.get("dietary_preferences"),
+                                    initial_state.get("user_language"), fresh=fresh)
+    if cached is None:
+        return None
+    logger.info(f"Recipe served from the cache ('{cached['cached_desire']}', similarity {cached['cache_similarity']:.2f})")
+    return {**initial_state, **cached}
+
+def remember_recipe(initial_state: RecipeAgentState, final_state: Dict[str, Any]) -> None:
+    """Add the outcome of a graph run to the recipe cache (refined recipes are not cached)"""
+    from resources import get_recipe_cache
+    
+    if final_state.get("final_recipe") and not final_state.get("refinements"):
+        get_recipe_cache().set(initial_state["user_desire"], initial_state.get("dietary_preferences"),
+                               initial_state.get("user_language"), final_state)
+
+def record_session_turn(app, config: Dict[str, Any], final_state: Dict[str, Any]) -> None:
+    """
+    Record in a session's thread a recipe that its graph did not generate (from
+    the recipe cache, or from another session's coalesced run), so follow-ups
+    can refine it.
+    """
+    previous_messages = app.get_state(config).values.get("messages") or []
+    values = {key: value for key, value in final_state.items()
+              if key not in ("node_metrics", "messages", "cached_desire", "cache_similarity")}
+    values.update(completed_request_update({**values, "messages": previous_messages}, final_state["final_recipe"]))
+    app.update_state(config, values, as_node="generate_recipe")
+
+def cached_session_turn(app, config: Dict[str, Any], turn_input: Dict[str, Any], fresh: bool = False) -> Optional[Dict[str, Any]]:
+    """Serve a new request of a checkpointed session from the recipe cache, None when the graph has to run"""
+    if "user_desire" not in turn_input:  # refinements depend on the session
+        return None
+    cached_state = cached_recipe_state(turn_input, fresh)
+    if cached_state is not None:
+        record_session_turn(app, config, cached_state)
+    return cached_state
+
+def run_recipe_agent(initial_state: RecipeAgentState, app=None, fresh: bool = False, store: bool = True) -> Dict[str, Any]:
+    """
+    Run the graph, unless a similar request is in the recipe cache (`fresh`
+    skips the lookup, `store=False` keeps the result out of the cache, e.g.
+    for runs with stubbed clients). Identical requests (same desire,
+    preferences and language) that are already in flight share that run
+    instead of starting another one.
+    """
+    cached_state = cached_recipe_state(initial_state, fresh)
+    if cached_state is not None:
+        return cached_state
+    
+    if app is None:
+        from resources import get_graph
+        app = get_graph()
+    
+    def run():
+        final_state = app.invoke(initial_state)
+        # Only the caller running the graph stores its outcome, not every caller sharing it
+        if store:
+            remember_recipe(initial_state, final_state)
+        return final_state
+
+    return graph_flights.do(_state_key(initial_state), run)
+
+async def arun_recipe_agent(initial_state: RecipeAgentState, app=None, fresh: bool = False, store: bool = True) -> Dict[str, Any]:
+    """
+    Async entry point: run the graph with the async nodes, so a single event loop
+    can overlap the LLM and search waits of many concurrent requests. The recipe
+    cache and the coalescing of identical in-flight requests work like in
+    run_recipe_agent.
+    """
+    cached_state = await asyncio.to_thread(cached_recipe_state, initial_state, fresh)
+    if cached_state is not None:
+        return cached_state
+    
+    if app is None:
+        from resources import get_graph
+        app = get_graph()
+    
+    async def run():
+        final_state = await app.ainvoke(initial_state)
+        if store:
+            await asyncio.to_thread(remember_recipe, initial_state, final_state)
+        return final_state
+
+    return await graph_flights.ado(_state_key(initial_state), run)
+
+def run_session_turn(app, thread_id: str, text: str, dietary_preferences: List[str], language: Optional[str],
+                     fresh: bool = False, on_event: Optional[Callable[[str, str], None]] = None) -> Dict[str, Any]:
+    """
+    One chat turn of a checkpointed session: a new request, or a follow-up
+    refining the last recipe (see refinement.py). New requests are served from
+    the recipe cache when possible and share the run of identical requests of
+    other sessions in flight (only the recipe is shared, not the conversation).
+    `on_event("node", name)` reports each completed node and
+    `on_event("token", text)` the recipe as it is generated.
+    """
+    config = session_config(thread_id)
+    previous_state = app.get_state(config).values
+    turn_input = build_turn_input(text, dietary_preferences, language, previous_state)
+
+    # A similar request with the same diet and language was already answered
+    cached_state = cached_session_turn(app, config, turn_input, fresh)
+    if cached_state is not None:
+        return cached_state
+
+    def stream_run():
+        final_state = {**previous_state, **turn_input, "node_metrics": []}
+
+        # Execute the graph, receiving node updates and LLM tokens as they are produced
+        for mode, chunk in app.stream(turn_input, config, stream_mode=["updates", "messages"]):
+            if mode == "messages":
+                message_chunk, metadata = chunk
+                if on_event and metadata.get("langgraph_node") == STREAMED_NODE and message_chunk.content:
+                    on_event("token", message_chunk.content)
+                continue
+
+            for node_name, update in chunk.items():
+                if update:
+                    # node_metrics is appended to by every node, like the graph's reducer does
+                    node_metrics = final_state.get("node_metrics", []) + update.get("node_metrics", [])
+                    final_state.update(update)
+                    final_state["node_metrics"] = node_metrics
+                if on_event:
+                    on_event("node", node_name)
+
+        return final_state
+
+    if "user_desire" not in turn_input:
+        # Refinements depend on this session's thread, they are never shared
+        return stream_run()
+
+    leader_state = []
+
+    def shared_run():
+        final_state = stream_run()
+        leader_state.append(final_state)
+        remember_recipe(turn_input, final_state)
+        # Only the outcome of the request is shared, never this session's conversation
+        return {field: final_state.get(field) for field in SHARED_SESSION_FIELDS}
+
+    # Sessions asking for the same recipe meanwhile wait for this run instead of starting their
+    # own. They have their own flights: stateless callers never see a session's state
+    shared_state = session_flights.do(_state_key(turn_input), shared_run)
+    if leader_state:
+        return leader_state[0]
+
+    # The run was another session's: record its outcome in this session's thread, like a cache hit
+    final_state = {**turn_input, **shared_state}
+    if final_state.get("final_recipe"):
+        record_session_turn(app, config, final_state)
+        if on_event:
+            on_event("token", final_state["final_recipe"])
+    return final_state
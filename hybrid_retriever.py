@@ -0,0 +1,153 @@
+import math
+import re
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from typing import Dict, List, Tuple
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pdf_processor import embed_queries, vector_similarity_search
+from resources import get_resource, get_vector_store
+from instrumentation import get_logger
+
+logger = get_logger("hybrid_retriever")
+
+HYBRID_K = 5
+HYBRID_CANDIDATES = 20  # hits taken from each ranking before fusion
+RRF_K = 60              # reciprocal rank fusion constant
+
+# Stage timings (ms) of the last hybrid search of the current thread / task; kept
+# per context because the retriever is a singleton shared by concurrent requests
+last_hybrid_timings: ContextVar[Dict[str, float]] = ContextVar("last_hybrid_timings", default={})
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from", "in", "into", "is", "it",
+    "its", "of", "on", "or", "that", "the", "their", "this", "to", "with", "you", "your", "pairing", "pairings"
+}
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with stopwords removed and a naive plural folding"""
+    tokens = []
+    for token in re.findall(r"[^\W_]+", text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+class BM25Index:
+    """In-memory inverted index over the book chunks with BM25 scoring"""
+
+    def __init__(self, doc_ids: List[str], texts: List[str], k1: float = 1.5, b: float = 0.75):
+        self.doc_ids = doc_ids
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.doc_lengths: List[int] = []
+
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            self.doc_lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self.postings[term].append((position, frequency))
+
+        self.avg_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+        n_docs = len(self.doc_lengths)
+        self.idf = {
+            term: math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Best `k` chunks for the query as (docstore id, score)"""
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, frequency in self.postings[term]:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[position] / self.avg_length
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.doc_ids[position], score) for position, score in best]
+
+def build_bm25_index() -> BM25Index:
+    """Index the chunks of the shared vector store"""
+    db = get_vector_store()
+    doc_ids = []
+    texts = []
+    for doc_id in db.index_to_docstore_id.values():
+        doc = db.docstore.search(doc_id)
+        if isinstance(doc, Document):
+            doc_ids.append(doc_id)
+            texts.append(doc.page_content)
+    return BM25Index(doc_ids, texts)
+
+def get_bm25_index() -> BM25Index:
+    return get_resource("bm25_index", build_bm25_index)
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[str]:
+    """Merge several rankings of ids: each id scores sum(1 / (k + rank))"""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+def hybrid_search(queries: List[str], k: int = HYBRID_K, candidates: int = HYBRID_CANDIDATES) -> Tuple[List[List[Document]], Dict[str, float]]:
+    """
+    Hybrid search for several queries: one batched dense search plus one BM25
+    lookup per query, fused by reciprocal rank fusion.
+    Returns the documents of each query and the time spent in each stage (ms).
+    """
+    timings = {}
+    if not queries:
+        return [], timings
+    bm25_index = get_bm25_index()
+
+    start = time.perf_counter()
+    vectors = embed_queries(queries)
+    timings["embed_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    dense_hits = vector_similarity_search(vectors, candidates)
+    timings["dense_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    lexical_hits = [bm25_index.search(query, candidates) for query in queries]
+    timings["bm25_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    docstore = get_vector_store().docstore
+    results = []
+    for dense, lexical in zip(dense_hits, lexical_hits):
+        docs_by_id = {doc_id: doc for doc_id, doc, _ in dense}
+        fused_ids = reciprocal_rank_fusion([[doc_id for doc_id, _, _ in dense], [doc_id for doc_id, _ in lexical]])
+        docs = []
+        for doc_id in fused_ids[:k]:
+            doc = docs_by_id.get(doc_id) or docstore.search(doc_id)
+            if isinstance(doc, Document):
+                docs.append(doc)
+        results.append(docs)
+    timings["fusion_ms"] = (time.perf_counter() - start) * 1000
+
+    timings = {stage: round(ms, 3) for stage, ms in timings.items()}
+    last_hybrid_timings.set(timings)
+    return results, timings
+
+class HybridPairingsRetriever(BaseRetriever):
+    """BM25 + FAISS retriever over the flavour book, fused with reciprocal rank fusion"""
+
+    k: int = HYBRID_K
+    candidates: int = HYBRID_CANDIDATES
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        results, timings = hybrid_search([query], k=self.k, candidates=self.candidates)
+        logger.debug(f"Hybrid retrieval timings (ms): {timings}", extra={"data": {"event": "hybrid_retrieval", **timings}})
+        return results[0]
+
+def get_hybrid_retriever() -> HybridPairingsRetriever:
+    return get_resource("hybrid_retriever", HybridPairingsRetriever)
@@ -0,0 +1,103 @@
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from pairing_index import INGREDIENT_ALIASES, PairingIndex
+
+load_dotenv()
+
+# "auto" uses the local extractor and falls back to the LLM when it is not
+# confident, "local" never calls the LLM, "llm" always does
+INGREDIENT_EXTRACTION = os.getenv("INGREDIENT_EXTRACTION", "auto")
+MAX_INGREDIENTS = 4
+MIN_INGREDIENTS = 3    # the LLM prompt asks for 3-4 main ingredients
+MIN_CONFIDENCE = float(os.getenv("INGREDIENT_EXTRACTOR_MIN_CONFIDENCE", 0.66))
+TITLE_BONUS = 2.0      # an ingredient named in a result title is central to the dish
+POSITION_BONUS = 1.0   # earlier mentions weigh more (ingredient lists come first)
+
+WORD = re.compile(r"[\w'’-]+")
+TITLE_LINE = re.compile(r"^\*\*(.+)\*\*$", re.M)
+
+class IngredientExtractor:
+    """
+    Word-level trie over the ingredient names of the Flavour Thesaurus (plus
+    plurals and common aliases), matched longest-first over free text.
+    """
+
+    def __init__(self, pairing_index: PairingIndex):
+        self.trie: Dict[str, Any] = {}
+        for key in pairing_index.pairs:
+            self._add_with_plurals(key, key)
+        for alias, key in INGREDIENT_ALIASES.items():
+            if key in pairing_index.pairs:
+                self._add_with_plurals(alias, key)
+
+    @staticmethod
+    def _plurals(term: str) -> List[str]:
+        if term.endswith("y") and not term.endswith(("ay", "ey", "oy")):
+            return [f"{term[:-1]}ies"]
+        if term.endswith(("s", "x", "ch", "sh", "o")):
+            return [f"{term}es", f"{term}s"]
+        return [f"{term}s"]
+
+    def _add_with_plurals(self, term: str, key: str) -> None:
+        for variant in [term] + self._plurals(term):
+            node = self.trie
+            for word in variant.split():
+                node = node.setdefault(word, {})
+            node.setdefault("$", key)
+
+    def matches(self, text: str) -> List[Tuple[str, str, int]]:
+        """Lexicon terms found in the text as (ingredient key, surface form, word position)"""
+        words = [word.lower() for word in WORD.findall(text)]
+        found = []
+        i = 0
+        while i < len(words):
+            node = self.trie
+            match = None
+            for j in range(i, len(words)):
+                node = node.get(words[j])
+                if node is None:
+                    break
+                if "$" in node:
+                    match = (node["$"], j + 1)
+            if match:
+                key, end = match
+                found.append((key, " ".join(words[i:end]), i))
+                i = end
+            else:
+                i += 1
+        return found
+
+    def extract(self, text: str, limit: int = MAX_INGREDIENTS) -> Tuple[List[str], float]:
+        """
+        Main ingredients of a recipe text, scored by frequency, title mentions and
+        how early they appear, with a confidence in [0, 1]: how many of the 3
+        ingredients expected were found mentioned at least twice or in a title.
+        """
+        mentions = self.matches(text)
+        if not mentions:
+            return [], 0.0
+
+        titles = {key for line in TITLE_LINE.findall(text) for key, _, _ in self.matches(line)}
+        total_words = max(1, len(WORD.findall(text)))
+        scores: Dict[str, float] = {}
+        counts: Dict[str, int] = {}
+        surface: Dict[str, str] = {}
+        for key, form, position in mentions:
+            if key not in scores:
+                surface[key] = form
+                scores[key] = POSITION_BONUS * (1 - position / total_words) + (TITLE_BONUS if key in titles else 0.0)
+            scores[key] += 1
+            counts[key] = counts.get(key, 0) + 1
+
+        ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+        supported = sum(1 for key in ranked if counts[key] >= 2 or key in titles)
+        return [surface[key] for key in ranked], min(1.0, supported / MIN_INGREDIENTS)
+
+def build_ingredient_extractor() -> Optional[IngredientExtractor]:
+    """Extractor over the shared pairing index, None if the index has not been built"""
+    from resources import get_pairing_index
+
+    pairing_index = get_pairing_index()
+    return IngredientExtractor(pairing_index) if pairing_index is not None else None
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import inspect
+import logging
+import functools
+import threading
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_PATH = os.getenv("CHEF_LOG_PATH", "chef_log.jsonl")   # empty: no JSON lines file
+LOG_LEVEL = os.getenv("CHEF_LOG_LEVEL", "INFO")
+LOG_CONSOLE = os.getenv("CHEF_LOG_CONSOLE", "true").lower() in ("1", "true", "yes")
+
+# Metrics of the node running in the current thread / task, None outside the graph
+_node_metrics: ContextVar[Optional[Dict[str, Any]]] = ContextVar("node_metrics", default=None)
+
+_listener: Optional[QueueListener] = None
+_listener_lock = threading.Lock()
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record, with the structured fields passed as extra={"data": ...}"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        data = getattr(record, "data", None)
+        if data:
+            entry.update(data)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def setup_logging() -> None:
+    """
+    Route the "chef" loggers through a queue: callers only enqueue the record and
+    a background listener thread does the formatting and the file/console I/O.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+
+        handlers: List[logging.Handler] = []
+        if LOG_PATH:
+            file_handler = logging.FileHandler(LOG_PATH, encoding="utf-8")
+            file_handler.setFormatter(JsonLinesFormatter())
+            handlers.append(file_handler)
+        if LOG_CONSOLE:
+            console_handler = logging.StreamHandler(sys.stderr)
+            console_handler.setFormatter(logging.Formatter("%(message)s"))
+            handlers.append(console_handler)
+
+        log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+        logger = logging.getLogger("chef")
+        logger.setLevel(LOG_LEVEL)
+        logger.addHandler(QueueHandler(log_queue))
+        logger.propagate = False
+
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_stop_listener)
+
+def _stop_listener() -> None:
+    """Write out the queued records and stop the listener thread"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+def _restart_listener() -> None:
+    """Start a listener thread again on the same queue and handlers"""
+    global _listener
+    if _listener is not None and _listener._thread is None:
+        _listener = QueueListener(_listener.queue, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+
+# Threads do not survive a fork (e.g. the pre-forked server workers): the listener
+# is drained and stopped before it, and restarted in both processes after it
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_stop_listener, after_in_parent=_restart_listener, after_in_child=_restart_listener)
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the "chef" hierarchy, setting up the queue handler on first use"""
+    setup_logging()
+    return logging.getLogger(f"chef.{name}")
+
+logger = get_logger("metrics")
+
+def _new_metrics(node: str) -> Dict[str, Any]:
+    return {
+        "node": node,
+        "wall_ms": 0.0,
+        "llm_calls": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "retrieval_hits": {},
+        "cache": {},
+    }
+
+def record_llm_usage(response: Any) -> None:
+    """Add the prompt/completion tokens reported by a chat model response to the current node"""
+    metrics = _node_metrics.get()
+    if metrics is None:
+        return
+    usage = getattr(response, "usage_metadata", None) or {}
+    metrics["llm_calls"] += 1
+    metrics["prompt_tokens"] += usage.get("input_tokens", 0)
+    metrics["completion_tokens"] += usage.get("output_tokens", 0)
+
+def record_retrieval(source: str, hits: int) -> None:
+    """Count documents returned by a retrieval source (pairing index, vector store, ...)"""
+    metrics = _node_metrics.get()
+    if metrics is not None:
+        metrics["retrieval_hits"][source] = metrics["retrieval_hits"].get(source, 0) + hits
+
+def record_cache(cache: str, hit: bool) -> None:
+    """Count a hit or miss of a cache for the current node"""
+    metrics = _node_metrics.get()
+    if metrics is not None:
+        counters = metrics["cache"].setdefault(cache, {"hits": 0, "misses": 0})
+        counters["hits" if hit else "misses"] += 1
+
+def _finish(metrics: Dict[str, Any], start: float, update: Any) -> Any:
+    metrics["wall_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    logger.info(f"Node {metrics['node']} done in {metrics['wall_ms']:.0f} ms", extra={"data": {"event": "node", **metrics}})
+    if isinstance(update, dict):
+        update = {**update, "node_metrics": [metrics]}
+    return update
+
+def instrument_node(node: str, func: Callable) -> Callable:
+    """
+    Wrap a sync or async graph node: time it, collect the metrics recorded while
+    it runs and append them to the `node_metrics` list of the state.
+    """
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(state, *args, **kwargs):
+            metrics = _new_metrics(node)
+            token = _node_metrics.set(metrics)
+            start = time.perf_counter()
+            try:
+                update = await func(state, *args, **kwargs)
+            finally:
+                _node_metrics.reset(token)
+            return _finish(metrics, start, update)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(state, *args, **kwargs):
+        metrics = _new_metrics(node)
+        token = _node_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            update = func(state, *args, **kwargs)
+        finally:
+            _node_metrics.reset(token)
+        return _finish(metrics, start, update)
+    return wrapper
+
+def summarize_node_metrics(node_metrics: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Totals of one request: wall time per node, tokens, retrieval hits and cache hits/misses"""
+    summary: Dict[str, Any] = {
+        "wall_ms": 0.0,
+        "nodes_ms": {},
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "retrieval_hits": {},
+        "cache": {},
+    }
+    for metrics in node_metrics or []:
+        summary["wall_ms"] += metrics["wall_ms"]
+        summary["nodes_ms"][metrics["node"]] = summary["nodes_ms"].get(metrics["node"], 0.0) + metrics["wall_ms"]
+        summary["prompt_tokens"] += metrics["prompt_tokens"]
+        summary["completion_tokens"] += metrics["completion_tokens"]
+        for source, hits in metrics["retrieval_hits"].items():
+            summary["retrieval_hits"][source] = summary["retrieval_hits"].get(source, 0) + hits
+        for cache, counters in metrics["cache"].items():
+            totals = summary["cache"].setdefault(cache, {"hits": 0, "misses": 0})
+            totals["hits"] += counters["hits"]
+            totals["misses"] += counters["misses"]
+    summary["wall_ms"] = round(summary["wall_ms"], 3)
+    return summary
@@ -0,0 +1,301 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from instrumentation import get_logger
+
+load_dotenv()
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))                  # graph runs at the same time, all sessions included
+# "thread" runs the jobs in this process, "process" in a pool of spawned processes
+# (which needs SESSION_CHECKPOINT_PATH, the processes share the session checkpoints through it)
+JOB_WORKER_MODE = os.getenv("JOB_WORKER_MODE", "thread")
+JOB_POLL_INTERVAL_S = float(os.getenv("JOB_POLL_INTERVAL_S", 1.0))
+JOB_RETENTION_S = int(os.getenv("JOB_RETENTION_S", 7 * 24 * 3600))  # finished jobs are deleted after this
+PARTIAL_WRITE_INTERVAL_S = 0.5  # how often the recipe streamed so far is saved for the pollers
+
+SUBMITTED = "submitted"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+logger = get_logger("jobs")
+
+class JobStore:
+    """
+    Recipe requests persisted in SQLite with their status (submitted, running,
+    done, failed), progress and result, so a page reload or another process can
+    follow a job it did not start.
+    """
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        self._conn = None
+        self._conn_pid = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        """Connection opened on first use in each process (the job processes share the file)"""
+        if self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                       id TEXT PRIMARY KEY,
+                       session_id TEXT NOT NULL,
+                       status TEXT NOT NULL,
+                       request TEXT NOT NULL,
+                       node TEXT,
+                       partial TEXT,
+                       result TEXT,
+                       error TEXT,
+                       worker TEXT,
+                       created_at REAL NOT NULL,
+                       started_at REAL,
+                       finished_at REAL
+                   )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            self._conn.commit()
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        """Run a write statement, return the number of rows it changed"""
+        with self._lock:
+            db = self._db()
+            changed = db.execute(sql, params).rowcount
+            db.commit()
+            return changed
+
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._db().execute(sql, params).fetchall()
+
+    @staticmethod
+    def _row(row: tuple) -> Dict[str, Any]:
+        (job_id, session_id, status, request, node, partial, result, error, worker,
+         created_at, started_at, finished_at) = row
+        return {
+            "id": job_id, "session_id": session_id, "status": status, "request": json.loads(request),
+            "node": node, "partial": partial, "result": json.loads(result) if result else None,
+            "error": error, "worker": worker,
+            "created_at": created_at, "started_at": started_at, "finished_at": finished_at,
+        }
+
+    def submit(self, session_id: str, request: Dict[str, Any]) -> str:
+        """Queue a request and return its job id"""
+        job_id = uuid.uuid4().hex
+        self._execute(
+            "INSERT INTO jobs (id, session_id, status, request, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, session_id, SUBMITTED, json.dumps(request), time.time())
+        )
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Mark the oldest submitted job as running for `worker`, None if the queue is empty"""
+        while True:
+            rows = self._query("SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (SUBMITTED,))
+            if not rows:
+                return None
+            # Another process may have claimed it since, then look again
+            claimed = self._execute(
+                "UPDATE jobs SET status = ?, worker = ?, started_at = ? WHERE id = ? AND status = ?",
+                (RUNNING, worker, time.time(), rows[0][0], SUBMITTED)
+            )
+            if claimed:
+                return self.get(rows[0][0])
+
+    def progress(self, job_id: str, node: Optional[str] = None, partial: Optional[str] = None) -> None:
+        """Record the last completed node and/or the recipe generated so far"""
+        if node is not None:
+            self._execute("UPDATE jobs SET node = ? WHERE id = ?", (node, job_id))
+        if partial is not None:
+            self._execute("UPDATE jobs SET partial = ? WHERE id = ?", (partial, job_id))
+
+    def finish(self, job_id: str, result: Dict[str, Any]) -> None:
+        self._execute(
+            "UPDATE jobs SET status = ?, result = ?, partial = NULL, finished_at = ? WHERE id = ?",
+            (DONE, json.dumps(result), time.time(), job_id)
+        )
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._execute(
+            "UPDATE jobs SET status = ?, error = ?, partial = NULL, finished_at = ? WHERE id = ?",
+            (FAILED, error, time.time(), job_id)
+        )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return self._row(rows[0]) if rows else None
+
+    def session_jobs(self, session_id: str) -> List[Dict[str, Any]]:
+        """Jobs of a chat session, oldest first"""
+        rows = self._query("SELECT * FROM jobs WHERE session_id = ? ORDER BY created_at", (session_id,))
+        return [self._row(row) for row in rows]
+
+    def requeue_running(self) -> int:
+        """Put back in the queue the jobs left running by a process that stopped"""
+        return self._execute(
+            "UPDATE jobs SET status = ?, worker = NULL, started_at = NULL, node = NULL, partial = NULL WHERE status = ?",
+            (SUBMITTED, RUNNING)
+        )
+
+    def purge(self, max_age: int = JOB_RETENTION_S) -> int:
+        """Delete the jobs finished more than `max_age` seconds ago"""
+        return self._execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (*FINISHED, time.time() - max_age)
+        )
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._query("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        return {**{status: 0 for status in (SUBMITTED, RUNNING, DONE, FAILED)}, **dict(rows)}
+
+def run_recipe_job(job_id: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run the chat turn of a job in its session's thread, saving the completed
+    nodes and the streamed recipe in the job store as they come. Module level
+    so the process pool can pickle it.
+    """
+    from graph import run_session_turn
+    from instrumentation import summarize_node_metrics
+    from resources import get_job_store, get_session_graph
+
+    store = get_job_store()
+    streamed = []
+    last_write = [0.0]
+
+    def on_event(kind: str, payload: str) -> None:
+        if kind == "node":
+            store.progress(job_id, node=payload)
+            return
+        streamed.append(payload)
+        if time.monotonic() - last_write[0] >= PARTIAL_WRITE_INTERVAL_S:
+            last_write[0] = time.monotonic()
+            store.progress(job_id, partial="".join(streamed))
+
+    final_state = run_session_turn(get_session_graph(), request["session_id"], request["text"],
+                                   request.get("dietary_preferences") or [], request.get("language"),
+                                   fresh=request.get("fresh", False), on_event=on_event)
+    return {
+        "final_recipe": final_state.get("final_recipe"),
+        "error_message": final_state.get("error_message"),
+        "language": final_state.get("user_language"),
+        "cached_desire": final_state.get("cached_desire"),
+        "metrics": summarize_node_metrics(final_state.get("node_metrics", [])) if not final_state.get("cached_desire") else None,
+    }
+
+def _share_llm_quota(shares: int) -> None:
+    """Give this process its share of the Groq quota, which is per API key"""
+    from resources import set_resource
+    from scheduler import GROQ_REQUESTS_PER_MINUTE, GROQ_TOKENS_PER_MINUTE, RateLimitScheduler
+
+    set_resource("llm_scheduler", RateLimitScheduler(GROQ_REQUESTS_PER_MINUTE / shares, GROQ_TOKENS_PER_MINUTE / shares))
+
+def _check_process_mode() -> None:
+    """Jobs of a session can land in any process, its checkpoints must be in the shared SQLite file"""
+    from refinement import SESSION_CHECKPOINT_PATH
+
+    if not SESSION_CHECKPOINT_PATH:
+        raise ValueError("JOB_WORKER_MODE=process needs SESSION_CHECKPOINT_PATH, in-memory session checkpoints are per process")
+    try:
+        import langgraph.checkpoint.sqlite  # noqa: F401
+    except ImportError as e:
+        raise ValueError("JOB_WORKER_MODE=process needs langgraph-checkpoint-sqlite for the session checkpoints") from e
+
+class JobQueue:
+    """
+    Pool of `workers` threads taking the submitted jobs in order. It bounds how
+    many graph runs happen at once whatever the number of sessions, and keeps
+    them out of the Streamlit script threads. In "process" mode each thread
+    hands its job to a spawned process of a pool of the same size; the Groq
+    quota is split between the processes and this one (e.g. for prewarming).
+    """
+
+    def __init__(self, store: JobStore, runner: Callable[[str, Dict[str, Any]], Dict[str, Any]] = run_recipe_job,
+                 workers: int = JOB_WORKERS, mode: str = JOB_WORKER_MODE, poll_interval: float = JOB_POLL_INTERVAL_S):
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.completed = 0
+        self.failed = 0
+        self._run_times: List[float] = []
+        self._wake = threading.Condition()
+        self._stopping = False
+        self._pool = None
+        if mode == "process":
+            _check_process_mode()
+            _share_llm_quota(workers + 1)
+            self._pool = ProcessPoolExecutor(workers, mp_context=get_context("spawn"),
+                                             initializer=_share_llm_quota, initargs=(workers + 1,))
+
+        # One queue owns the file: whatever is still running was cut off by a restart
+        requeued = store.requeue_running()
+        purged = store.purge()
+        if requeued or purged:
+            logger.info(f"Job queue opened: {requeued} interrupted jobs requeued, {purged} old jobs deleted")
+
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, session_id: str, request: Dict[str, Any]) -> str:
+        job_id = self.store.submit(session_id, {**request, "session_id": session_id})
+        with self._wake:
+            self._wake.notify()
+        return job_id
+
+    def _work(self) -> None:
+        worker = f"{os.getpid()}/{threading.current_thread().name}"
+        while not self._stopping:
+            job = self.store.claim(worker)
+            if job is None:
+                # Jobs submitted by other processes are only seen when polling
+                with self._wake:
+                    self._wake.wait(self.poll_interval)
+                continue
+
+            start = time.perf_counter()
+            try:
+                if self._pool is not None:
+                    result = self._pool.submit(self.runner, job["id"], job["request"]).result()
+                else:
+                    result = self.runner(job["id"], job["request"])
+                self.store.finish(job["id"], result)
+                self.completed += 1
+            except Exception as e:
+                logger.exception(f"Job {job['id']} failed")
+                self.store.fail(job["id"], str(e))
+                self.failed += 1
+            self._run_times = (self._run_times + [time.perf_counter() - start])[-100:]
+
+    def shutdown(self) -> None:
+        self._stopping = True
+        with self._wake:
+            self._wake.notify_all()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        run_times = self._run_times
+        return {
+            "workers": self.workers,
+            "mode": self.mode,
+            "jobs": self.store.counts(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "mean_run_s": round(sum(run_times) / len(run_times), 2) if run_times else None,
+        }
@@ -1,14 +1,28 @@
 import os
-from dotenv import load_dotenv
-from graph import build_recipe_agent_graph
-from state import RecipeAgentState
+import json
+import uuid
+import time
+import asyncio
+import argparse
+from typing import Any, Dict, List, Set
+from langdetect import detect
+import langdetect.lang_detect_exception
+from resources import get_graph, get_session_graph
+from refinement import build_turn_input, session_config
+from state import build_initial_state
+from graph import arun_recipe_agent, cached_session_turn, remember_recipe
+from scheduler import BATCH, priority
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
 
 def run_chef_innovativo():
     """Main execution function with better error handling"""
-    app = build_recipe_agent_graph()
+    app = get_session_graph()
+    config = session_config(uuid.uuid4().hex)
     
     print("🍳 Welcome to Chef Innovativo!")
     print("I'll help you create unique recipes by combining traditional dishes with innovative pairings.")
+    print("Follow-ups like 'make it vegan' or 'for 2 people' refine the last recipe.")
     print("Type 'exit' to quit.\n")
     
     while True:
@@ -22,28 +36,18 @@ def run_chef_innovativo():
             dietary_input = input("Any dietary preferences? (optional): ").strip()
             dietary_prefs = [p.strip() for p in dietary_input.split(',') if p.strip()]
             
-            # Initialize state
-            initial_state = RecipeAgentState(
-                messages=[],
-                user_desire=user_input,
-                dietary_preferences=dietary_prefs,
-                base_recipe_query=None,
-                base_recipe_search_results=None,
-                extracted_ingredients_from_base_recipe=[],
-                pairing_query=None,
-                pairing_results=None,
-                final_recipe=None,
-                error_message=None,
-                retry_count=0,
-                tool_calls=[],
-                tool_results=[],
-                awaiting_user_input=False
-            )
+            # A new request, or a refinement reusing the session's previous results
+            turn_input = build_turn_input(user_input, dietary_prefs, _detect_language(user_input),
+                                          app.get_state(config).values)
             
             print("\n🔥 Creating your innovative recipe...")
             
-            # Execute the graph
-            final_state = app.invoke(initial_state)
+            # Execute the graph, unless a similar request is in the recipe cache
+            final_state = cached_session_turn(app, config, turn_input)
+            if final_state is None:
+                final_state = app.invoke(turn_input, config)
+                if "user_desire" in turn_input:
+                    remember_recipe(turn_input, final_state)
             
             # Handle results
             if final_state.get("final_recipe"):
@@ -66,5 +70,120 @@ def run_chef_innovativo():
             print(f"\n💥 Unexpected error: {e}")
             continue
 
+def _detect_language(text: str) -> str:
+    try:
+        return detect(text)
+    except langdetect.lang_detect_exception.LangDetectException:
+        return 'en'
+
+def load_batch_requests(input_path: str) -> List[Dict[str, Any]]:
+    """
+    Read the {desire, dietary_preferences, language, fresh} requests of a JSONL file.
+    A request without an "id" is identified by its line number.
+    """
+    requests = []
+    with open(input_path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            request.setdefault("id", str(line_number))
+            requests.append(request)
+    return requests
+
+def load_completed_ids(output_path: str) -> Set[str]:
+    """Ids already answered in the output file, which doubles as the resume checkpoint"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # line cut short by an interrupted run
+            if result.get("status") == "done":
+                completed.add(str(result["id"]))
+    return completed
+
+async def _run_batch_request(request: Dict[str, Any], app, semaphore: asyncio.Semaphore, fresh: bool = False) -> Dict[str, Any]:
+    desire = request.get("desire", "")
+    language = request.get("language") or _detect_language(desire)
+    # Batch LLM calls yield to interactive ones when they share the quota
+    with priority(BATCH):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                initial_state = build_initial_state(desire, request.get("dietary_preferences") or [], language)
+                final_state = await arun_recipe_agent(initial_state, app, fresh=fresh or bool(request.get("fresh")))
+            except Exception as e:
+                final_state = {"error_message": f"Unexpected error: {e}"}
+            elapsed = time.perf_counter() - start
+    
+    return {
+        "id": request["id"],
+        "desire": desire,
+        "dietary_preferences": request.get("dietary_preferences") or [],
+        "language": language,
+        "status": "done" if final_state.get("final_recipe") else "failed",
+        "final_recipe": final_state.get("final_recipe"),
+        "error_message": final_state.get("error_message"),
+        "cached_desire": final_state.get("cached_desire"),
+        "elapsed_s": round(elapsed, 2),
+    }
+
+async def arun_batch(input_path: str, output_path: str, concurrency: int = BATCH_CONCURRENCY, fresh: bool = False) -> Dict[str, Any]:
+    """
+    Run every request of a JSONL file through the graph with at most `concurrency`
+    in flight. Results are appended to `output_path` in completion order, so an
+    interrupted run resumes with the requests that are not done yet (failed ones
+    are retried). Requests similar to an earlier one are served from the recipe
+    cache unless `fresh` (or the request's own "fresh") is set.
+    """
+    requests = load_batch_requests(input_path)
+    completed = load_completed_ids(output_path)
+    pending = [request for request in requests if str(request["id"]) not in completed]
+    print(f"🍳 {len(requests)} requests, {len(requests) - len(pending)} already done, {len(pending)} to run (concurrency {concurrency})")
+    
+    app = get_graph()
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [asyncio.create_task(_run_batch_request(request, app, semaphore, fresh)) for request in pending]
+    
+    done = failed = 0
+    start = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as output:
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            
+            done += 1
+            failed += result["status"] != "done"
+            rate = done / (time.perf_counter() - start) * 60
+            print(f"[{done}/{len(pending)}] {result['id']} {result['status']} in {result['elapsed_s']}s - {rate:.1f} requests/min")
+    
+    elapsed = time.perf_counter() - start
+    stats = {
+        "completed": done - failed,
+        "failed": failed,
+        "elapsed_s": round(elapsed, 2),
+        "requests_per_min": round(done / elapsed * 60, 2) if done else 0.0,
+    }
+    print(f"✅ Batch finished: {stats['completed']} done, {stats['failed']} failed, {stats['requests_per_min']} requests/min")
+    return stats
+
+def run_batch(input_path: str, output_path: str, concurrency: int = BATCH_CONCURRENCY, fresh: bool = False) -> Dict[str, Any]:
+    return asyncio.run(arun_batch(input_path, output_path, concurrency, fresh))
+
 if __name__ == "__main__":
-    run_chef_innovativo()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Chef Innovativo: interactive, or batch over a JSONL file of requests")
+    parser.add_argument("--batch", metavar="JSONL", help="requests file, one {desire, dietary_preferences, language} per line")
+    parser.add_argument("--output", default="recipes.jsonl", help="results file for --batch, also used to resume an interrupted run")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="requests in flight for --batch")
+    parser.add_argument("--fresh", action="store_true", help="generate every recipe, skipping the recipe cache")
+    args = parser.parse_args()
+    
+    if args.batch:
+        run_batch(args.batch, args.output, args.concurrency, args.fresh)
+    else:
+        run_chef_innovativo()
\ No newline at end of file
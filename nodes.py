@@ -1,83 +1,162 @@
 import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from langchain_core.messages import HumanMessage, AIMessage
 from state import RecipeAgentState
-from tools import llm, tavily_search_tool, search_food_pairings
+from tools import (
+    search_food_pairings,
+    search_food_pairings_for_ingredients,
+    asearch_food_pairings_for_ingredients,
+    merge_pairing_results,
+    PAIRING_RETRIEVAL_MODE
+)
+from resources import get_ingredient_extractor, get_llm, get_pairing_index, get_search_tool
+from cache import get_search_cache, normalize_query
+from coalesce import llm_flights, pairing_flights, search_flights
+from context import compress_context
+from ingredient_extractor import INGREDIENT_EXTRACTION, MAX_INGREDIENTS, MIN_CONFIDENCE
+from instrumentation import get_logger, record_cache, record_llm_usage
+from refinement import completed_request_update, refinement_update
+
+logger = get_logger("nodes")
 
 def start_node(state: RecipeAgentState) -> Dict[str, Any]:
     """Initialize the conversation"""
-    print("🍳 Starting recipe creation process...")
+    logger.info("🍳 Starting recipe creation process...")
     
     if not state["user_desire"]:
         return {"awaiting_user_input": True}
     
-    return {"awaiting_user_input": False}
+    # In a checkpointed session, follow-ups resume after the nodes whose inputs did not change
+    return {"awaiting_user_input": False, **refinement_update(state)}
+
+async def astart_node(state: RecipeAgentState) -> Dict[str, Any]:
+    """Async version of start_node"""
+    # The async nodes keep the SQLite, FAISS and CPU-bound work off the event loop
+    return await asyncio.to_thread(start_node, state)
+
+def _invoke_llm(prompt: str) -> Any:
+    """LLM call shared by identical prompts in flight at the same time"""
+    def call():
+        response = get_llm().invoke([HumanMessage(content=prompt)])
+        record_llm_usage(response)
+        return response
+    
+    return llm_flights.do(prompt, call)
+
+async def _ainvoke_llm(prompt: str) -> Any:
+    """Async version of _invoke_llm"""
+    async def call():
+        response = await get_llm().ainvoke([HumanMessage(content=prompt)])
+        record_llm_usage(response)
+        return response
+    
+    return await llm_flights.ado(prompt, call)
+
+def format_base_recipe_results(results: Any) -> Optional[str]:
+    """Turn the raw Tavily payload into the text passed to the other nodes"""
+    formatted_results = []
+    
+    if isinstance(results, dict):
+        # If results is a dict, look for 'results' key
+        if 'results' in results:
+            search_results = results['results']
+        else:
+            search_results = [results]  # Treat the dict as a single result
+    elif isinstance(results, list):
+        search_results = results
+    elif isinstance(results, str):
+        # If it's already a string, use it directly
+        return results
+    else:
+        # Fallback for unknown types
+        return str(results)
+    
+    # Process the search results
+    for i, result in enumerate(search_results[:3]):  # Top 3 results
+        if isinstance(result, dict):
+            title = result.get('title', result.get('name', f'Recipe {i+1}'))
+            content = result.get('content', result.get('snippet', result.get('description', 'No description available')))
+            url = result.get('url', '')
+            
+            formatted_result = f"**{title}**\n{content}"
+            if url:
+                formatted_result += f"\nSource: {url}"
+            
+            formatted_results.append(formatted_result)
+        elif isinstance(result, str):
+            formatted_results.append(f"**Recipe {i+1}**\n{result}")
+        else:
+            formatted_results.append(f"**Recipe {i+1}**\n{str(result)}")
+    
+    return "\n\n".join(formatted_results) if formatted_results else None
+
+def _cached_base_recipe(query: str, state: RecipeAgentState) -> Optional[Dict[str, Any]]:
+    """Return the node update from the search cache, or None on a miss"""
+    bypass = bool(state.get("bypass_cache"))
+    cached_results = get_search_cache().get(query, bypass=bypass)
+    if not bypass:
+        record_cache("search", cached_results is not None)
+    if cached_results is None:
+        return None
+    
+    logger.info("Search cache hit")
+    return {
+        "base_recipe_search_results": cached_results,
+        "base_recipe_query": query
+    }
+
+def _base_recipe_update(query: str, results: Any, state: RecipeAgentState) -> Dict[str, Any]:
+    """Format fresh Tavily results, store them in the search cache and build the node update"""
+    logger.debug(f"Search results type: {type(results).__name__}")
+    
+    formatted_results = format_base_recipe_results(results)
+    
+    if formatted_results:
+        get_search_cache().set(query, formatted_results, bypass=bool(state.get("bypass_cache")))
+        return {
+            "base_recipe_search_results": formatted_results,
+            "base_recipe_query": query
+        }
+    else:
+        return {"error_message": "No useful recipe information found"}
 
 def search_base_recipe_node(state: RecipeAgentState) -> Dict[str, Any]:
-    """Search for a base recipe using Tavily - FIXED VERSION"""
-    print(f"🔍 Searching for base recipe: {state['user_desire']}")
+    """Search for a base recipe using Tavily, going through the persistent search cache"""
+    logger.info(f"🔍 Searching for base recipe: {state['user_desire']}")
     
     try:
         query = f"{state['user_desire']} recipe cooking instructions"
-        print(f"Search query: {query}")
-        
-        # Call Tavily search
-        results = tavily_search_tool.invoke(query)
-        print(f"Raw results type: {type(results)}")
-        print(f"Raw results: {results}")
+        logger.debug(f"Search query: {query}")
         
-        # Handle different possible result formats
-        formatted_results = []
+        cached_update = _cached_base_recipe(query, state)
+        if cached_update is not None:
+            return cached_update
         
-        if isinstance(results, dict):
-            # If results is a dict, look for 'results' key
-            if 'results' in results:
-                search_results = results['results']
-            else:
-                search_results = [results]  # Treat the dict as a single result
-        elif isinstance(results, list):
-            search_results = results
-        elif isinstance(results, str):
-            # If it's already a string, use it directly
-            return {
-                "base_recipe_search_results": results,
-                "base_recipe_query": query
-            }
-        else:
-            # Fallback for unknown types
-            return {
-                "base_recipe_search_results": str(results),
-                "base_recipe_query": query
-            }
+        # Call Tavily search, once for identical queries in flight
+        results = search_flights.do(normalize_query(query), lambda: get_search_tool().invoke(query))
+        return _base_recipe_update(query, results, state)
+            
+    except Exception as e:
+        logger.exception(f"Error in search_base_recipe_node: {e}")
+        return {"error_message": f"Error searching for base recipe: {str(e)}"}
+
+async def asearch_base_recipe_node(state: RecipeAgentState) -> Dict[str, Any]:
+    """Async version of search_base_recipe_node"""
+    logger.info(f"🔍 Searching for base recipe: {state['user_desire']}")
+    
+    try:
+        query = f"{state['user_desire']} recipe cooking instructions"
+        logger.debug(f"Search query: {query}")
         
-        # Process the search results
-        for i, result in enumerate(search_results[:3]):  # Top 3 results
-            if isinstance(result, dict):
-                title = result.get('title', result.get('name', f'Recipe {i+1}'))
-                content = result.get('content', result.get('snippet', result.get('description', 'No description available')))
-                url = result.get('url', '')
-                
-                formatted_result = f"**{title}**\n{content}"
-                if url:
-                    formatted_result += f"\nSource: {url}"
-                
-                formatted_results.append(formatted_result)
-            elif isinstance(result, str):
-                formatted_results.append(f"**Recipe {i+1}**\n{result}")
-            else:
-                formatted_results.append(f"**Recipe {i+1}**\n{str(result)}")
+        cached_update = await asyncio.to_thread(_cached_base_recipe, query, state)
+        if cached_update is not None:
+            return cached_update
         
-        if formatted_results:
-            return {
-                "base_recipe_search_results": "\n\n".join(formatted_results),
-                "base_recipe_query": query
-            }
-        else:
-            return {"error_message": "No useful recipe information found"}
+        results = await search_flights.ado(normalize_query(query), lambda: get_search_tool().ainvoke(query))
+        return await asyncio.to_thread(_base_recipe_update, query, results, state)
             
     except Exception as e:
-        print(f"Error in search_base_recipe_node: {str(e)}")
-        print(f"Error type: {type(e)}")
+        logger.exception(f"Error in asearch_base_recipe_node: {e}")
         return {"error_message": f"Error searching for base recipe: {str(e)}"}
 
 def debug_search_base_recipe_node(state: RecipeAgentState) -> Dict[str, Any]:
@@ -89,7 +168,7 @@ def debug_search_base_recipe_node(state: RecipeAgentState) -> Dict[str, Any]:
         print(f"Search query: {query}")
         
         # Call Tavily search
-        results = tavily_search_tool.invoke(query)
+        results = get_search_tool().invoke(query)
         
         # Detailed debugging
         print(f"Results type: {type(results)}")
@@ -122,13 +201,11 @@ def debug_search_base_recipe_node(state: RecipeAgentState) -> Dict[str, Any]:
         traceback.print_exc()
         return {"error_message": f"Error searching for base recipe: {str(e)}"}
 
-def extract_ingredients_node(state: RecipeAgentState) -> Dict[str, Any]:
-    """Extract key ingredients from the base recipe"""
-    print("📝 Extracting ingredients from base recipe...")
-    
+def build_extract_ingredients_prompt(state: RecipeAgentState) -> str:
+    """Prompt asking the LLM for the main ingredients of the base recipe"""
     base_recipe = state["base_recipe_search_results"]
     
-    prompt = f"""
+    return f"""
     From the following recipe information, extract the 3-4 main ingredients that would be most important for finding flavor pairings:
 
     {base_recipe}
@@ -136,35 +213,185 @@ def extract_ingredients_node(state: RecipeAgentState) -> Dict[str, Any]:
     Return only the main ingredients as a comma-separated list (e.g., "chicken, lemon, herbs, garlic").
     Focus on proteins, main vegetables, and dominant flavors.
     """
+
+def _ingredients_update(ingredients_text: str) -> Dict[str, Any]:
+    """Parse the comma-separated ingredients returned by the LLM"""
+    # Clean and parse ingredients
+    ingredients = [ing.strip() for ing in ingredients_text.strip().split(',') if ing.strip()]
+    
+    return {
+        "extracted_ingredients_from_base_recipe": ingredients,
+        "pairing_query": f"pairings for {' '.join(ingredients[:3])}"
+    }
+
+def _local_ingredients_update(state: RecipeAgentState) -> Optional[Dict[str, Any]]:
+    """Ingredients found by the local lexicon extractor, None when the LLM should be asked"""
+    if INGREDIENT_EXTRACTION == "llm":
+        return None
+    
+    extractor = get_ingredient_extractor()
+    if extractor is None:
+        return None
+    
+    ingredients, confidence = extractor.extract(state["base_recipe_search_results"] or "")
+    confident = confidence >= MIN_CONFIDENCE or (INGREDIENT_EXTRACTION == "local" and ingredients)
+    record_cache("local_extraction", bool(confident))
+    if not confident:
+        logger.info(f"Local ingredient extraction not confident ({confidence:.2f}), asking the LLM")
+        return None
+    
+    logger.info(f"Ingredients extracted locally ({confidence:.2f}): {ingredients}")
+    return _ingredients_update(", ".join(ingredients))
+
+def extract_ingredients_node(state: RecipeAgentState) -> Dict[str, Any]:
+    """Extract key ingredients from the base recipe, locally when possible"""
+    logger.info("📝 Extracting ingredients from base recipe...")
+    
+    local_update = _local_ingredients_update(state)
+    if local_update is not None:
+        return local_update
+    
+    prompt = build_extract_ingredients_prompt(state)
     
     try:
-        response = llm.invoke([HumanMessage(content=prompt)])
-        ingredients_text = response.content.strip()
-        
-        # Clean and parse ingredients
-        ingredients = [ing.strip() for ing in ingredients_text.split(',') if ing.strip()]
+        response = _invoke_llm(prompt)
+        return _ingredients_update(response.content)
         
-        return {
-            "extracted_ingredients_from_base_recipe": ingredients,
-            "pairing_query": f"pairings for {' '.join(ingredients[:3])}"
-        }
+    except Exception as e:
+        return {"error_message": f"Error extracting ingredients: {str(e)}"}
+
+async def aextract_ingredients_node(state: RecipeAgentState) -> Dict[str, Any]:
+    """Async version of extract_ingredients_node"""
+    logger.info("📝 Extracting ingredients from base recipe...")
+    
+    local_update = await asyncio.to_thread(_local_ingredients_update, state)
+    if local_update is not None:
+        return local_update
+    
+    prompt = build_extract_ingredients_prompt(state)
+    
+    try:
+        response = await _ainvoke_llm(prompt)
+        return _ingredients_update(response.content)
         
     except Exception as e:
         return {"error_message": f"Error extracting ingredients: {str(e)}"}
 
 def search_pairings_node(state: RecipeAgentState) -> Dict[str, Any]:
-    """Search for food pairings"""
-    print("🍯 Searching for flavor pairings...")
+    """Search for food pairings, one batched query per extracted ingredient in "multi" mode"""
+    logger.info("🍯 Searching for flavor pairings...")
     
     try:
-        query = state["pairing_query"]
-        results = search_food_pairings.invoke(query)
+        ingredients = state.get("extracted_ingredients_from_base_recipe") or []
+        if PAIRING_RETRIEVAL_MODE == "multi" and ingredients:
+            key = tuple(normalize_query(ingredient) for ingredient in ingredients)
+            results = pairing_flights.do(key, lambda: search_food_pairings_for_ingredients(ingredients))
+        else:
+            results = pairing_flights.do(normalize_query(state["pairing_query"]), lambda: search_food_pairings.invoke(state["pairing_query"]))
         
         return {"pairing_results": results}
         
     except Exception as e:
         return {"error_message": f"Error searching pairings: {str(e)}"}
 
+async def asearch_pairings_node(state: RecipeAgentState) -> Dict[str, Any]:
+    """Async version of search_pairings_node"""
+    logger.info("🍯 Searching for flavor pairings...")
+    
+    try:
+        ingredients = state.get("extracted_ingredients_from_base_recipe") or []
+        if PAIRING_RETRIEVAL_MODE == "multi" and ingredients:
+            key = tuple(normalize_query(ingredient) for ingredient in ingredients)
+            results = await pairing_flights.ado(key, lambda: asearch_food_pairings_for_ingredients(ingredients))
+        else:
+            results = await pairing_flights.ado(normalize_query(state["pairing_query"]), lambda: search_food_pairings.ainvoke(state["pairing_query"]))
+        
+        return {"pairing_results": results}
+        
+    except Exception as e:
+        return {"error_message": f"Error searching pairings: {str(e)}"}
+
+def desire_ingredients(user_desire: str) -> List[str]:
+    """Ingredients of the pairing index named in the request itself (e.g. "chicken with lemon and thyme")"""
+    pairing_index = get_pairing_index()
+    if pairing_index is None:
+        return []
+    return pairing_index.find_ingredients(user_desire or "")[:MAX_INGREDIENTS]
+
+def speculative_pairings_node(state: RecipeAgentState) -> Dict[str, Any]:
+    """Look up pairings for the ingredients named in the request while the base recipe is searched"""
+    ingredients = desire_ingredients(state["user_desire"])
+    if not ingredients:
+        return {"speculative_pairing_ingredients": [], "speculative_pairing_results": None}
+    
+    logger.info(f"🍯 Speculative pairing lookup for {ingredients}")
+    key = tuple(normalize_query(ingredient) for ingredient in ingredients)
+    results = pairing_flights.do(key, lambda: search_food_pairings_for_ingredients(ingredients))
+    return {"speculative_pairing_ingredients": ingredients, "speculative_pairing_results": results}
+
+async def aspeculative_pairings_node(state: RecipeAgentState) -> Dict[str, Any]:
+    """Async version of speculative_pairings_node"""
+    ingredients = await asyncio.to_thread(desire_ingredients, state["user_desire"])
+    if not ingredients:
+        return {"speculative_pairing_ingredients": [], "speculative_pairing_results": None}
+    
+    logger.info(f"🍯 Speculative pairing lookup for {ingredients}")
+    key = tuple(normalize_query(ingredient) for ingredient in ingredients)
+    results = await pairing_flights.ado(key, lambda: asearch_food_pairings_for_ingredients(ingredients))
+    return {"speculative_pairing_ingredients": ingredients, "speculative_pairing_results": results}
+
+def _uncovered_ingredients(state: RecipeAgentState) -> Tuple[Dict[str, Any], Optional[RecipeAgentState]]:
+    """
+    The ingredients update (when extraction was skipped because the request
+    already names enough ingredients) and the state for the ingredient-driven
+    search, None when the speculative lookup already covers every ingredient.
+    """
+    speculative = state.get("speculative_pairing_ingredients") or []
+    ingredients = state.get("extracted_ingredients_from_base_recipe") or []
+    update = {}
+    if not ingredients and speculative and not state.get("error_message"):
+        update = _ingredients_update(", ".join(speculative))
+        ingredients = speculative
+    
+    pairing_index = get_pairing_index()
+    uncovered = [
+        ingredient for ingredient in ingredients
+        if pairing_index is None or pairing_index.normalize(ingredient) not in speculative
+    ]
+    if not uncovered:
+        return update, None
+    return update, {
+        **state,
+        "extracted_ingredients_from_base_recipe": uncovered,
+        "pairing_query": f"pairings for {' '.join(uncovered[:3])}"
+    }
+
+def _merged_pairings_update(state: RecipeAgentState, update: Dict[str, Any]) -> Dict[str, Any]:
+    """Ingredient-driven results first, then the speculative ones not already among them"""
+    speculative_results = state.get("speculative_pairing_results")
+    if speculative_results:
+        record_cache("speculative_pairings", "pairing_results" not in update)
+        update["pairing_results"] = merge_pairing_results(update.get("pairing_results"), speculative_results)
+    return update
+
+def merge_pairings_node(state: RecipeAgentState) -> Dict[str, Any]:
+    """Reconcile the speculative pairings with the ingredient-driven search, run only for the ingredients they miss"""
+    update, search_state = _uncovered_ingredients(state)
+    if search_state is not None:
+        update.update(search_pairings_node(search_state))
+    else:
+        logger.info("🍯 Speculative pairings cover every ingredient, skipping the pairing search")
+    return _merged_pairings_update(state, update)
+
+async def amerge_pairings_node(state: RecipeAgentState) -> Dict[str, Any]:
+    """Async version of merge_pairings_node"""
+    update, search_state = await asyncio.to_thread(_uncovered_ingredients, state)
+    if search_state is not None:
+        update.update(await asearch_pairings_node(search_state))
+    else:
+        logger.info("🍯 Speculative pairings cover every ingredient, skipping the pairing search")
+    return _merged_pairings_update(state, update)
+
 def get_language_instructions(lang_code: str) -> str:
     """Get specific language instructions for the LLM"""
     language_instructions = {
@@ -183,24 +410,43 @@ def get_language_instructions(lang_code: str) -> str:
     
     return language_instructions.get(lang_code, language_instructions['it'])
 
-def generate_recipe_node(state: RecipeAgentState) -> Dict[str, Any]:
-    """Generate the final innovative recipe"""
-    print("👨‍🍳 Generating innovative recipe...")
-    
+def build_generate_recipe_prompt(state: RecipeAgentState) -> str:
+    """Prompt asking the LLM for the final innovative recipe"""
     dietary_prefs = ", ".join(state['dietary_preferences']) if state['dietary_preferences'] else "none"
     user_language = state.get('user_language', 'it')
     
     # Get specific language instructions
     language_instruction = get_language_instructions(user_language)
     
-    prompt = f"""
+    # Deduplicated, ranked and token-budgeted web and book passages
+    context = compress_context(
+        state['base_recipe_search_results'],
+        state.get('pairing_results'),
+        state.get('extracted_ingredients_from_base_recipe') or [],
+        state['user_desire']
+    )
+    
+    refinements = state.get('refinements') or []
+    completed = state.get('completed_request')
+    refinement_section = ""
+    if refinements and completed:
+        changes = "\n".join(f"    - {refinement}" for refinement in refinements)
+        refinement_section = f"""
+    Adapt the recipe you proposed before:
+    {completed['final_recipe']}
+
+    Changes requested by the user:
+{changes}
+    """
+    
+    return f"""
     {language_instruction}
 
     Create an innovative recipe based on:
     - User request: {state['user_desire']}
     - Dietary preferences: {dietary_prefs}
-    - Base recipe: {state['base_recipe_search_results']}
-    - Flavor pairings: {state.get('pairing_results', 'No specific pairings found')}
+    - Base recipe: {context['base_recipe']}
+    - Flavor pairings: {context['pairing_results'] or 'No specific pairings found'}
 
     Format your response as a complete recipe with:
     - Creative title
@@ -209,26 +455,50 @@ def generate_recipe_node(state: RecipeAgentState) -> Dict[str, Any]:
     - Serving suggestions
 
     Make it innovative by incorporating the suggested pairings while keeping it practical.
-    
+    {refinement_section}
     Remember: The user's language is {user_language}. Write EVERYTHING in this language including measurements, cooking terms, and all text.
     """
+
+def _recipe_update(recipe_text: str, state: RecipeAgentState) -> Dict[str, Any]:
+    """Validate the generated recipe"""
+    recipe = recipe_text.strip()
+    
+    # Simple validation
+    if len(recipe) > 100:
+        return {"final_recipe": recipe, **completed_request_update(state, recipe)}
+    else:
+        return {"error_message": "Generated recipe seems incomplete"}
+
+def generate_recipe_node(state: RecipeAgentState) -> Dict[str, Any]:
+    """Generate the final innovative recipe"""
+    logger.info("👨‍🍳 Generating innovative recipe...")
+    
+    prompt = build_generate_recipe_prompt(state)
     
     try:
-        response = llm.invoke([HumanMessage(content=prompt)])
-        recipe = response.content.strip()
-        
-        # Simple validation
-        if len(recipe) > 100:
-            return {"final_recipe": recipe}
-        else:
-            return {"error_message": "Generated recipe seems incomplete"}
+        response = _invoke_llm(prompt)
+        return _recipe_update(response.content, state)
+            
+    except Exception as e:
+        return {"error_message": f"Error generating recipe: {str(e)}"}
+
+async def agenerate_recipe_node(state: RecipeAgentState) -> Dict[str, Any]:
+    """Async version of generate_recipe_node"""
+    logger.info("👨‍🍳 Generating innovative recipe...")
+    
+    # Context compression counts tokens over every passage
+    prompt = await asyncio.to_thread(build_generate_recipe_prompt, state)
+    
+    try:
+        response = await _ainvoke_llm(prompt)
+        return _recipe_update(response.content, state)
             
     except Exception as e:
         return {"error_message": f"Error generating recipe: {str(e)}"}
 
 def clarify_input_node(state: RecipeAgentState) -> Dict[str, Any]:
     """Ask for clarification when needed"""
-    print("❓ Requesting clarification...")
+    logger.info("❓ Requesting clarification...")
     
     error_msg = state.get("error_message", "")
     user_language = state.get('user_language', 'it')
@@ -274,4 +544,8 @@ def clarify_input_node(state: RecipeAgentState) -> Dict[str, Any]:
     return {
         "messages": [AIMessage(content=message)],
         "awaiting_user_input": True
-    }
\ No newline at end of file
+    }
+
+async def aclarify_input_node(state: RecipeAgentState) -> Dict[str, Any]:
+    """Async version of clarify_input_node"""
+    return clarify_input_node(state)
\ No newline at end of file
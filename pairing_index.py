@@ -0,0 +1,216 @@
+import os
+import re
+import gzip
+import json
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from pdf_processor import PDF_PATH, VECTOR_DB_PATH, load_pdf_pages
+from instrumentation import get_logger
+
+PAIRING_INDEX_FILE = "pairings.json.gz"
+
+# An entry of the book starts with a heading line "Ingredient &" followed by a line with the partner
+ENTRY_HEADING = re.compile(r"^([A-Z][^\n&]{0,40}?) ?& ?\n([A-Z][^\n&]{0,40}?) ?\n", re.M)
+CROSS_REFERENCE = re.compile(r"^See ([^&\n]+?) & ([^,\n]+?),")
+# A real ingredient heads many entries, this filters out stray matches (e.g. in the bibliography)
+MIN_ENTRIES_PER_INGREDIENT = 3
+
+logger = get_logger("pairing_index")
+
+# Common names that the book (US edition) spells differently
+INGREDIENT_ALIASES = {
+    "aubergine": "eggplant",
+    "beetroot": "beet",
+    "chilli": "chili",
+    "chile": "chili",
+    "coriander": "cilantro",
+    "coriander leaf": "cilantro",
+    "capsicum": "bell pepper",
+    "swede": "rutabaga",
+    "artichoke": "globe artichoke",
+    "goat's cheese": "goat cheese",
+    "blackcurrant": "black currant",
+    "prawn": "shellfish",
+    "shrimp": "shellfish",
+    "salmon": "oily fish",
+    "mackerel": "oily fish",
+    "sardine": "oily fish",
+    "cod": "white fish",
+    "parmesan": "hard cheese",
+    "pecorino": "hard cheese",
+    "cheddar": "hard cheese",
+    "guanciale": "bacon",
+    "pancetta": "bacon",
+    "ham": "prosciutto",
+    "star anise": "anise",
+    "fennel": "anise",
+}
+
+# Words of a pairing query that are not ingredients (e.g. "pairings for chicken and yuzu")
+QUERY_FILLER_WORDS = {
+    "pairing", "pairings", "pair", "pairs", "combination", "combinations", "suggestion", "suggestions",
+    "ideas", "flavour", "flavours", "flavor", "flavors", "ingredient", "ingredients", "food", "foods",
+    "what", "goes", "go", "well", "good", "best", "for", "and", "with", "or", "of", "the", "a", "an",
+    "to", "in", "on", "abbinamenti", "abbinamento", "per", "con", "e", "di",
+}
+
+def _clean(text: str) -> str:
+    """Collapse the tab/space runs that the PDF text extraction produces"""
+    return re.sub(r"[ \t]+", " ", text)
+
+def _key(name: str) -> str:
+    return re.sub(r"\s+", " ", name).strip().lower()
+
+def build_pairing_index(page_texts: Iterable[str]) -> Dict[str, Any]:
+    """
+    Parse the "X & Y" entries of the Flavour Thesaurus into a compact index:
+    a list of entry texts and, for every ingredient, a map partner -> entry.
+    Cross references ("See Y & X") point to the entry they name.
+    """
+    text = _clean("\n".join(page_texts))
+    headings = list(ENTRY_HEADING.finditer(text))
+
+    counts = Counter(_key(match.group(1)) for match in headings)
+    ingredients = {name for name, count in counts.items() if count >= MIN_ENTRIES_PER_INGREDIENT}
+    names = {}
+
+    entries: List[str] = []
+    pairs: Dict[str, Dict[str, int]] = {}
+    cross_references: List[Tuple[str, str, str, str]] = []
+
+    for i, match in enumerate(headings):
+        first, second = _key(match.group(1)), _key(match.group(2))
+        if first not in ingredients or second not in ingredients:
+            continue
+        names.setdefault(first, re.sub(r"\s+", " ", match.group(1)).strip())
+        names.setdefault(second, re.sub(r"\s+", " ", match.group(2)).strip())
+
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+        lines = []
+        for line in text[match.end():end].strip().split("\n"):
+            # The next ingredient's section heading ends the entry
+            if _key(line) in ingredients:
+                break
+            lines.append(line.strip())
+        body = re.sub(r"\s+", " ", " ".join(lines)).strip()
+
+        reference = CROSS_REFERENCE.match(body)
+        if reference:
+            cross_references.append((first, second, _key(reference.group(1)), _key(reference.group(2))))
+            continue
+
+        pairs.setdefault(first, {})[second] = len(entries)
+        entries.append(body)
+
+    for first, second, target_first, target_second in cross_references:
+        entry = pairs.get(target_first, {}).get(target_second)
+        if entry is not None:
+            pairs.setdefault(first, {}).setdefault(second, entry)
+
+    return {"version": 1, "names": names, "entries": entries, "pairs": pairs}
+
+def missing_alias_targets(pairs: Dict[str, Any]) -> List[str]:
+    """Aliases pointing to an ingredient the index has no entries for, they can never match"""
+    return sorted(alias for alias, key in INGREDIENT_ALIASES.items() if key not in pairs)
+
+def pairing_index_path(db_path: Optional[str] = None) -> str:
+    return os.path.join(db_path or VECTOR_DB_PATH, PAIRING_INDEX_FILE)
+
+def save_pairing_index(data: Dict[str, Any], db_path: Optional[str] = None) -> None:
+    with gzip.open(pairing_index_path(db_path), "wt", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+
+class PairingIndex:
+    """Exact ingredient -> pairing -> text lookups over the parsed book"""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.names: Dict[str, str] = data["names"]
+        self.entries: List[str] = data["entries"]
+        self.pairs: Dict[str, Dict[str, int]] = data["pairs"]
+        self.max_name_words = max((len(name.split()) for name in self.pairs), default=1)
+        missing = missing_alias_targets(self.pairs)
+        if missing:
+            logger.warning(f"Ingredient aliases without an entry in the pairing index: {missing}")
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "PairingIndex":
+        with gzip.open(path or pairing_index_path(), "rt", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def normalize(self, ingredient: str) -> Optional[str]:
+        """Map an ingredient name to its key in the index, or None if the book has no entry for it"""
+        key = _key(ingredient)
+        for candidate in (key, key[:-1] if key.endswith("s") else None, key[:-2] if key.endswith("es") else None):
+            if not candidate:
+                continue
+            candidate = INGREDIENT_ALIASES.get(candidate, candidate)
+            if candidate in self.pairs:
+                return candidate
+        return None
+
+    def find_ingredients(self, text: str) -> List[str]:
+        """Ingredients of the index named in free text, longest names first (e.g. "goat cheese")"""
+        return self.match_ingredients(text)[0]
+
+    def match_ingredients(self, text: str) -> Tuple[List[str], List[str]]:
+        """
+        Ingredients of the index named in free text, and the other terms of the
+        text: runs of words between them, split at punctuation and without the
+        query filler words.
+        """
+        words = re.findall(r"[\w'’-]+|[,;:&+/]", text.lower())
+        found, unmatched, run = [], [], []
+
+        def end_run():
+            if run:
+                term = " ".join(run)
+                if term not in unmatched:
+                    unmatched.append(term)
+                run.clear()
+
+        i = 0
+        while i < len(words):
+            for size in range(min(self.max_name_words, len(words) - i), 0, -1):
+                key = self.normalize(" ".join(words[i:i + size]))
+                if key:
+                    end_run()
+                    if key not in found:
+                        found.append(key)
+                    i += size
+                    break
+            else:
+                if words[i] in QUERY_FILLER_WORDS or not re.match(r"\w", words[i]):
+                    end_run()
+                else:
+                    run.append(words[i])
+                i += 1
+        end_run()
+        return found, unmatched
+
+    def lookup(self, ingredient: str, partners: Iterable[str] = (), limit: int = 3) -> List[Tuple[str, str, str]]:
+        """
+        Book entries for an ingredient key as (ingredient, partner, text).
+        Entries pairing it with one of `partners` come first, then book order.
+        """
+        entries = self.pairs.get(ingredient, {})
+        preferred = [partner for partner in partners if partner in entries and partner != ingredient]
+        ordered = preferred + [partner for partner in entries if partner not in preferred]
+        return [
+            (self.names.get(ingredient, ingredient), self.names.get(partner, partner), self.entries[entries[partner]])
+            for partner in ordered[:limit]
+        ]
+
+def load_pairing_index() -> Optional[PairingIndex]:
+    """Load the pairing index, or None if it has not been built yet"""
+    path = pairing_index_path()
+    if not os.path.exists(path):
+        logger.warning(f"Pairing index '{path}' not found, exact pairing lookups are disabled.")
+        return None
+    return PairingIndex.load(path)
+
+if __name__ == "__main__":
+    logger.info(f"Loading PDF from: {PDF_PATH}")
+    pages = load_pdf_pages(PDF_PATH)
+    data = build_pairing_index(page.page_content for page in pages)
+    save_pairing_index(data)
+    logger.info(f"Pairing index with {len(data['pairs'])} ingredients and {len(data['entries'])} entries saved in : {pairing_index_path()}")
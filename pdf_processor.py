@@ -1,51 +1,486 @@
 import os
+import math
+import json
+import hashlib
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import faiss
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader
+
+try:
+    import resource
+except ImportError:  # not available on Windows, peak memory is then reported by psutil
+    resource = None
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
-import streamlit as st 
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+from pypdf import PdfReader
+from resources import get_embeddings, get_vector_store
+from chunk_store import chunk_store_exists, load_mmap_vector_store, load_writable_vector_store, save_vector_store
 
 load_dotenv()
 
 PDF_PATH = "The_Flavour_Thesaurus.pdf"
 VECTOR_DB_PATH = "faiss_abbinamenti_db"
 
-def process_pdf_and_create_vector_db():
+MANIFEST_FILE = "manifest.json"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size = CHUNK_SIZE,
+        chunk_overlap = CHUNK_OVERLAP
+    )
+
+def _hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _hash_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def _page_key(doc: Document) -> str:
+    # Only the file name, so the same PDF gives the same keys whatever the working directory
+    source = os.path.basename(doc.metadata.get('source', PDF_PATH))
+    return f"{source}:{doc.metadata.get('page', 0)}"
+
+def _chunk_id(page_key: str, text: str) -> str:
+    """Content hash of a chunk, also used as its docstore id"""
+    return _hash_text(f"{page_key}\n{text}")[:32]
+
+def _split_page(page: Document, text_splitter: RecursiveCharacterTextSplitter) -> Dict[str, Document]:
+    """Split a page into chunks keyed by their content hash"""
+    page_key = _page_key(page)
+    return {_chunk_id(page_key, chunk.page_content): chunk for chunk in text_splitter.split_documents([page])}
+
+def _manifest_path(db_path: Optional[str] = None) -> str:
+    return os.path.join(db_path or VECTOR_DB_PATH, MANIFEST_FILE)
+
+def load_manifest(db: Optional[FAISS] = None) -> Dict[str, Any]:
+    """
+    Load the ingestion manifest: for every page its content hash and the
+    docstore ids of its chunks, keyed by chunk hash. Indexes built before the
+    manifest existed are bootstrapped from their docstore (page hashes unknown).
+    """
+    path = _manifest_path()
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    
+    manifest = {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "files": {}, "pages": {}}
+    if db is not None:
+        for doc_id in db.index_to_docstore_id.values():
+            doc = db.docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                continue
+            page_key = _page_key(doc)
+            page = manifest["pages"].setdefault(page_key, {"hash": None, "chunks": {}})
+            page["chunks"][_chunk_id(page_key, doc.page_content)] = doc_id
+    return manifest
+
+def save_manifest(manifest: Dict[str, Any], db_path: Optional[str] = None) -> None:
+    with open(_manifest_path(db_path), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+# Index type used for new builds: exact "flat" search, or a compressed/approximate variant
+INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "sq8", "sq_fp16")
+HNSW_NEIGHBORS = 32
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 8
+PQ_BYTES_PER_VECTOR = 48
+
+def faiss_index_description(index_type: str, n_vectors: int, dim: int) -> str:
+    """faiss.index_factory description of an index type, sized for the number of vectors"""
+    # IVF needs ~39 training points per list, PQ ~39 per centroid of each sub-quantizer
+    nlist = max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+    pq_bits = max(4, min(8, int(math.log2(max(n_vectors // 39, 2)))))
+    pq_subquantizers = PQ_BYTES_PER_VECTOR if dim % PQ_BYTES_PER_VECTOR == 0 else dim // 8
+    
+    descriptions = {
+        "flat": "Flat",
+        "hnsw": f"HNSW{HNSW_NEIGHBORS},Flat",
+        "ivf_flat": f"IVF{nlist},Flat",
+        "ivf_pq": f"IVF{nlist},PQ{pq_subquantizers}x{pq_bits}",
+        "sq8": "SQ8",
+        "sq_fp16": "SQfp16",
+    }
+    if index_type not in descriptions:
+        raise ValueError(f"Unknown index type '{index_type}', choose one of {', '.join(INDEX_TYPES)}")
+    return descriptions[index_type]
+
+def create_faiss_index(index_type: str, vectors: np.ndarray) -> faiss.Index:
+    """Create, train and fill a FAISS index of the given type, keeping the order of `vectors`"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_vectors, dim = vectors.shape
+    index = faiss.index_factory(dim, faiss_index_description(index_type, n_vectors, dim))
+    
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    
+    if index_type == "hnsw":
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif index_type.startswith("ivf"):
+        faiss.extract_index_ivf(index).nprobe = IVF_NPROBE
+    return index
+
+def convert_index_type(db: FAISS, index_type: str) -> None:
+    """Replace the index of a store built with a flat index by another index type"""
+    if index_type == "flat":
+        return
+    vectors = db.index.reconstruct_n(0, db.index.ntotal)
+    db.index = create_faiss_index(index_type, vectors)
+    print(f"Converted the FAISS index to '{index_type}' ({faiss_index_description(index_type, *vectors.shape)}).")
+
+def _write_pairing_index(page_texts: List[str], db_path: Optional[str] = None) -> None:
+    """Rebuild the exact ingredient pairing index from the book pages"""
+    from pairing_index import build_pairing_index, save_pairing_index
+    
+    save_pairing_index(build_pairing_index(page_texts), db_path)
+
+def process_pdf_and_create_vector_db(pdf_path: str = PDF_PATH, index_type: Optional[str] = None):
     """Load the PDF file, split it to chuncks, create embeddings and save in FAISS"""
     
     if os.path.exists(VECTOR_DB_PATH):
         print(f"Vector Database '{VECTOR_DB_PATH}' already exists. Skipping the creation of it.")
         return 
     
-    print(f"Loading PDF from: {PDF_PATH}")
-    loader = PyPDFLoader(PDF_PATH)
-    documents = loader.load()
+    print(f"Loading PDF from: {pdf_path}")
+    documents = load_pdf_pages(pdf_path)
     print(f"Loaded {len(documents)} pages from the PDF file.")
     
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size = 1000,
-        chunk_overlap = 200
-    )
+    text_splitter = get_text_splitter()
     
-    texts = text_splitter.split_documents(documents)
+    file_hash = _hash_file(pdf_path)
+    index_type = index_type or INDEX_TYPE
+    
+    manifest = {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "index_type": index_type,
+        "files": {os.path.basename(pdf_path): file_hash},
+        "pages": {}
+    }
+    texts = {}
+    for page in documents:
+        chunks = _split_page(page, text_splitter)
+        manifest["pages"][_page_key(page)] = {
+            "hash": _hash_text(page.page_content),
+            "chunks": {chunk_id: chunk_id for chunk_id in chunks}
+        }
+        texts.update(chunks)
     print(f"The PDF file is been splitted into {len(texts)} chunks.")
     
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    embeddings = get_embeddings()
     print("Starting HuggingFace's embeddings...")
     
     print("Creating FAISS vector database...")
-    db = FAISS.from_documents(texts, embeddings)
-    db.save_local(VECTOR_DB_PATH)
+    db = FAISS.from_documents(list(texts.values()), embeddings, ids=list(texts.keys()))
+    convert_index_type(db, index_type)
+    save_vector_store(db, VECTOR_DB_PATH)
+    save_manifest(manifest)
+    _write_pairing_index([page.page_content for page in documents])
     print(f"FAISS vector database saved correctly in : {VECTOR_DB_PATH}")
+
+def update_vector_db_incremental(pdf_path: str = PDF_PATH) -> Dict[str, int]:
+    """
+    Incremental ingestion: hash every page and only split and embed the pages
+    whose content changed. New chunks are appended to the existing index and
+    chunks that disappeared are removed from it, instead of rebuilding it.
+    """
+    embeddings = get_embeddings()
+    db = load_vector_db(embeddings, writable=True) if os.path.exists(VECTOR_DB_PATH) else None
+    manifest = load_manifest(db)
+    
+    if (manifest.get("chunk_size"), manifest.get("chunk_overlap")) != (CHUNK_SIZE, CHUNK_OVERLAP):
+        raise ValueError("The chunking settings changed since the index was built: rebuild it from scratch")
+    
+    file_hash = _hash_file(pdf_path)
+    file_key = os.path.basename(pdf_path)
+    if db is not None and manifest.setdefault("files", {}).get(file_key) == file_hash:
+        print(f"'{pdf_path}' is unchanged since the last ingestion.")
+        return {"unchanged_pages": len(manifest["pages"]), "added_chunks": 0, "removed_chunks": 0}
+    
+    print(f"Loading PDF from: {pdf_path}")
+    pages = load_pdf_pages(pdf_path)
+    text_splitter = get_text_splitter()
+    
+    to_add: Dict[str, Document] = {}
+    to_delete: List[str] = []
+    seen_pages = set()
+    unchanged_pages = 0
+    
+    for page in pages:
+        page_key = _page_key(page)
+        page_hash = _hash_text(page.page_content)
+        seen_pages.add(page_key)
+        entry = manifest["pages"].get(page_key, {"hash": None, "chunks": {}})
+        
+        if entry["hash"] == page_hash:
+            unchanged_pages += 1
+            continue
+        
+        chunks = _split_page(page, text_splitter)
+        old_chunks = entry["chunks"]
+        
+        to_delete.extend(doc_id for chunk_id, doc_id in old_chunks.items() if chunk_id not in chunks)
+        new_chunks = {chunk_id: chunk for chunk_id, chunk in chunks.items() if chunk_id not in old_chunks}
+        to_add.update(new_chunks)
+        
+        manifest["pages"][page_key] = {
+            "hash": page_hash,
+            "chunks": {chunk_id: old_chunks.get(chunk_id, chunk_id) for chunk_id in chunks}
+        }
     
+    # Pages of this PDF that no longer exist
+    source_prefix = f"{os.path.basename(pdf_path)}:"
+    for page_key in [key for key in manifest["pages"] if key.startswith(source_prefix) and key not in seen_pages]:
+        to_delete.extend(manifest["pages"].pop(page_key)["chunks"].values())
+    
+    print(f"{unchanged_pages}/{len(pages)} pages unchanged, {len(to_add)} chunks to embed, {len(to_delete)} chunks to remove.")
+    
+    if to_delete and manifest.get("index_type") == "hnsw":
+        raise ValueError("HNSW indexes do not support removing vectors: rebuild the index from scratch")
+    if to_delete and db is not None:
+        db.delete(to_delete)
+    if to_add:
+        if db is None:
+            db = FAISS.from_documents(list(to_add.values()), embeddings, ids=list(to_add.keys()))
+        else:
+            db.add_documents(list(to_add.values()), ids=list(to_add.keys()))
+    
+    manifest.setdefault("files", {})[file_key] = file_hash
+    
+    if db is not None:
+        save_vector_store(db, VECTOR_DB_PATH)
+        save_manifest(manifest)
+        _write_pairing_index([page.page_content for page in pages])
+        print(f"FAISS vector database updated in : {VECTOR_DB_PATH}")
+    
+    return {"unchanged_pages": unchanged_pages, "added_chunks": len(to_add), "removed_chunks": len(to_delete)}
+
+INGEST_WORKERS = os.cpu_count() or 1
+EMBEDDING_BATCH_SIZE = 256
+PAGES_PER_TASK = 8
+
+def _parse_page_range(pdf_path: str, start: int, end: int) -> List[Document]:
+    """
+    Extract the text of pages [start, end) of the PDF, run in a worker process
+    by the parallel build. Every ingestion path extracts pages with it, so full,
+    incremental and parallel builds give the same chunks.
+    """
+    reader = PdfReader(pdf_path)
+    source = os.path.basename(pdf_path)
+    pages = []
+    for page_number in range(start, end):
+        text = reader.pages[page_number].extract_text(extraction_mode="plain").strip()
+        pages.append(Document(
+            page_content=text,
+            metadata={
+                "source": source,
+                "page": page_number,
+                "page_label": reader.page_labels[page_number],
+                "total_pages": len(reader.pages)
+            }
+        ))
+    return pages
+
+def load_pdf_pages(pdf_path: str = PDF_PATH) -> List[Document]:
+    """Text of every page of the PDF, one document per page"""
+    return _parse_page_range(pdf_path, 0, len(PdfReader(pdf_path).pages))
 
-def get_abbinamenti_retriever():
-    """Load up the FAISS vector database and return a retriever"""
-    # hugging_key = st.secrets['HUGGINGFACE_API_KEY']
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    db = FAISS.load_local(VECTOR_DB_PATH, embeddings, allow_dangerous_deserialization=True)
-    return db.as_retriever(search_kwargs={"k" : 5})
+def _peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process and its finished workers"""
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        return round(max(own, children) / 1024, 1)
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / 2**20, 1)
+    except (ImportError, AttributeError):
+        return None
+
+def build_vector_db_parallel(pdf_path: str = PDF_PATH, db_path: Optional[str] = None,
+                             workers: int = INGEST_WORKERS, batch_size: int = EMBEDDING_BATCH_SIZE,
+                             index_type: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Rebuild the vector database with a parallel pipeline: page ranges are parsed
+    in a process pool, their chunks are streamed into fixed-size embedding
+    batches and each batch is added to the FAISS index as soon as it is embedded.
+    """
+    db_path = db_path or VECTOR_DB_PATH
+    index_type = index_type or INDEX_TYPE
+    start_time = time.perf_counter()
+    
+    total_pages = len(PdfReader(pdf_path).pages)
+    ranges = [(start, min(start + PAGES_PER_TASK, total_pages)) for start in range(0, total_pages, PAGES_PER_TASK)]
+    print(f"Parsing {total_pages} pages of '{pdf_path}' with {workers} workers...")
+    
+    embeddings = get_embeddings()
+    text_splitter = get_text_splitter()
+    manifest = {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "index_type": index_type,
+        "files": {os.path.basename(pdf_path): _hash_file(pdf_path)},
+        "pages": {}
+    }
+    db = None
+    page_texts: Dict[int, str] = {}
+    pending: Dict[str, Document] = {}
+    parsed_pages = 0
+    total_chunks = 0
+    embedding_time = 0.0
+    
+    def flush(batch: Dict[str, Document]) -> None:
+        nonlocal db, embedding_time
+        batch_start = time.perf_counter()
+        texts = [doc.page_content for doc in batch.values()]
+        vectors = embeddings.embed_documents(texts)
+        if db is None:
+            db = FAISS(embeddings, faiss.IndexFlatL2(len(vectors[0])), InMemoryDocstore(), {})
+        db.add_embeddings(zip(texts, vectors), metadatas=[doc.metadata for doc in batch.values()], ids=list(batch.keys()))
+        embedding_time += time.perf_counter() - batch_start
+    
+    # Spawned, not forked: this process runs the embedding model while the pool is alive, and a
+    # child forked after a forward pass inherits torch's thread pool locks without its threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        futures = [pool.submit(_parse_page_range, pdf_path, start, end) for start, end in ranges]
+        for future in as_completed(futures):
+            for page in future.result():
+                chunks = _split_page(page, text_splitter)
+                manifest["pages"][_page_key(page)] = {
+                    "hash": _hash_text(page.page_content),
+                    "chunks": {chunk_id: chunk_id for chunk_id in chunks}
+                }
+                page_texts[page.metadata["page"]] = page.page_content
+                pending.update(chunks)
+                total_chunks += len(chunks)
+                parsed_pages += 1
+            
+            while len(pending) >= batch_size:
+                batch_ids = list(pending)[:batch_size]
+                flush({chunk_id: pending.pop(chunk_id) for chunk_id in batch_ids})
+    
+    if pending:
+        flush(pending)
+    
+    if db is None:
+        raise ValueError(f"No text could be extracted from '{pdf_path}'")
+    
+    # Vectors stream into a flat index, trained index types are built once all of them are known
+    convert_index_type(db, index_type)
+    save_vector_store(db, db_path)
+    save_manifest(manifest, db_path)
+    _write_pairing_index([page_texts[number] for number in sorted(page_texts)], db_path)
+    
+    elapsed = time.perf_counter() - start_time
+    stats = {
+        "pages": parsed_pages,
+        "chunks": total_chunks,
+        "elapsed_s": round(elapsed, 2),
+        "embedding_s": round(embedding_time, 2),
+        "pages_per_s": round(parsed_pages / elapsed, 1),
+        "chunks_per_s": round(total_chunks / elapsed, 1),
+        "peak_rss_mb": _peak_rss_mb(),
+        "workers": workers,
+        "batch_size": batch_size
+    }
+    print(f"FAISS vector database saved correctly in : {db_path}")
+    print(f"{stats['pages_per_s']} pages/s, {stats['chunks_per_s']} chunks/s, peak RSS {stats['peak_rss_mb']} MB")
+    return stats
+
+def load_vector_db(embeddings, writable: bool = False):
+    """
+    Load up the FAISS vector database from disk. The chunk file format is
+    memory-mapped (index included) and only decodes the chunks that are returned;
+    `writable` loads it fully for ingestion. Stores saved by older versions
+    (index.pkl) are still read with FAISS.load_local.
+    """
+    if chunk_store_exists(VECTOR_DB_PATH):
+        if writable:
+            return load_writable_vector_store(VECTOR_DB_PATH, embeddings)
+        return load_mmap_vector_store(VECTOR_DB_PATH, embeddings)
+    
+    print(f"No chunk store in '{VECTOR_DB_PATH}', loading the pickled docstore (convert it with: python chunk_store.py)")
+    return FAISS.load_local(VECTOR_DB_PATH, embeddings, allow_dangerous_deserialization=True)
+
+# "hybrid" fuses BM25 and FAISS results, "dense" is the plain FAISS retriever
+RETRIEVER_MODE = os.getenv("RETRIEVER_MODE", "hybrid")
+
+def get_abbinamenti_retriever(mode: Optional[str] = None):
+    """Return a retriever over the process-wide FAISS vector database"""
+    if (mode or RETRIEVER_MODE) == "hybrid":
+        from hybrid_retriever import get_hybrid_retriever
+        return get_hybrid_retriever()
+    return get_vector_store().as_retriever(search_kwargs={"k" : 5})
+
+def embed_queries(queries: List[str]) -> np.ndarray:
+    """Embed several queries with one batched encoder call, cached vectors are reused"""
+    embeddings = get_embeddings()
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(queries)
+    return np.asarray(embeddings.embed_documents(queries), dtype=np.float32)
+
+def vector_similarity_search(vectors: np.ndarray, k: int) -> List[List[Tuple[str, Document, float]]]:
+    """
+    Search the FAISS index with a whole matrix of query vectors in a single call.
+    Returns, for each query, its hits as (docstore id, document, distance).
+    """
+    db = get_vector_store()
+    if db._normalize_L2:
+        vectors = vectors.copy()
+        faiss.normalize_L2(vectors)
+    
+    distances, indices = db.index.search(vectors, k)
+    
+    hits = []
+    for row_distances, row_indices in zip(distances, indices):
+        row_hits = []
+        for distance, index in zip(row_distances, row_indices):
+            if index == -1:  # fewer than k vectors in the index
+                continue
+            doc_id = db.index_to_docstore_id[int(index)]
+            doc = db.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                row_hits.append((doc_id, doc, float(distance)))
+        hits.append(row_hits)
+    
+    return hits
+
+def multi_query_similarity_search(queries: List[str], k: int = 3) -> List[List[Tuple[str, Document, float]]]:
+    """
+    Search the vector database for several queries at once: all queries are
+    embedded with one batched encoder call and the FAISS index is searched with
+    the whole query matrix in a single call.
+    """
+    if not queries:
+        return []
+    
+    return vector_similarity_search(embed_queries(queries), k)
 
 if __name__ == "__main__":
-    process_pdf_and_create_vector_db()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the FAISS vector database of the flavour book")
+    parser.add_argument("--incremental", action="store_true", help="only embed new or changed pages and update the existing index")
+    parser.add_argument("--parallel", action="store_true", help="rebuild the index with the parallel parsing and batched embedding pipeline")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="parser processes for --parallel")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE, help="chunks per embedding batch for --parallel")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_TYPE, help="FAISS index type for new builds")
+    parser.add_argument("--pdf", default=PDF_PATH, help="PDF file to ingest")
+    args = parser.parse_args()
+    
+    if args.parallel:
+        build_vector_db_parallel(args.pdf, workers=args.workers, batch_size=args.batch_size, index_type=args.index_type)
+    elif args.incremental:
+        update_vector_db_incremental(args.pdf)
+    else:
+        process_pdf_and_create_vector_db(args.pdf, index_type=args.index_type)
\ No newline at end of file
@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+from instrumentation import get_logger
+
+load_dotenv()
+
+PREWARM_SUGGESTIONS = os.getenv("PREWARM_SUGGESTIONS", "true").lower() in ("1", "true", "yes")
+PREWARM_INTERVAL_S = int(os.getenv("PREWARM_INTERVAL_S", 6 * 3600))   # time between two passes
+# Older recipes are generated again. Keep it under RECIPE_CACHE_MAX_AGE_S minus the
+# interval, so a suggestion is regenerated before the cache stops serving its recipe
+PREWARM_MAX_AGE_S = int(os.getenv("PREWARM_MAX_AGE_S", 18 * 3600))
+
+# Requests offered by the suggestion buttons, per language
+SUGGESTIONS_BY_LANG = {
+    'it': [
+        "Pasta alla carbonara fusion",
+        "Risotto innovativo",
+        "Pollo con spezie esotiche",
+        "Dessert al cioccolato creativo",
+        "Insalata gourmet",
+        "Pizza con ingredienti inusuali"
+    ],
+    'en': [
+        "Fusion carbonara pasta",
+        "Innovative risotto",
+        "Chicken with exotic spices",
+        "Creative chocolate dessert",
+        "Gourmet salad",
+        "Pizza with unusual ingredients"
+    ],
+    'fr': [
+        "Pâtes carbonara fusion",
+        "Risotto innovant",
+        "Poulet aux épices exotiques",
+        "Dessert au chocolat créatif",
+        "Salade gourmet",
+        "Pizza aux ingrédients inhabituels"
+    ],
+    'es': [
+        "Pasta carbonara fusión",
+        "Risotto innovador",
+        "Pollo con especias exóticas",
+        "Postre de chocolate creativo",
+        "Ensalada gourmet",
+        "Pizza con ingredientes inusuales"
+    ],
+    'de': [
+        "Fusion Carbonara Pasta",
+        "Innovatives Risotto",
+        "Hähnchen mit exotischen Gewürzen",
+        "Kreatives Schokoladendessert",
+        "Gourmet Salat",
+        "Pizza mit ungewöhnlichen Zutaten"
+    ]
+}
+
+logger = get_logger("prewarm")
+
+class SuggestionPrewarmer:
+    """
+    Background thread keeping the recipes of the suggestion buttons in the
+    recipe cache: at start and then every `interval` seconds, each suggestion
+    whose recipe is missing or older than `max_age` goes through the graph.
+    Only the requests without dietary preferences are prewarmed, and the LLM
+    calls yield to the interactive ones.
+    """
+
+    def __init__(self, suggestions: Dict[str, List[str]] = SUGGESTIONS_BY_LANG,
+                 interval: int = PREWARM_INTERVAL_S, max_age: int = PREWARM_MAX_AGE_S):
+        self.suggestions = suggestions
+        self.interval = interval
+        self.max_age = max_age
+        self.generated = 0
+        self.failures = 0
+        self.passes = 0
+        self.running = False
+        self.last_pass_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SuggestionPrewarmer":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="suggestion-prewarmer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self.prewarm()
+            self._stop.wait(self.interval)
+
+    def prewarm(self) -> int:
+        """Generate the missing and stale suggestion recipes, return how many were generated"""
+        from graph import run_recipe_agent
+        from resources import get_recipe_cache
+        from scheduler import BATCH, priority
+        from state import build_initial_state
+
+        cache = get_recipe_cache()
+        generated = 0
+        self.running = True
+        try:
+            for language, suggestions in self.suggestions.items():
+                for suggestion in suggestions:
+                    if self._stop.is_set():
+                        return generated
+                    age = cache.age(suggestion, [], language)
+                    if age is not None and age <= self.max_age:
+                        continue
+                    try:
+                        # fresh: a similar cached request must not stand in for the suggestion
+                        with priority(BATCH):
+                            final_state = run_recipe_agent(build_initial_state(suggestion, [], language), fresh=True)
+                    except Exception as e:
+                        logger.warning(f"Prewarming '{suggestion}' ({language}) failed: {e}")
+                        self.failures += 1
+                        continue
+                    if final_state.get("final_recipe"):
+                        generated += 1
+                    else:
+                        self.failures += 1
+        finally:
+            self.running = False
+            self.passes += 1
+            self.last_pass_at = time.time()
+            self.generated += generated
+        logger.info(f"Prewarm pass done, {generated} suggestion recipes generated")
+        return generated
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Coverage (suggestions the cache serves) per language, with the recipes due
+        for regeneration ("stale") and those past the cache max age ("expired",
+        no longer served), and the pass counters
+        """
+        from resources import get_recipe_cache
+
+        cache = get_recipe_cache()
+        languages = {}
+        for language, suggestions in self.suggestions.items():
+            ages = [cache.age(suggestion, [], language) for suggestion in suggestions]
+            cached = [age for age in ages if age is not None]
+            languages[language] = {
+                "total": len(suggestions),
+                "cached": len(cached),
+                "stale": sum(1 for age in cached if age > self.max_age),
+                "expired": sum(1 for age in cached if cache.max_age and age > cache.max_age),
+                "oldest_s": round(max(cached)) if cached else None,
+            }
+        total = sum(stats["total"] for stats in languages.values())
+        served = sum(stats["cached"] - stats["expired"] for stats in languages.values())
+        return {
+            "coverage": served / total if total else 0.0,
+            "languages": languages,
+            "running": self.running,
+            "passes": self.passes,
+            "generated": self.generated,
+            "failures": self.failures,
+            "last_pass_at": self.last_pass_at,
+            "next_pass_in_s": round(self.last_pass_at + self.interval - time.time()) if self.last_pass_at else None,
+        }
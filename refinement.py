@@ -0,0 +1,150 @@
+import os
+import re
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, HumanMessage
+from cache import normalize_query
+from instrumentation import get_logger
+from state import build_initial_state
+
+load_dotenv()
+
+# SQLite file of the session checkpoints (needs langgraph-checkpoint-sqlite),
+# empty keeps them in memory for the life of the process
+SESSION_CHECKPOINT_PATH = os.getenv("SESSION_CHECKPOINT_PATH", "")
+REFINEMENT_MAX_WORDS = 12  # longer messages are treated as a new request
+
+# Where the refinement router resumes a session, the nodes before it are not rerun
+FULL_RUN = "search_base_recipe"
+PAIRINGS = "search_pairings"
+GENERATE = "generate_recipe"
+
+# Follow-ups that refer back to the recipe on the table: they either point at it
+# ("make it vegan") or open with a change to it ("without onions", "for 2 people").
+# Diet words or numbers inside a request ("vegan lasagna", "curry for 4") name a new dish.
+REFERENCE_CUES = re.compile(
+    r"\b(make (it|this|that|the recipe)|same (recipe|dish|thing)|"
+    r"rendil[ao]|fall[ao]|la stessa ricetta|fais-l[ae]|rends-l[ae]|la même recette|"
+    r"hazl[ao]|la misma receta|mach (es|das)|das gleiche rezept)\b",
+    re.IGNORECASE
+)
+CHANGE_CUES = re.compile(
+    r"^(but |without |instead of |add |remove |replace |swap |for \d+\b|"
+    r"ma |senza |invece d\w* |aggiungi |togli |sostituisci |per \d+\b|"
+    r"mais |sans |au lieu d\w* |ajoute |enlève |remplace |pour \d+\b|"
+    r"pero |sin |en (lugar|vez) de |añade |agrega |quita |cambia |para \d+\b|"
+    r"aber |ohne |statt |anstatt |füge |entferne |ersetze |für \d+\b)",
+    re.IGNORECASE
+)
+# Refinements naming ingredients that are removed, not added
+NEGATION_CUES = re.compile(r"\b(without|no|remove|instead of|senza|togli|niente|sans|sin|ohne)\b", re.IGNORECASE)
+
+logger = get_logger("refinement")
+
+def create_checkpointer() -> Any:
+    """Checkpointer of the session graph: SQLite when configured and available, else in memory"""
+    from langgraph.checkpoint.memory import MemorySaver
+
+    if SESSION_CHECKPOINT_PATH:
+        try:
+            import sqlite3
+            from langgraph.checkpoint.sqlite import SqliteSaver
+            return SqliteSaver(sqlite3.connect(SESSION_CHECKPOINT_PATH, check_same_thread=False))
+        except ImportError:
+            logger.warning("langgraph-checkpoint-sqlite is not installed, session checkpoints are kept in memory")
+    return MemorySaver()
+
+def session_config(thread_id: str) -> Dict[str, Any]:
+    """Run config selecting the checkpointed thread of a session"""
+    return {"configurable": {"thread_id": thread_id}}
+
+def is_refinement(text: str) -> bool:
+    """Whether a follow-up message adjusts the current recipe (e.g. "make it vegan", "for 2 people")"""
+    text = text.strip()
+    return (len(text.split()) <= REFINEMENT_MAX_WORDS
+            and (REFERENCE_CUES.search(text) is not None or CHANGE_CUES.match(text) is not None))
+
+def build_turn_input(text: str, dietary_preferences: List[str], language: Optional[str],
+                     previous: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Graph input of a chat turn given the session's checkpointed state. A new
+    dish resets the request fields; a refinement of the recipe generated last
+    (or the same request again) only passes what changed, the checkpoint keeps
+    the search results, ingredients and pairings for the router to reuse.
+    """
+    completed = previous.get("completed_request")
+    same_request = completed is not None and normalize_query(text) == completed["user_desire"]
+    if completed is not None and (same_request or is_refinement(text)):
+        refinements = list(previous.get("refinements") or [])
+        if not same_request:
+            refinements.append(text)
+        return {
+            "dietary_preferences": dietary_preferences,
+            # Short follow-ups are poorly detected, the conversation keeps its language
+            "user_language": previous.get("user_language") or language,
+            "refinements": refinements,
+            "final_recipe": None,
+            "error_message": None,
+            "awaiting_user_input": False,
+            "node_metrics": None,  # the checkpoint keeps only the metrics of the last turn
+        }
+
+    return {**build_initial_state(text, dietary_preferences, language), "messages": previous.get("messages") or [],
+            "node_metrics": None}
+
+def _added_ingredients(state: Dict[str, Any], refinements: List[str]) -> List[str]:
+    """Ingredients of the pairing index a new refinement asks to add to the recipe"""
+    from resources import get_pairing_index
+
+    pairing_index = get_pairing_index()
+    if pairing_index is None:
+        return []
+
+    known = {pairing_index.normalize(ingredient) for ingredient in state.get("extracted_ingredients_from_base_recipe") or []}
+    added = []
+    for refinement in refinements:
+        if NEGATION_CUES.search(refinement):
+            continue
+        added += [key for key in pairing_index.find_ingredients(refinement) if key not in known and key not in added]
+    return added
+
+def refinement_update(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Refinement router: compare the request with the last one completed in the
+    session and resume at the first node whose inputs changed. Preferences,
+    language or wording changes only need generate_recipe; added ingredients
+    also need their pairings; a different dish reruns everything.
+    """
+    completed = state.get("completed_request")
+    if (not completed or not state.get("base_recipe_search_results")
+            or normalize_query(state["user_desire"]) != completed["user_desire"]):
+        return {"resume_from": FULL_RUN}
+
+    new_refinements = (state.get("refinements") or [])[len(completed["refinements"]):]
+    added = _added_ingredients(state, new_refinements)
+    if added:
+        ingredients = (state.get("extracted_ingredients_from_base_recipe") or []) + added
+        logger.info(f"Refinement adds {added}, resuming at the pairing search")
+        return {
+            "resume_from": PAIRINGS,
+            "extracted_ingredients_from_base_recipe": ingredients,
+            "pairing_query": f"pairings for {' '.join(ingredients[:3])}"
+        }
+
+    logger.info("Refinement only changes the recipe, resuming at its generation")
+    return {"resume_from": GENERATE}
+
+def completed_request_update(state: Dict[str, Any], recipe: str) -> Dict[str, Any]:
+    """Remember what the recipe was generated from, and add the turn to the conversation"""
+    refinements = state.get("refinements") or []
+    return {
+        "completed_request": {
+            "user_desire": normalize_query(state["user_desire"]),
+            "refinements": list(refinements),
+            "final_recipe": recipe,
+        },
+        "messages": (state.get("messages") or []) + [
+            HumanMessage(content=refinements[-1] if refinements else state["user_desire"]),
+            AIMessage(content=recipe)
+        ]
+    }
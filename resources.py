@@ -0,0 +1,168 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+from dotenv import load_dotenv
+from langchain_groq import ChatGroq
+from langchain_tavily import TavilySearch
+from langchain_huggingface import HuggingFaceEmbeddings
+import streamlit as st
+from instrumentation import get_logger
+
+try:
+    import psutil
+except ImportError:  # memory figures are reported as None without psutil
+    psutil = None
+
+load_dotenv()
+
+logger = get_logger("resources")
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+LLM_MODEL_NAME = "llama3-70b-8192"
+
+# Shared objects are loaded at most once per process and reused by every
+# Streamlit session / worker thread. Each resource has its own lock so a slow
+# load (e.g. the embedding model) does not block access to the others.
+_resources: Dict[str, Any] = {}
+_resource_locks: Dict[str, threading.Lock] = {}
+_resource_stats: Dict[str, Dict[str, Any]] = {}
+_registry_lock = threading.Lock()
+
+def _current_rss() -> Optional[int]:
+    """Resident memory of this process in bytes, if psutil is available"""
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss
+
+def get_resource(name: str, factory: Callable[[], Any]) -> Any:
+    """Return the shared resource `name`, creating it with `factory` on first use"""
+    if name in _resources:
+        return _resources[name]
+
+    with _registry_lock:
+        lock = _resource_locks.setdefault(name, threading.Lock())
+
+    with lock:
+        if name not in _resources:
+            rss_before = _current_rss()
+            start = time.perf_counter()
+
+            resource = factory()
+
+            load_time = time.perf_counter() - start
+            rss_after = _current_rss()
+            _resource_stats[name] = {
+                "load_time_s": round(load_time, 3),
+                # Approximate: other threads may allocate while the resource loads
+                "rss_delta_mb": round((rss_after - rss_before) / 2**20, 1) if rss_before is not None else None,
+                "loaded_at": time.time(),
+            }
+            logger.info(f"Loaded shared resource '{name}' in {load_time:.2f}s")
+            _resources[name] = resource
+
+    return _resources[name]
+
+def set_resource(name: str, resource: Any) -> None:
+    """Register (or replace) a shared resource, e.g. a local stand-in for an API client"""
+    with _registry_lock:
+        _resources[name] = resource
+        _resource_stats[name] = {"load_time_s": 0.0, "rss_delta_mb": None, "loaded_at": time.time()}
+
+def resource_stats() -> Dict[str, Any]:
+    """Load time and memory growth of every loaded resource, plus the process RSS"""
+    rss = _current_rss()
+    return {
+        "process_rss_mb": round(rss / 2**20, 1) if rss is not None else None,
+        "resources": {name: dict(stats) for name, stats in _resource_stats.items()},
+    }
+
+def get_embedding_model() -> HuggingFaceEmbeddings:
+    """Shared sentence-transformers embedding model"""
+    return get_resource("embedding_model", lambda: HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME))
+
+def get_embeddings():
+    """Shared embedding model behind the query embedding cache"""
+    from cache import CachedEmbeddings
+
+    return get_resource("embeddings", lambda: CachedEmbeddings(get_embedding_model(), model_name=EMBEDDING_MODEL_NAME))
+
+def get_recipe_cache():
+    """Shared semantic cache of the final recipes"""
+    from cache import RecipeCache
+
+    return get_resource("recipe_cache", lambda: RecipeCache(get_embeddings()))
+
+def get_vector_store():
+    """Shared FAISS store of the flavour book"""
+    from pdf_processor import load_vector_db
+
+    embeddings = get_embeddings()
+    return get_resource("vector_store", lambda: load_vector_db(embeddings))
+
+def get_pairing_index():
+    """Shared exact ingredient -> pairing index, None if it has not been built"""
+    from pairing_index import load_pairing_index
+
+    return get_resource("pairing_index", load_pairing_index)
+
+def get_ingredient_extractor():
+    """Shared lexicon-based ingredient extractor, None if the pairing index has not been built"""
+    from ingredient_extractor import build_ingredient_extractor
+
+    return get_resource("ingredient_extractor", build_ingredient_extractor)
+
+def _create_llm() -> ChatGroq:
+    return ChatGroq(model=LLM_MODEL_NAME, temperature=0.7, api_key=st.secrets["GROQ_API_KEY"])
+
+def get_llm_scheduler():
+    """Shared rate limit scheduler of the Groq quota"""
+    from scheduler import RateLimitScheduler
+
+    return get_resource("llm_scheduler", RateLimitScheduler)
+
+def get_llm():
+    """Shared Groq chat model client, calls go through the rate limit scheduler"""
+    from scheduler import ScheduledChatModel
+
+    return get_resource("llm", lambda: ScheduledChatModel(_create_llm(), get_llm_scheduler()))
+
+def _create_search_tool() -> TavilySearch:
+    search_tool = TavilySearch(max_results=5, api_key=st.secrets["TAVILY_API_KEY"])
+    search_tool.name = "tavily_search"
+    search_tool.description = "Used to retrieve information about recipes, ingredients and cooking methods or any other general information on the web. Give pertinent result based on the query."
+    return search_tool
+
+def get_search_tool() -> TavilySearch:
+    """Shared Tavily search client"""
+    return get_resource("search_tool", _create_search_tool)
+
+def get_graph():
+    """Shared compiled recipe agent graph"""
+    from graph import build_recipe_agent_graph
+
+    return get_resource("graph", build_recipe_agent_graph)
+
+def get_session_graph():
+    """Shared recipe graph checkpointing the state of each chat session (thread_id)"""
+    from graph import build_recipe_agent_graph
+    from refinement import create_checkpointer
+
+    return get_resource("session_graph", lambda: build_recipe_agent_graph(checkpointer=create_checkpointer()))
+
+def get_job_store():
+    """Shared SQLite store of the recipe jobs"""
+    from jobs import JobStore
+
+    return get_resource("job_store", JobStore)
+
+def get_job_queue():
+    """Shared worker pool running the recipe jobs of every session"""
+    from jobs import JobQueue
+
+    return get_resource("job_queue", lambda: JobQueue(get_job_store()))
+
+def get_prewarmer():
+    """Shared background prewarmer of the suggestion recipes, None when PREWARM_SUGGESTIONS is off"""
+    from prewarm import PREWARM_SUGGESTIONS, SuggestionPrewarmer
+
+    return get_resource("prewarmer", lambda: SuggestionPrewarmer().start() if PREWARM_SUGGESTIONS else None)
@@ -0,0 +1,262 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+from dotenv import load_dotenv
+from instrumentation import get_logger
+
+load_dotenv()
+
+# Client-side view of the Groq quota, tune it to the plan of the API key
+GROQ_REQUESTS_PER_MINUTE = int(os.getenv("GROQ_REQUESTS_PER_MINUTE", 30))
+GROQ_TOKENS_PER_MINUTE = int(os.getenv("GROQ_TOKENS_PER_MINUTE", 6000))
+COMPLETION_TOKENS_ESTIMATE = int(os.getenv("COMPLETION_TOKENS_ESTIMATE", 800))  # reserved per call until the usage is known
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", 5))
+BACKOFF_BASE_S = float(os.getenv("BACKOFF_BASE_S", 1.0))
+BACKOFF_MAX_S = float(os.getenv("BACKOFF_MAX_S", 30.0))
+
+# Lower value is served first
+INTERACTIVE = 0
+BATCH = 1
+
+request_priority: ContextVar[int] = ContextVar("request_priority", default=INTERACTIVE)
+
+logger = get_logger("scheduler")
+
+@contextmanager
+def priority(level: int) -> Iterator[None]:
+    """Run the LLM calls made inside the block (and the tasks it starts) with this priority"""
+    token = request_priority.set(level)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a prompt (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+class TokenBucket:
+    """`capacity` units refilled continuously at `rate` units per second"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.available = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until `amount` units are available, 0 if they already are"""
+        self._refill()
+        missing = min(amount, self.capacity) - self.available
+        return max(0.0, missing / self.rate)
+
+    def level(self) -> float:
+        """Units available right now"""
+        self._refill()
+        return self.available
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        """Give back (or, if negative, take) units once the real cost is known"""
+        self._refill()
+        self.available = min(self.capacity, self.available + amount)
+
+class RateLimitScheduler:
+    """
+    Admission control for the shared LLM client: a call waits until both the
+    request bucket and the token bucket can pay for it. Waiting calls are served
+    by priority (interactive before batch), then in arrival order.
+    """
+
+    def __init__(self, requests_per_minute: int = GROQ_REQUESTS_PER_MINUTE, tokens_per_minute: int = GROQ_TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self._condition = threading.Condition()
+        self._waiting: list = []  # heap of (priority, sequence) tickets
+        self._sequence = itertools.count()
+        self.acquired = 0
+        self.max_queue_depth = 0
+        self.total_wait_s = 0.0
+        self.rate_limited = 0
+        self.retries = 0
+
+    def _enqueue(self, level: int) -> tuple:
+        ticket = (level, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            self.max_queue_depth = max(self.max_queue_depth, len(self._waiting))
+        return ticket
+
+    def _try_acquire(self, ticket: tuple, cost: int) -> Optional[float]:
+        """Take the call's budget if it is its turn and the budget is there; else the seconds to wait (None: not its turn)"""
+        if self._waiting[0] != ticket:
+            return None
+        wait = max(self.requests.time_until(1), self.tokens.time_until(cost))
+        if wait > 0:
+            return wait
+        self.requests.consume(1)
+        self.tokens.consume(cost)
+        heapq.heappop(self._waiting)
+        self.acquired += 1
+        self._condition.notify_all()
+        return 0.0
+
+    def acquire(self, cost: int, level: Optional[int] = None) -> float:
+        """Block until the call may be sent, return the time waited"""
+        ticket = self._enqueue(request_priority.get() if level is None else level)
+        start = time.monotonic()
+        try:
+            with self._condition:
+                while True:
+                    wait = self._try_acquire(ticket, cost)
+                    if wait == 0.0:
+                        break
+                    # Not its turn: woken up when the call ahead is admitted (the timeout is a safety net)
+                    self._condition.wait(wait if wait is not None else 0.5)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        waited = time.monotonic() - start
+        self.total_wait_s += waited
+        return waited
+
+    async def aacquire(self, cost: int, level: Optional[int] = None) -> float:
+        """Async version of acquire, the event loop keeps running while the call waits"""
+        ticket = self._enqueue(request_priority.get() if level is None else level)
+        start = time.monotonic()
+        try:
+            while True:
+                with self._condition:
+                    wait = self._try_acquire(ticket, cost)
+                if wait == 0.0:
+                    break
+                # Not its turn yet: poll, as sync waiters cannot wake up a coroutine
+                await asyncio.sleep(min(wait, 0.05) if wait is not None else 0.05)
+        except BaseException:  # e.g. the request task was cancelled
+            self._abandon(ticket)
+            raise
+        waited = time.monotonic() - start
+        self.total_wait_s += waited
+        return waited
+
+    def _abandon(self, ticket: tuple) -> None:
+        """Drop the ticket of a call that stopped waiting, so it does not block the queue"""
+        with self._condition:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+
+    def settle(self, reserved: int, used: Optional[int]) -> None:
+        """Correct the token bucket with the real usage of a call"""
+        if used is not None:
+            with self._condition:
+                self.tokens.refund(reserved - used)
+                self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            waiting = list(self._waiting)
+            available_requests = self.requests.level()
+            available_tokens = self.tokens.level()
+        return {
+            "queue_depth": len(waiting),
+            "queued_interactive": sum(1 for level, _ in waiting if level == INTERACTIVE),
+            "queued_batch": sum(1 for level, _ in waiting if level != INTERACTIVE),
+            "max_queue_depth": self.max_queue_depth,
+            "acquired": self.acquired,
+            "mean_wait_ms": round(self.total_wait_s / self.acquired * 1000, 1) if self.acquired else 0.0,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "available_requests": int(available_requests),
+            "available_tokens": int(available_tokens),
+        }
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+def backoff_delay(attempt: int, error: Optional[Exception] = None) -> float:
+    """Full-jitter exponential backoff, at least the server's Retry-After when it sends one"""
+    delay = random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt))
+    response = getattr(error, "response", None)
+    retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        return max(delay, float(retry_after)) if retry_after else delay
+    except ValueError:
+        return delay
+
+class ScheduledChatModel:
+    """
+    Chat model client that goes through the scheduler: each call reserves a
+    request and its estimated tokens, 429 responses are retried with backoff.
+    Other attributes are those of the wrapped model, except bind_tools whose
+    model is scheduled too.
+    """
+
+    def __init__(self, model: Any, scheduler: RateLimitScheduler):
+        self.model = model
+        self.scheduler = scheduler
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.model, name)
+
+    def bind_tools(self, tools: Any, **kwargs) -> "ScheduledChatModel":
+        """The tool-bound model, its calls go through the same scheduler"""
+        return ScheduledChatModel(self.model.bind_tools(tools, **kwargs), self.scheduler)
+
+    def _cost(self, messages: Any) -> int:
+        text = messages if isinstance(messages, str) else " ".join(str(getattr(m, "content", m)) for m in messages)
+        return estimate_tokens(text) + COMPLETION_TOKENS_ESTIMATE
+
+    def _on_rate_limit(self, attempt: int, error: Exception) -> float:
+        self.scheduler.rate_limited += 1
+        if attempt >= RATE_LIMIT_MAX_RETRIES:
+            raise error
+        self.scheduler.retries += 1
+        delay = backoff_delay(attempt, error)
+        logger.warning(f"LLM rate limited, retry {attempt + 1}/{RATE_LIMIT_MAX_RETRIES} in {delay:.1f}s",
+                       extra={"data": {"event": "rate_limited", "attempt": attempt + 1, "delay_s": round(delay, 2)}})
+        return delay
+
+    def invoke(self, messages: Any, *args, **kwargs) -> Any:
+        cost = self._cost(messages)
+        for attempt in itertools.count():
+            self.scheduler.acquire(cost)
+            try:
+                response = self.model.invoke(messages, *args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                time.sleep(self._on_rate_limit(attempt, e))
+                continue
+            self.scheduler.settle(cost, (getattr(response, "usage_metadata", None) or {}).get("total_tokens"))
+            return response
+
+    async def ainvoke(self, messages: Any, *args, **kwargs) -> Any:
+        cost = self._cost(messages)
+        for attempt in itertools.count():
+            await self.scheduler.aacquire(cost)
+            try:
+                response = await self.model.ainvoke(messages, *args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                await asyncio.sleep(self._on_rate_limit(attempt, e))
+                continue
+            self.scheduler.settle(cost, (getattr(response, "usage_metadata", None) or {}).get("total_tokens"))
+            return response
@@ -0,0 +1,414 @@
+import os
+import json
+import time
+import signal
+import socket
+import asyncio
+import argparse
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List
+from urllib.parse import parse_qs
+from dotenv import load_dotenv
+from instrumentation import get_logger, summarize_node_metrics
+
+load_dotenv()
+
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 8000))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 1))
+MAX_BODY_BYTES = 64 * 1024
+LATENCY_WINDOW = 1000  # recent requests kept for the latency percentiles of /metrics
+
+# Node whose LLM output is sent to the client token by token
+STREAMED_NODE = "generate_recipe"
+
+logger = get_logger("server")
+
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+
+class RequestError(Exception):
+    """Invalid request, answered with `status`"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class ServerStats:
+    """Request counters and recent latencies of this worker"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.requests = 0
+        self.streamed = 0
+        self.cached = 0
+        self.failed = 0
+        self.disconnected = 0
+        self.in_flight = 0
+        self.latencies_ms: deque = deque(maxlen=LATENCY_WINDOW)
+
+    def latency(self) -> Dict[str, Any]:
+        samples = sorted(self.latencies_ms)
+        if not samples:
+            return {"count": 0}
+        pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))], 1)
+        return {"count": len(samples), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+stats = ServerStats()
+
+async def send_json(send: Send, status: int, body: Any) -> None:
+    payload = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+def sse_event(event: str, data: Any) -> bytes:
+    """One Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n".encode("utf-8")
+
+async def read_body(receive: Receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise RequestError(499, "client disconnected")
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            raise RequestError(413, f"request body over {MAX_BODY_BYTES} bytes")
+        if not message.get("more_body"):
+            return body
+
+def parse_recipe_request(body: bytes) -> Dict[str, Any]:
+    """Validate the JSON body of POST /recipes"""
+    try:
+        request = json.loads(body or b"{}")
+    except ValueError:
+        raise RequestError(400, "body is not valid JSON")
+    if not isinstance(request, dict) or not str(request.get("desire") or "").strip():
+        raise RequestError(400, '"desire" is required')
+    preferences = request.get("dietary_preferences") or []
+    if not isinstance(preferences, list) or not all(isinstance(preference, str) for preference in preferences):
+        raise RequestError(400, '"dietary_preferences" must be a list of strings')
+    return request
+
+def _initial_state(request: Dict[str, Any]) -> Dict[str, Any]:
+    from main import _detect_language
+    from state import build_initial_state
+
+    desire = request["desire"].strip()
+    language = request.get("language") or _detect_language(desire)
+    return build_initial_state(desire, request.get("dietary_preferences") or [], language)
+
+def _result(final_state: Dict[str, Any], elapsed_s: float) -> Dict[str, Any]:
+    return {
+        "status": "done" if final_state.get("final_recipe") else "failed",
+        "final_recipe": final_state.get("final_recipe"),
+        "error_message": final_state.get("error_message"),
+        "language": final_state.get("user_language"),
+        "cached_desire": final_state.get("cached_desire"),
+        "elapsed_s": round(elapsed_s, 3),
+        "metrics": summarize_node_metrics(final_state.get("node_metrics") or []),
+    }
+
+async def create_recipe(request: Dict[str, Any]) -> Dict[str, Any]:
+    """Whole recipe in one response; identical in-flight requests share a run"""
+    from graph import arun_recipe_agent
+
+    start = time.perf_counter()
+    final_state = await arun_recipe_agent(_initial_state(request), fresh=bool(request.get("fresh")))
+    return _result(final_state, time.perf_counter() - start)
+
+async def stream_recipe(request: Dict[str, Any], send: Send) -> Dict[str, Any]:
+    """
+    Send the run as Server-Sent Events: "node" when a node completes, "token"
+    for each chunk of the generated recipe, then "done" with the result.
+    Identical in-flight requests share a run like in create_recipe: only the
+    client running it gets the node events, the others get the recipe in one
+    "token" event, as for a cached recipe.
+    """
+    from coalesce import graph_flights
+    from graph import _state_key, cached_recipe_state, remember_recipe
+    from resources import get_graph
+
+    start = time.perf_counter()
+    initial_state = _initial_state(request)
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")],
+    })
+
+    async def emit(event: str, data: Any) -> None:
+        await send({"type": "http.response.body", "body": sse_event(event, data), "more_body": True})
+
+    streamed = []
+
+    async def stream_run() -> Dict[str, Any]:
+        streamed.append(True)
+        final_state = dict(initial_state)
+        async for mode, chunk in get_graph().astream(initial_state, stream_mode=["updates", "messages"]):
+            if mode == "messages":
+                message_chunk, metadata = chunk
+                if metadata.get("langgraph_node") == STREAMED_NODE and message_chunk.content:
+                    await emit("token", {"text": message_chunk.content})
+                continue
+            for node_name, update in chunk.items():
+                update = update or {}
+                node_metrics = final_state.get("node_metrics", []) + update.get("node_metrics", [])
+                final_state.update(update)
+                final_state["node_metrics"] = node_metrics
+                await emit("node", {"node": node_name, "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)})
+        await asyncio.to_thread(remember_recipe, initial_state, final_state)
+        return final_state
+
+    try:
+        final_state = await asyncio.to_thread(cached_recipe_state, initial_state, bool(request.get("fresh")))
+        if final_state is None:
+            final_state = await graph_flights.ado(_state_key(initial_state), stream_run)
+        if not streamed and final_state.get("final_recipe"):
+            await emit("token", {"text": final_state["final_recipe"]})
+    except Exception as e:
+        # The response has started, the error can only be reported in the stream
+        logger.exception(f"Error streaming a recipe: {e}")
+        final_state = {**initial_state, "error_message": f"Unexpected error: {e}"}
+
+    result = _result(final_state, time.perf_counter() - start)
+    await send({"type": "http.response.body", "body": sse_event("done", result), "more_body": False})
+    return result
+
+def health() -> Dict[str, Any]:
+    from graph import GRAPH_TOPOLOGY
+    from resources import resource_stats
+
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "uptime_s": round(time.time() - stats.started_at, 1),
+        "graph_topology": GRAPH_TOPOLOGY,
+        "resources_loaded": sorted(resource_stats()["resources"]),
+    }
+
+def metrics() -> Dict[str, Any]:
+    """Counters of this worker process (each pre-forked worker answers for itself)"""
+    from cache import get_search_cache
+    from coalesce import coalescing_stats
+    from resources import get_embeddings, get_llm_scheduler, get_recipe_cache, resource_stats
+
+    resources = resource_stats()
+    loaded = resources["resources"]
+    caches = {"search": get_search_cache().stats()}
+    if "recipe_cache" in loaded:
+        caches["recipe"] = get_recipe_cache().stats()
+    if "embeddings" in loaded:
+        caches["embedding"] = get_embeddings().stats()
+    return {
+        "pid": os.getpid(),
+        "uptime_s": round(time.time() - stats.started_at, 1),
+        "requests": {
+            "total": stats.requests,
+            "streamed": stats.streamed,
+            "cached": stats.cached,
+            "failed": stats.failed,
+            "disconnected": stats.disconnected,
+            "in_flight": stats.in_flight,
+        },
+        "latency": stats.latency(),
+        "llm_scheduler": get_llm_scheduler().stats() if "llm_scheduler" in loaded else None,
+        "coalescing": coalescing_stats(),
+        "caches": caches,
+        "resources": resources,
+    }
+
+async def _until_disconnect(receive: Receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+async def handle_recipe(scope: Dict[str, Any], receive: Receive, send: Send) -> None:
+    request = parse_recipe_request(await read_body(receive))
+    headers = dict(scope.get("headers") or [])
+    query = parse_qs(scope.get("query_string", b"").decode())
+    streaming = (b"text/event-stream" in headers.get(b"accept", b"")
+                 or bool(request.get("stream")) or query.get("stream", [""])[0] in ("1", "true"))
+
+    stats.requests += 1
+    stats.streamed += streaming
+    stats.in_flight += 1
+    start = time.perf_counter()
+    # A client that goes away cancels its run, it would only hold LLM quota
+    run = asyncio.ensure_future(stream_recipe(request, send) if streaming else create_recipe(request))
+    watcher = asyncio.ensure_future(_until_disconnect(receive))
+    try:
+        await asyncio.wait({run, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if not run.done():
+            run.cancel()
+            stats.disconnected += 1
+            logger.info("Client disconnected, run cancelled", extra={"data": {"event": "disconnect"}})
+            return
+        result = run.result()
+    except asyncio.CancelledError:
+        run.cancel()
+        raise
+    finally:
+        watcher.cancel()
+        stats.in_flight -= 1
+
+    stats.latencies_ms.append((time.perf_counter() - start) * 1000)
+    stats.failed += result["status"] != "done"
+    stats.cached += result["cached_desire"] is not None
+    if not streaming:
+        await send_json(send, 200, result)
+
+# GET endpoints answered with the JSON returned by a (blocking) function
+JSON_ROUTES: Dict[str, Callable[[], Dict[str, Any]]] = {
+    "/health": health,
+    "/metrics": metrics,
+}
+
+async def lifespan(receive: Receive, send: Send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope: Dict[str, Any], receive: Receive, send: Send) -> None:
+    """
+    ASGI application:
+      POST /recipes   {"desire", "dietary_preferences", "language", "fresh", "stream"}
+                      JSON result, or Server-Sent Events with "Accept: text/event-stream"
+      GET  /health    liveness of the worker
+      GET  /metrics   request, latency, scheduler, coalescing and cache counters
+    """
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    method, path = scope["method"], scope["path"].rstrip("/") or "/"
+    try:
+        if path == "/recipes":
+            if method != "POST":
+                return await send_json(send, 405, {"error": "method not allowed"})
+            await handle_recipe(scope, receive, send)
+        elif path in JSON_ROUTES:
+            if method != "GET":
+                return await send_json(send, 405, {"error": "method not allowed"})
+            await send_json(send, 200, await asyncio.to_thread(JSON_ROUTES[path]))
+        else:
+            await send_json(send, 404, {"error": "not found"})
+    except RequestError as e:
+        if e.status != 499:
+            await send_json(send, e.status, {"error": str(e)})
+    except Exception as e:
+        logger.exception(f"Error handling {method} {path}: {e}")
+        await send_json(send, 500, {"error": str(e)})
+
+def preload() -> None:
+    """
+    Load the read-only resources in the parent before forking, so the workers
+    share them copy-on-write: the embedding model weights, the mmap-backed FAISS
+    store (its pages stay shared through the page cache), the pairing index and
+    the compiled graph. Clients and SQLite caches are opened by each worker.
+    Forking is safe because nothing here runs the model: torch starts its
+    intra-op thread pool at the first forward pass, so each worker starts its
+    own instead of inheriting the parent's. Keep inference (e.g. a warm-up
+    query) out of this function, or the workers would have to be spawned.
+    """
+    from hybrid_retriever import get_bm25_index
+    from pdf_processor import RETRIEVER_MODE
+    from resources import get_graph, get_ingredient_extractor, get_pairing_index, get_vector_store
+
+    get_vector_store()
+    get_pairing_index()
+    get_ingredient_extractor()
+    if RETRIEVER_MODE == "hybrid":
+        get_bm25_index()
+    get_graph()
+
+def _run_worker(sock: socket.socket, workers: int) -> None:
+    import uvicorn
+    from resources import set_resource
+    from scheduler import GROQ_REQUESTS_PER_MINUTE, GROQ_TOKENS_PER_MINUTE, RateLimitScheduler
+
+    stats.started_at = time.time()
+    if workers > 1:
+        # Every worker gets its share of the Groq quota, which is per API key
+        set_resource("llm_scheduler", RateLimitScheduler(GROQ_REQUESTS_PER_MINUTE / workers, GROQ_TOKENS_PER_MINUTE / workers))
+    config = uvicorn.Config(app, lifespan="on", access_log=False, log_level="warning", timeout_graceful_shutdown=30)
+    uvicorn.Server(config).run(sockets=[sock])
+
+def _spawn_worker(sock: socket.socket, workers: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            _run_worker(sock, workers)
+        finally:
+            os._exit(0)
+    return pid
+
+def serve(host: str = SERVER_HOST, port: int = SERVER_PORT, workers: int = SERVER_WORKERS) -> None:
+    """
+    Pre-fork server: preload the shared resources, bind the socket once, then
+    fork `workers` uvicorn processes accepting on it. A worker that dies is
+    replaced; SIGINT/SIGTERM stop them all.
+    """
+    if workers > 1 and not hasattr(os, "fork"):
+        print("Pre-forked workers need os.fork, running a single worker")
+        workers = 1
+
+    print("Loading shared resources...")
+    preload()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    print(f"🍳 Serving on http://{host}:{port} with {workers} worker(s)")
+
+    if workers <= 1:
+        _run_worker(sock, workers)
+        return
+
+    children: List[int] = [_spawn_worker(sock, workers) for _ in range(workers)]
+    stopping = False
+
+    def stop(signum: int, frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        if pid in children:
+            children.remove(pid)
+        if not stopping:
+            print(f"Worker {pid} exited ({status}), starting a new one")
+            children.append(_spawn_worker(sock, workers))
+    sock.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP API of the recipe agent, with SSE streaming and pre-forked workers")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="processes sharing the preloaded index and model")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
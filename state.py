@@ -1,6 +1,12 @@
-from typing import List, TypedDict, Optional
+from typing import Annotated, Any, Dict, List, TypedDict, Optional
 from langchain_core.messages import BaseMessage
 
+def add_node_metrics(current: Optional[List[dict]], update: Optional[List[dict]]) -> List[dict]:
+    """Append the metrics of the nodes that ran; None starts a new list (new turn of a checkpointed session)"""
+    if update is None:
+        return []
+    return (current or []) + update
+
 class RecipeAgentState(TypedDict):
     """
     Represent the state of our agent "Innovative Chef"
@@ -14,10 +20,40 @@ class RecipeAgentState(TypedDict):
     extracted_ingredients_from_base_recipe: List[str] # Ingredienti chiave estratti dalla ricetta base
     pairing_query: Optional[str]    # Query usata per cercare abbinamenti nel PDF
     pairing_results: Optional[str]  # Risultati della ricerca nel PDF
+    speculative_pairing_ingredients: Optional[List[str]] # Ingredients of the book named in user_desire (fan-out topology)
+    speculative_pairing_results: Optional[str] # Pairings looked up for them while the base recipe is searched
     final_recipe: Optional[str]     # La ricetta innovativa finale generata
     error_message: Optional[str]    # Messaggio di errore se qualcosa va storto
     retry_count: int                # Contatore per gestire i tentativi in caso di errore
     tool_calls: List[dict]          # Le chiamate ai tool che l'LLM ha suggerito
     tool_results: List[dict]        # I risultati delle chiamate ai tool
     awaiting_user_input: Optional[bool] # Flag to indicate if the agent is waiting for user input
-    user_language: Optional[str]    # User's detected language code (e.g., 'it', 'en', 'fr')
\ No newline at end of file
+    user_language: Optional[str]    # User's detected language code (e.g., 'it', 'en', 'fr')
+    bypass_cache: Optional[bool]    # Skip the search cache and always query Tavily
+    refinements: List[str]          # Follow-ups applied to the recipe of this request (e.g. "make it vegan")
+    completed_request: Optional[Dict[str, Any]] # What the last recipe of the session was generated from
+    resume_from: Optional[str]      # First node the refinement router reruns
+    cached_desire: Optional[str]    # Earlier request whose cached recipe was served instead of running the graph
+    cache_similarity: Optional[float] # Similarity of that request to this one
+    node_metrics: Annotated[List[dict], add_node_metrics] # Timing, token, retrieval and cache metrics appended by every node
+
+def build_initial_state(user_desire: str, dietary_preferences: List[str], language: Optional[str] = None) -> RecipeAgentState:
+    """Initial graph state for one recipe request"""
+    return RecipeAgentState(
+        messages=[],
+        user_desire=user_desire,
+        dietary_preferences=dietary_preferences,
+        base_recipe_query=None,
+        base_recipe_search_results=None,
+        extracted_ingredients_from_base_recipe=[],
+        pairing_query=None,
+        pairing_results=None,
+        final_recipe=None,
+        error_message=None,
+        retry_count=0,
+        tool_calls=[],
+        tool_results=[],
+        awaiting_user_input=False,
+        user_language=language,
+        refinements=[]
+    )
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+import pytest
+from coalesce import SingleFlight, request_key
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight("test")
+    calls, results = [], []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"pairings": ["lemon"]}
+
+    run_threads(4, lambda: results.append(flights.do("key", slow)))
+    assert len(calls) == 1
+    assert results == [{"pairings": ["lemon"]}] * 4
+    assert flights.stats() == {"executions": 1, "coalesced": 3, "coalesced_rate": 0.75, "in_flight": 0}
+
+def test_waiters_get_their_own_copy():
+    flights = SingleFlight("test")
+    results = []
+
+    def slow():
+        time.sleep(0.2)
+        return {"pairings": ["lemon"]}
+
+    run_threads(3, lambda: results.append(flights.do("key", slow)))
+    results[1]["pairings"].append("thyme")
+    assert [result["pairings"] for result in results].count(["lemon"]) == 2
+
+def test_waiters_share_the_error():
+    flights = SingleFlight("test")
+    errors = []
+
+    def failing():
+        time.sleep(0.2)
+        raise ValueError("search failed")
+
+    def call():
+        try:
+            flights.do("key", failing)
+        except ValueError as e:
+            errors.append(str(e))
+
+    run_threads(3, call)
+    assert errors == ["search failed"] * 3
+
+def test_calls_are_not_cached_once_completed():
+    flights = SingleFlight("test")
+    assert flights.do("key", lambda: 1) == 1
+    assert flights.do("key", lambda: 2) == 2
+    assert flights.stats()["coalesced"] == 0
+
+def test_a_waiter_runs_the_call_when_the_leader_is_cancelled():
+    flights = SingleFlight("test")
+    executions = []
+
+    async def slow():
+        executions.append(1)
+        await asyncio.sleep(0.2)
+        return "recipe"
+
+    async def main():
+        leader = asyncio.ensure_future(flights.ado("key", slow))
+        await asyncio.sleep(0.05)
+        waiters = [asyncio.ensure_future(flights.ado("key", slow)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(main()) == ["recipe", "recipe"]
+    assert len(executions) == 2
+
+def test_request_key_ignores_spelling_and_preference_order():
+    assert request_key(" Vegan  Lasagna", ["Nut-free", "gluten-free"], "en") == \
+        request_key("vegan lasagna", ["gluten-free", "nut-free"], "en")
+    assert request_key("vegan lasagna", [], "en") != request_key("vegan lasagna", [], "it")
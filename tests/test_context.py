@@ -0,0 +1,44 @@
+from context import BASE_RECIPE_SHARE, compress_context, count_tokens, fit_budget, rank_passages, remove_repeated_text
+from tools import PAIRING_RESULTS_HEADER
+
+def passage(topic, words=60):
+    return f"{topic} " + " ".join(f"{topic}{i}." for i in range(words))
+
+def test_repeated_sentences_and_near_duplicates_are_dropped():
+    shared = "Cook the spaghetti in salted boiling water until al dente."
+    passages = [
+        f"Carbonara needs guanciale. {shared}",
+        f"{shared} Toss with pecorino and eggs.",
+        f"Carbonara needs guanciale. {shared}",
+    ]
+    assert remove_repeated_text(passages) == [
+        f"Carbonara needs guanciale. {shared}",
+        "Toss with pecorino and eggs.",
+    ]
+
+def test_passages_naming_more_ingredients_rank_first():
+    passages = ["Nothing relevant here.", "Lemon and thyme.", "Lemon only."]
+    assert rank_passages(passages, ["lemon", "thyme"]) == [1, 2, 0]
+
+def test_fit_budget_keeps_the_original_order():
+    passages = ["first " * 10, "second " * 10, "third " * 10]
+    budget = count_tokens(passages[0]) + count_tokens(passages[2])
+    assert fit_budget(passages, [2, 0, 1], budget) == [passages[0], passages[2]]
+
+def test_compressed_context_stays_within_budget():
+    base = "\n\n".join(f"**Recipe {i}**\n{passage(f'base{i}')}" for i in range(5))
+    pairings = PAIRING_RESULTS_HEADER + "\n---\n".join(passage(f"pairing{i}") for i in range(8))
+    result = compress_context(base, pairings, ["lemon"], budget=300)
+    # The header and the separators between passages are not part of the budget
+    assert result["stats"]["tokens_after"] <= 300 + count_tokens(PAIRING_RESULTS_HEADER) + 10
+    assert result["stats"]["passages_after"] < result["stats"]["passages_before"]
+    assert result["pairing_results"].startswith(PAIRING_RESULTS_HEADER)
+
+def test_budget_left_by_the_base_recipe_goes_to_the_pairings():
+    pairings = PAIRING_RESULTS_HEADER + "\n---\n".join(passage(f"pairing{i}", 20) for i in range(6))
+    without_base = compress_context(None, pairings, [], budget=300)
+    with_base = compress_context(f"**Recipe**\n{passage('base', 20)}", pairings, [], budget=300)
+    assert without_base["base_recipe"] == ""
+    assert count_tokens(without_base["pairing_results"]) > count_tokens(with_base["pairing_results"])
+    # The base recipe takes less than its share, the pairings get more than theirs
+    assert count_tokens(with_base["pairing_results"]) > 300 * (1 - BASE_RECIPE_SHARE)
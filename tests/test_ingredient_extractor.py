@@ -0,0 +1,43 @@
+from ingredient_extractor import IngredientExtractor
+from pairing_index import PairingIndex
+
+INGREDIENTS = ["bacon", "egg", "hard cheese", "black pepper", "tomato", "cherry", "lemon"]
+
+def make_extractor():
+    pairs = {ingredient: {partner: 0 for partner in INGREDIENTS if partner != ingredient} for ingredient in INGREDIENTS}
+    index = PairingIndex({"names": {ingredient: ingredient.title() for ingredient in INGREDIENTS},
+                          "entries": ["entry"], "pairs": pairs})
+    return IngredientExtractor(index)
+
+def test_matches_longest_names_plurals_and_aliases():
+    matches = make_extractor().matches("Guanciale, eggs, black pepper and cherries")
+    assert [(key, form) for key, form, _ in matches] == [
+        ("bacon", "guanciale"), ("egg", "eggs"), ("black pepper", "black pepper"), ("cherry", "cherries"),
+    ]
+
+def test_recipe_with_repeated_main_ingredients_is_confident():
+    text = (
+        "**Spaghetti carbonara with guanciale**\n"
+        "Fry the guanciale, beat the eggs with pecorino and black pepper. "
+        "Toss the pasta with the eggs, the guanciale and more pecorino, finish with black pepper."
+    )
+    ingredients, confidence = make_extractor().extract(text)
+    assert ingredients[0] == "guanciale"
+    assert set(ingredients) == {"guanciale", "eggs", "pecorino", "black pepper"}
+    assert confidence == 1.0
+
+def test_passing_mentions_give_low_confidence():
+    ingredients, confidence = make_extractor().extract("A quick dinner with tomato, lemon and something else.")
+    assert ingredients == ["tomato", "lemon"]
+    assert confidence == 0.0
+
+def test_confidence_counts_the_supported_ingredients():
+    _, confidence = make_extractor().extract("Lemon cake: lemon zest, lemon juice, eggs, more eggs and a tomato.")
+    assert confidence == 2 / 3
+
+def test_no_ingredient_found():
+    assert make_extractor().extract("Nothing to cook here.") == ([], 0.0)
+
+def test_limit_caps_the_ingredients():
+    ingredients, _ = make_extractor().extract("bacon egg tomato lemon cherry", limit=2)
+    assert ingredients == ["bacon", "egg"]
@@ -0,0 +1,20 @@
+import os
+import pytest
+from pairing_index import INGREDIENT_ALIASES, PairingIndex, missing_alias_targets, pairing_index_path
+
+@pytest.mark.skipif(not os.path.exists(pairing_index_path()), reason="the pairing index has not been built")
+def test_every_alias_points_to_an_indexed_ingredient():
+    index = PairingIndex.load()
+    assert missing_alias_targets(index.pairs) == []
+    for alias, key in INGREDIENT_ALIASES.items():
+        assert index.normalize(alias) == key
+
+@pytest.mark.skipif(not os.path.exists(pairing_index_path()), reason="the pairing index has not been built")
+@pytest.mark.parametrize("query,keys,unmatched", [
+    ("pairings for chicken and rosemary", ["chicken", "rosemary"], []),
+    ("pairings for chicken, yuzu and rosemary", ["chicken", "rosemary"], ["yuzu"]),
+    ("what goes well with goat's cheese and sumac", ["goat cheese"], ["sumac"]),
+    ("yuzu kosho", [], ["yuzu kosho"]),
+])
+def test_match_ingredients_keeps_the_unknown_terms(query, keys, unmatched):
+    assert PairingIndex.load().match_ingredients(query) == (keys, unmatched)
@@ -0,0 +1,38 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import resources
+from cache import RecipeCache
+from prewarm import SuggestionPrewarmer
+
+class LetterEmbeddings:
+    """Counts of a few letters, enough to tell the test requests apart"""
+
+    def embed_query(self, text):
+        return [text.count(letter) + 0.1 for letter in "aeiou"]
+
+class RecipeGraph:
+    """Stands in for the compiled graph, every run produces a recipe"""
+
+    def invoke(self, state):
+        return {**state, "final_recipe": f"Recipe for {state['user_desire']}"}
+
+def cached_suggestion(path, suggestion, language):
+    """Suggestion click as served by another process (job or server worker)"""
+    cached = RecipeCache(LetterEmbeddings(), path=path).get(suggestion, [], language)
+    return cached and cached["final_recipe"]
+
+def test_prewarmed_suggestion_is_served_by_other_processes(tmp_path, monkeypatch):
+    path = str(tmp_path / "recipes.sqlite3")
+    worker_cache = RecipeCache(LetterEmbeddings(), path=path)
+    assert worker_cache.get("Innovative risotto", [], "en") is None
+
+    monkeypatch.setitem(resources._resources, "recipe_cache", RecipeCache(LetterEmbeddings(), path=path))
+    monkeypatch.setitem(resources._resources, "graph", RecipeGraph())
+    prewarmer = SuggestionPrewarmer(suggestions={"en": ["Innovative risotto"]})
+    assert prewarmer.prewarm() == 1
+    assert prewarmer.stats()["coverage"] == 1.0
+
+    assert worker_cache.get("Innovative risotto", [], "en")["final_recipe"] == "Recipe for Innovative risotto"
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        served = pool.submit(cached_suggestion, path, "Innovative risotto", "en").result()
+    assert served == "Recipe for Innovative risotto"
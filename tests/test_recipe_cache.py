@@ -0,0 +1,44 @@
+import time
+from cache import RecipeCache
+
+class LetterEmbeddings:
+    """Counts of a few letters, enough to tell the test requests apart"""
+
+    def embed_query(self, text):
+        return [text.count(letter) + 0.1 for letter in "aeiou"]
+
+def make_cache(max_age):
+    return RecipeCache(LetterEmbeddings(), path=None, max_age=max_age)
+
+def test_serves_recent_recipe():
+    cache = make_cache(max_age=3600)
+    cache.set("Innovative risotto", [], "en", {"final_recipe": "risotto"})
+    assert cache.get("Innovative risotto", [], "en")["final_recipe"] == "risotto"
+
+def test_does_not_serve_recipe_past_max_age():
+    cache = make_cache(max_age=3600)
+    cache.set("Innovative risotto", [], "en", {"final_recipe": "risotto"})
+    cache._db().execute("UPDATE recipe_cache SET created_at = ?", (time.time() - 7200,))
+    assert cache.get("Innovative risotto", [], "en") is None
+    assert cache.stats()["expired"] == 1
+
+    cache.set("Innovative risotto", [], "en", {"final_recipe": "new risotto"})
+    assert cache.get("Innovative risotto", [], "en")["final_recipe"] == "new risotto"
+
+def test_no_max_age():
+    cache = make_cache(max_age=0)
+    cache.set("Innovative risotto", [], "en", {"final_recipe": "risotto"})
+    cache._db().execute("UPDATE recipe_cache SET created_at = 0")
+    assert cache.get("Innovative risotto", [], "en")["final_recipe"] == "risotto"
+
+def test_serves_recipes_stored_by_another_instance(tmp_path):
+    path = str(tmp_path / "recipes.sqlite3")
+    reader = RecipeCache(LetterEmbeddings(), path=path)
+    writer = RecipeCache(LetterEmbeddings(), path=path)
+    assert reader.get("Innovative risotto", [], "en") is None  # the empty partition is loaded
+
+    writer.set("Innovative risotto", [], "en", {"final_recipe": "risotto"})
+    assert reader.get("Innovative risotto", [], "en")["final_recipe"] == "risotto"
+
+    writer.set("Innovative risotto", [], "en", {"final_recipe": "new risotto"})
+    assert reader.get("Innovative risotto", [], "en")["final_recipe"] == "new risotto"
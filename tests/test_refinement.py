@@ -0,0 +1,51 @@
+import pytest
+from refinement import build_turn_input, is_refinement
+
+@pytest.mark.parametrize("text", [
+    "make it vegan",
+    "make it spicier",
+    "Can you make this gluten-free?",
+    "without onions",
+    "for 2 people",
+    "instead of cream use yogurt",
+    "add thyme and basil",
+    "rendila vegana",
+    "senza burro",
+    "per 2 persone",
+    "sans lactose",
+    "sin gluten",
+    "ohne Zwiebeln",
+])
+def test_follow_ups_are_refinements(text):
+    assert is_refinement(text)
+
+@pytest.mark.parametrize("text", [
+    "vegan lasagna",
+    "Gluten-free chocolate cake",
+    "chicken curry for 4",
+    "pasta sin gluten",
+    "Risotto senza burro",
+    "more ideas for dinner",
+    "spaghetti carbonara",
+])
+def test_new_dishes_are_not_refinements(text):
+    assert not is_refinement(text)
+
+def _completed(desire):
+    return {
+        "user_desire": desire,
+        "user_language": "en",
+        "refinements": [],
+        "messages": [],
+        "completed_request": {"user_desire": desire, "refinements": [], "final_recipe": "recipe"},
+    }
+
+def test_new_dish_after_a_recipe_starts_a_new_request():
+    turn_input = build_turn_input("vegan lasagna", [], "en", _completed("spaghetti carbonara"))
+    assert turn_input["user_desire"] == "vegan lasagna"
+    assert turn_input["refinements"] == []
+
+def test_refinement_keeps_the_request():
+    turn_input = build_turn_input("make it vegan", [], "en", _completed("spaghetti carbonara"))
+    assert "user_desire" not in turn_input
+    assert turn_input["refinements"] == ["make it vegan"]
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+import pytest
+import scheduler
+from scheduler import BATCH, INTERACTIVE, RateLimitScheduler, ScheduledChatModel, TokenBucket, backoff_delay, priority
+
+class RateLimitError(Exception):
+    status_code = 429
+
+class Response:
+    def __init__(self, content, total_tokens=None):
+        self.content = content
+        self.usage_metadata = {"total_tokens": total_tokens} if total_tokens else None
+
+class FlakyModel:
+    """Answers after `failures` rate-limit errors"""
+
+    def __init__(self, failures=0, total_tokens=None):
+        self.failures = failures
+        self.total_tokens = total_tokens
+        self.calls = 0
+        self.bound_tools = None
+
+    def invoke(self, messages, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RateLimitError("rate limited")
+        return Response("recipe", self.total_tokens)
+
+    async def ainvoke(self, messages, **kwargs):
+        return self.invoke(messages, **kwargs)
+
+    def bind_tools(self, tools, **kwargs):
+        bound = FlakyModel(self.failures, self.total_tokens)
+        bound.bound_tools = tools
+        return bound
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(scheduler, "BACKOFF_BASE_S", 0.001)
+    monkeypatch.setattr(scheduler, "BACKOFF_MAX_S", 0.01)
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(capacity=10, rate=100)
+    bucket.consume(10)
+    assert bucket.time_until(5) == pytest.approx(0.05, abs=0.01)
+    time.sleep(0.05)
+    assert bucket.time_until(5) == 0.0
+    assert bucket.level() <= 10
+
+def test_acquire_waits_for_the_token_budget():
+    limiter = RateLimitScheduler(requests_per_minute=600, tokens_per_minute=600)  # 10 tokens per second
+    limiter.acquire(600)
+    assert limiter.acquire(3) == pytest.approx(0.3, abs=0.1)
+    assert limiter.stats()["acquired"] == 2
+
+def test_settle_gives_back_unused_tokens():
+    limiter = RateLimitScheduler(requests_per_minute=60, tokens_per_minute=1000)
+    limiter.acquire(800)
+    limiter.settle(800, 100)
+    assert limiter.stats()["available_tokens"] >= 299
+
+def test_interactive_calls_are_served_before_batch_calls():
+    limiter = RateLimitScheduler(requests_per_minute=600, tokens_per_minute=60000)  # one request every 0.1 s
+    limiter.requests.consume(600)
+    served = []
+
+    def call(level, name):
+        limiter.acquire(1, level=level)
+        served.append(name)
+
+    threads = [threading.Thread(target=call, args=(BATCH, "batch"))]
+    threads[0].start()
+    time.sleep(0.02)
+    threads.append(threading.Thread(target=call, args=(INTERACTIVE, "interactive")))
+    threads[1].start()
+    for thread in threads:
+        thread.join()
+    assert served == ["interactive", "batch"]
+
+def test_priority_context_sets_the_level():
+    limiter = RateLimitScheduler()
+    with priority(BATCH):
+        ticket = limiter._enqueue(scheduler.request_priority.get())
+    assert ticket[0] == BATCH
+    assert scheduler.request_priority.get() == INTERACTIVE
+
+def test_rate_limited_calls_are_retried():
+    limiter = RateLimitScheduler()
+    model = ScheduledChatModel(FlakyModel(failures=2, total_tokens=50), limiter)
+    assert model.invoke("a prompt").content == "recipe"
+    stats = limiter.stats()
+    assert (stats["rate_limited"], stats["retries"], stats["acquired"]) == (2, 2, 3)
+
+def test_retries_are_bounded(monkeypatch):
+    monkeypatch.setattr(scheduler, "RATE_LIMIT_MAX_RETRIES", 2)
+    model = ScheduledChatModel(FlakyModel(failures=10), RateLimitScheduler())
+    with pytest.raises(RateLimitError):
+        model.invoke("a prompt")
+    assert model.model.calls == 3
+
+def test_async_calls_are_retried():
+    limiter = RateLimitScheduler()
+    model = ScheduledChatModel(FlakyModel(failures=1), limiter)
+    assert asyncio.run(model.ainvoke("a prompt")).content == "recipe"
+    assert limiter.stats()["retries"] == 1
+
+def test_other_errors_are_not_retried():
+    class BrokenModel(FlakyModel):
+        def invoke(self, messages, **kwargs):
+            raise ValueError("bad request")
+
+    limiter = RateLimitScheduler()
+    with pytest.raises(ValueError):
+        ScheduledChatModel(BrokenModel(), limiter).invoke("a prompt")
+    assert limiter.stats()["retries"] == 0
+
+def test_tool_bound_model_is_scheduled():
+    limiter = RateLimitScheduler()
+    bound = ScheduledChatModel(FlakyModel(failures=1), limiter).bind_tools(["search"])
+    assert isinstance(bound, ScheduledChatModel) and bound.model.bound_tools == ["search"]
+    assert bound.invoke("a prompt").content == "recipe"
+    assert limiter.stats()["retries"] == 1
+
+def test_backoff_honours_retry_after():
+    class Headers:
+        headers = {"retry-after": "2"}
+
+    error = RateLimitError("rate limited")
+    error.response = Headers()
+    assert backoff_delay(0, error) == 2.0
+    assert 0 <= backoff_delay(3) <= scheduler.BACKOFF_MAX_S
@@ -0,0 +1,43 @@
+import time
+from cache import SearchCache
+
+def make_cache(tmp_path, **kwargs):
+    return SearchCache(path=str(tmp_path / "search.sqlite3"), **kwargs)
+
+def test_queries_share_an_entry_across_spellings(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("Carbonara  Recipe", "results")
+    assert cache.get(" carbonara recipe") == "results"
+    assert cache.stats()["hits"] == 1
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = make_cache(tmp_path, ttl=60)
+    cache.set("carbonara", "results")
+    cache._db().execute("UPDATE search_cache SET created_at = ?", (time.time() - 120,))
+    assert cache.get("carbonara") is None
+    assert cache.stats()["entries"] == 0
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = make_cache(tmp_path, max_entries=2)
+    cache.set("carbonara", "a")
+    cache.set("risotto", "b")
+    cache._db().execute("UPDATE search_cache SET accessed_at = accessed_at - 10 WHERE key = 'risotto'")
+    assert cache.get("carbonara") == "a"  # risotto is now the least recently used
+    cache.set("lasagna", "c")
+    assert cache.get("risotto") is None
+    assert cache.get("carbonara") == "a" and cache.get("lasagna") == "c"
+    assert cache.stats()["evictions"] == 1
+
+def test_size_bound_evicts_entries(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=10)
+    cache.set("carbonara", "x" * 8)
+    cache.set("risotto", "y" * 8)
+    assert cache.get("carbonara") is None
+    assert cache.stats()["bytes"] <= 10
+
+def test_bypass_skips_the_cache(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("carbonara", "results", bypass=True)
+    assert cache.get("carbonara") is None
+    cache.set("carbonara", "results")
+    assert cache.get("carbonara", bypass=True) is None
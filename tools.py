@@ -1,49 +1,191 @@
 import os
+import asyncio
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
-from langchain_tavily import TavilySearch
-from langchain_core.tools import tool
-from typing import List, Any, Dict
-from pdf_processor import get_abbinamenti_retriever
+from langchain_core.tools import StructuredTool
+from typing import List, Any, Optional
+from pdf_processor import get_abbinamenti_retriever, multi_query_similarity_search, RETRIEVER_MODE
+from hybrid_retriever import hybrid_search
 from langgraph.prebuilt.tool_node import ToolNode # Import ToolNode
-import streamlit as st 
+from resources import get_llm, get_search_tool, get_resource, get_pairing_index
+from langchain_core.documents import Document
+from instrumentation import get_logger, record_retrieval
 
 load_dotenv()
 
-groq_key= st.secrets["GROQ_API_KEY"]
+logger = get_logger("tools")
 
-llm = ChatGroq( model="llama3-70b-8192", temperature=0.7, api_key=groq_key)
+# "multi" searches the book once per extracted ingredient (batched), "single"
+# runs one search for the combined pairing query
+PAIRING_RETRIEVAL_MODE = os.getenv("PAIRING_RETRIEVAL_MODE", "multi")
+PAIRINGS_PER_INGREDIENT = 3
+MAX_PAIRING_RESULTS = 8
+PAIRING_RESULTS_HEADER = "Results from the book of flavours:\n"
 
-tavily_key = st.secrets["TAVILY_API_KEY"]
+def format_pairing_docs(docs: List[Any]) -> str:
+    """Join the retrieved book passages into the text given to the LLM"""
+    if not docs:
+        return "No pertinent pairing found in the book for the query."
 
-tavily_search_tool = TavilySearch(max_results=5, api_key=tavily_key)
-tavily_search_tool.name = "tavily_search"
-tavily_search_tool.description = "Used to retrieve information about recipes, ingredients and cooking methods or any other general information on the web. Give pertinent result based on the query."
+    results = "\n---\n".join([doc.page_content for doc in docs])
+    return PAIRING_RESULTS_HEADER + results
 
-abbinamenti_retriever = get_abbinamenti_retriever()
+def exact_pairing_docs(ingredient_keys: List[str], per_ingredient: int) -> List[Document]:
+    """Book entries of the parsed pairing index for ingredients known to it"""
+    pairing_index = get_pairing_index()
+    docs = []
+    for key in ingredient_keys:
+        for ingredient, partner, text in pairing_index.lookup(key, partners=ingredient_keys, limit=per_ingredient):
+            docs.append(Document(
+                page_content=f"{ingredient} & {partner}: {text}",
+                metadata={"ingredient": ingredient, "partner": partner}
+            ))
+    return docs
 
-@tool
-def search_food_pairings(query: str) -> str:
+def retrieve_pairing_docs(ingredients: List[str], per_ingredient: int) -> List[Document]:
     """
-    Search the flavours book for suggestions for specific ingredients or combinations.
-    Use this feature when you need to find innovative pairings for a recipe's ingredients.
-    Input: query (string, e.g., "pairings for chicken and rosemary").
+    Book passages for ingredients the pairing index does not know: one batched
+    embedding call and one index search (fused with BM25 in hybrid mode), with
+    the per-ingredient hits interleaved by rank and deduplicated so that every
+    ingredient is represented.
     """
-    print(f"\n--- TOOL CALL: search_food_pairings for : '{query}' ---")
+    if RETRIEVER_MODE == "hybrid":
+        per_ingredient_docs, timings = hybrid_search(ingredients, k=per_ingredient)
+        logger.debug(f"Hybrid retrieval timings (ms): {timings}", extra={"data": {"event": "hybrid_retrieval", **timings}})
+    else:
+        per_ingredient_docs = [
+            [doc for _, doc, _ in hits]
+            for hits in multi_query_similarity_search(ingredients, k=per_ingredient)
+        ]
+    
+    record_retrieval("vector_store", sum(len(ingredient_docs) for ingredient_docs in per_ingredient_docs))
+    
+    docs = []
+    seen_texts = set()
+    for rank in range(per_ingredient):
+        for ingredient_docs in per_ingredient_docs:
+            if rank < len(ingredient_docs) and ingredient_docs[rank].page_content not in seen_texts:
+                seen_texts.add(ingredient_docs[rank].page_content)
+                docs.append(ingredient_docs[rank])
+    return docs
+
+def _exact_pairing_results(query: str) -> Optional[str]:
+    """
+    Answer the query from the pairing index when it names ingredients of the
+    book; its other terms are searched in the book and their passages added.
+    """
+    pairing_index = get_pairing_index()
+    if pairing_index is None:
+        return None
+    
+    keys, unmatched = pairing_index.match_ingredients(query)
+    if not keys:
+        return None
+    
+    per_ingredient = max(1, MAX_PAIRING_RESULTS // (len(keys) + len(unmatched)))
+    docs = exact_pairing_docs(keys, per_ingredient)
+    record_retrieval("pairing_index", len(docs))
+    if unmatched:
+        docs += retrieve_pairing_docs(unmatched, per_ingredient)
+    return format_pairing_docs(docs[:MAX_PAIRING_RESULTS])
+
+def _search_food_pairings(query: str) -> str:
+    logger.info(f"TOOL CALL: search_food_pairings for : '{query}'")
+    try:
+        exact_results = _exact_pairing_results(query)
+        if exact_results is not None:
+            return exact_results
+        docs = get_abbinamenti_retriever().invoke(query)
+        record_retrieval("vector_store", len(docs))
+        return format_pairing_docs(docs)
+    except Exception as e:
+        return f"Error found during the research for the pairings in the book: {e}"
+
+async def _asearch_food_pairings(query: str) -> str:
+    logger.info(f"TOOL CALL: search_food_pairings (async) for : '{query}'")
+    try:
+        exact_results = await asyncio.to_thread(_exact_pairing_results, query)
+        if exact_results is not None:
+            return exact_results
+        docs = await get_abbinamenti_retriever().ainvoke(query)
+        record_retrieval("vector_store", len(docs))
+        return format_pairing_docs(docs)
+    except Exception as e:
+        return f"Error found during the research for the pairings in the book: {e}"
+
+search_food_pairings = StructuredTool.from_function(
+    func=_search_food_pairings,
+    coroutine=_asearch_food_pairings,
+    name="search_food_pairings",
+    description=(
+        "Search the flavours book for suggestions for specific ingredients or combinations. "
+        "Use this feature when you need to find innovative pairings for a recipe's ingredients. "
+        "Input: query (string, e.g., \"pairings for chicken and rosemary\")."
+    )
+)
+
+def search_food_pairings_for_ingredients(ingredients: List[str]) -> str:
+    """
+    Multi-query pairing search. Ingredients with an entry in the pairing index
+    are answered from it directly, the others are searched in the book (see
+    retrieve_pairing_docs).
+    """
+    logger.info(f"search_food_pairings_for_ingredients: {ingredients}")
     try:
-        docs = abbinamenti_retriever.invoke(query)
-        if not docs:
-            return "No pertinent pairing found in the book for the query."
+        pairing_index = get_pairing_index()
+        exact_keys = []
+        remaining = []
+        for ingredient in ingredients:
+            key = pairing_index.normalize(ingredient) if pairing_index is not None else None
+            if key and key not in exact_keys:
+                exact_keys.append(key)
+            elif not key:
+                remaining.append(ingredient)
         
-        results = "\n---\n".join([doc.page_content for doc in docs])
-        return f"Results from the book of flavours:\n{results}"
+        docs = exact_pairing_docs(exact_keys, PAIRINGS_PER_INGREDIENT) if exact_keys else []
+        record_retrieval("pairing_index", len(docs))
+        docs += retrieve_pairing_docs(remaining, PAIRINGS_PER_INGREDIENT)
+        return format_pairing_docs(docs[:MAX_PAIRING_RESULTS])
     except Exception as e:
         return f"Error found during the research for the pairings in the book: {e}"
-    
-tools = [tavily_search_tool, search_food_pairings]
 
-# Ensure llm_with_tools is defined here so it can be imported by nodes.py
-llm_with_tools = llm.bind_tools(tools)
+async def asearch_food_pairings_for_ingredients(ingredients: List[str]) -> str:
+    """Async version of search_food_pairings_for_ingredients"""
+    # The encoder and FAISS release the GIL, so a worker thread keeps the event loop free
+    return await asyncio.to_thread(search_food_pairings_for_ingredients, ingredients)
 
-# Define tool_executor here so it can be imported from tools.py
-tool_executor = ToolNode(tools)
+def merge_pairing_results(*results: Optional[str]) -> str:
+    """
+    Combine formatted pairing results, earlier ones first: passages already
+    present are dropped and the total is capped at MAX_PAIRING_RESULTS.
+    Error and "nothing found" messages contribute nothing.
+    """
+    passages = []
+    for result in results:
+        if not result or not result.startswith(PAIRING_RESULTS_HEADER):
+            continue
+        for passage in result[len(PAIRING_RESULTS_HEADER):].split("\n---\n"):
+            if passage.strip() and passage not in passages:
+                passages.append(passage)
+    return format_pairing_docs([Document(page_content=passage) for passage in passages[:MAX_PAIRING_RESULTS]])
+
+def get_tools() -> List[Any]:
+    return [get_search_tool(), search_food_pairings]
+
+def __getattr__(name: str) -> Any:
+    """
+    Resolve the shared clients lazily from the resource registry, so importing
+    this module no longer loads the FAISS store or reads the API keys.
+    """
+    if name == "llm":
+        return get_llm()
+    if name == "tavily_search_tool":
+        return get_search_tool()
+    if name == "abbinamenti_retriever":
+        return get_abbinamenti_retriever()
+    if name == "tools":
+        return get_tools()
+    if name == "llm_with_tools":
+        return get_resource("llm_with_tools", lambda: get_llm().bind_tools(get_tools()))
+    if name == "tool_executor":
+        return get_resource("tool_executor", lambda: ToolNode(get_tools()))
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")